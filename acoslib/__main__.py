@@ -0,0 +1,5 @@
+import sys
+
+from acoslib.cli import main
+
+sys.exit(main())
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import pathlib
+import tempfile
+import typing
+
+from acoslib.types import ImageFormat
+from acoslib.utils.filelock import flock
+
+
+class ImageRecord(typing.NamedTuple):
+    commit: str
+    version: str | None
+    format: ImageFormat
+    location: pathlib.Path
+    size: int
+    digest: str
+    created: datetime.datetime
+    compressed: pathlib.Path | None = None
+    compressed_digest: str | None = None
+
+    def metadata(self) -> dict:
+        return {
+            "size": self.size,
+            "sha256": self.digest,
+            "compressed": self.compressed,
+            "compressed_sha256": self.compressed_digest,
+        }
+
+    def as_dict(self, image_dir: pathlib.Path) -> dict:
+        return {
+            "commit": self.commit,
+            "version": self.version,
+            "format": self.format.value,
+            "location": str(self.location.relative_to(image_dir)),
+            "size": self.size,
+            "digest": self.digest,
+            "created": self.created.isoformat(),
+            "compressed": str(self.compressed.relative_to(image_dir)) if self.compressed else None,
+            "compressed_digest": self.compressed_digest,
+        }
+
+    @classmethod
+    def from_dict(cls, image_dir: pathlib.Path, data: dict) -> ImageRecord:
+        return cls(commit=data["commit"],
+                   version=data.get("version"),
+                   format=ImageFormat(data["format"]),
+                   location=pathlib.Path(image_dir, data["location"]),
+                   size=data["size"],
+                   digest=data["digest"],
+                   created=datetime.datetime.fromisoformat(data["created"]),
+                   compressed=pathlib.Path(image_dir, data["compressed"]) if data.get("compressed") else None,
+                   compressed_digest=data.get("compressed_digest"))
+
+
+class ImageCatalog:
+    """
+    Каталог собранных образов ветки (images/catalog.json).
+    Хранит для каждого образа коммит, версию, формат, размер и sha256.
+    Файл перезаписывается атомарно под блокировкой, поэтому его можно читать во время сборки других образов.
+    """
+
+    FILENAME = "catalog.json"
+
+    __slots__ = (
+        "_image_dir",
+        "_records",
+    )
+
+    def __init__(self, image_dir: str | os.PathLike) -> None:
+        self._image_dir = pathlib.Path(image_dir)
+        self._records: dict[tuple[ImageFormat, str], ImageRecord] = {}
+        self.reload()
+
+    @property
+    def path(self) -> pathlib.Path:
+        return pathlib.Path(self._image_dir, self.FILENAME)
+
+    @property
+    def lock_path(self) -> pathlib.Path:
+        return pathlib.Path(self._image_dir, f".{self.FILENAME}.lock")
+
+    def reload(self) -> None:
+        self._records = self._load()
+
+    def get(self, img_format: ImageFormat, commit: str) -> ImageRecord | None:
+        """Образ коммита в заданном формате, если его файл еще существует"""
+        record = self._records.get((img_format, commit))
+        return record if record and record.location.exists() else None
+
+    def latest(self, img_format: ImageFormat) -> ImageRecord | None:
+        records = self.all(img_format)
+        return records[-1] if records else None
+
+    def all(self, img_format: ImageFormat | None = None) -> list[ImageRecord]:
+        """Существующие образы (в заданном формате), упорядоченные по времени сборки"""
+        return sorted((record for record in self._records.values()
+                       if (img_format is None or record.format == img_format) and record.location.exists()),
+                      key=lambda record: record.created)
+
+    def add(self, record: ImageRecord) -> ImageRecord:
+        with flock(self.lock_path):
+            self._records = self._load()
+            self._records[(record.format, record.commit)] = record
+            self._dump()
+        return record
+
+    def remove(self, img_format: ImageFormat, commit: str) -> ImageRecord | None:
+        with flock(self.lock_path):
+            self._records = self._load()
+            record = self._records.pop((img_format, commit), None)
+            self._dump()
+        return record
+
+    def _load(self) -> dict[tuple[ImageFormat, str], ImageRecord]:
+        if not self.path.exists():
+            return {}
+
+        with self.path.open() as file:
+            records = [ImageRecord.from_dict(self._image_dir, item) for item in json.load(file)]
+
+        return {(record.format, record.commit): record for record in records}
+
+    def _dump(self) -> None:
+        self._image_dir.mkdir(parents=True, exist_ok=True)
+
+        with tempfile.NamedTemporaryFile("w", dir=self._image_dir, prefix=f".{self.FILENAME}.", delete=False) as file:
+            json.dump([record.as_dict(self._image_dir) for record in self._records.values()], file, indent=2)
+
+        os.chmod(file.name, 0o664)
+        os.replace(file.name, self.path)
@@ -0,0 +1,143 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import typing
+
+from acoslib.utils import lru
+from acoslib.utils.filelock import flock
+
+
+class CheckoutStore:
+    """
+    Общее хранилище checkout'ов коммитов bare-репозитория.
+    Каждый коммит извлекается один раз (жесткими ссылками на объекты репозитория)
+    и служит нижним слоем overlay для всех веток и подветок, собирающихся поверх него.
+    Держатели checkout'а (ветки, чьи roots на него ссылаются) учитываются символическими ссылками
+    в каталоге .holders; удерживаемые checkout'ы не вытесняются.
+    Checkout'ы принадлежат root, поэтому время последнего использования и размер checkout'а
+    хранятся в принадлежащем пользователю файле .usage/<commit>: время модификации файла служит меткой LRU,
+    а содержимое - объемом, который освободится при удалении checkout'а. Размер считается один раз,
+    при первом закреплении checkout'а.
+    Лимит хранилища ограничивает только этот собственный объем checkout'ов (каталоги и файлы, скопированные
+    при извлечении, а не связанные жесткими ссылками): файлы, разделяемые с bare-репозиторием, вытеснение
+    не освобождает, они удаляются только вместе с коммитом (Reference.prune). Для checkout'ов
+    из жестких ссылок собственный объем мал, поэтому лимит срабатывает редко.
+    """
+
+    # Ограничение собственного объема checkout'ов хранилища по умолчанию, байт
+    MAX_SIZE = 20 * 1024 ** 3
+
+    HOLDERS = ".holders"
+    USAGE = ".usage"
+    LOCK = ".lock"
+
+    __slots__ = (
+        "_root",
+        "_max_size",
+    )
+
+    def __init__(self, root: str | os.PathLike, max_size: int = MAX_SIZE) -> None:
+        self._root = pathlib.Path(root)
+        self._max_size = max_size
+
+    @property
+    def root(self) -> pathlib.Path:
+        return self._root
+
+    @property
+    def holders_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._root, self.HOLDERS)
+
+    @property
+    def usage_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._root, self.USAGE)
+
+    def path(self, commit_id: str) -> pathlib.Path:
+        return pathlib.Path(self._root, commit_id)
+
+    def exists(self, commit_id: str) -> bool:
+        return self.path(commit_id).is_dir()
+
+    def lock(self) -> typing.ContextManager[pathlib.Path]:
+        """Блокировка хранилища на время извлечения, учета держателей и вытеснения"""
+        return flock(pathlib.Path(self._root, self.LOCK))
+
+    def holders(self) -> dict[str, str]:
+        """Держатель -> коммит, checkout которого он использует"""
+        if not self.holders_dir.exists():
+            return {}
+
+        return {link.name: os.readlink(link) for link in self.holders_dir.iterdir()}
+
+    def refcount(self, commit_id: str) -> int:
+        return sum(1 for held in self.holders().values() if held == commit_id)
+
+    def hold(self, holder: str, commit_id: str) -> pathlib.Path:
+        """
+        Отмечает checkout коммита как используемый держателем и как недавно использованный.
+        Предыдущий checkout держателя при этом освобождается.
+        """
+        self.holders_dir.mkdir(parents=True, exist_ok=True)
+
+        link = pathlib.Path(self.holders_dir, holder)
+        tmp_link = link.with_name(f".{holder}.{os.getpid()}")
+        tmp_link.unlink(missing_ok=True)
+        tmp_link.symlink_to(commit_id)
+        tmp_link.replace(link)
+
+        lru.touch(self._usage_file(commit_id))
+        return self.path(commit_id)
+
+    def release(self, holder: str) -> None:
+        pathlib.Path(self.holders_dir, holder).unlink(missing_ok=True)
+
+    def usage(self, commit_id: str) -> tuple[float, int]:
+        """
+        Время последнего использования и собственный объем checkout'а.
+        Checkout без файла учета (извлеченный до его появления или оставшийся после сбоя между извлечением
+        и hold) считается самым давним.
+        """
+        usage_file = pathlib.Path(self.usage_dir, commit_id)
+        try:
+            return usage_file.stat().st_mtime, int(usage_file.read_text())
+        except (OSError, ValueError):
+            return 0.0, lru.exclusive_usage(self.path(commit_id))
+
+    def forget(self, commit_id: str) -> None:
+        """Удаляет учет использования checkout'а (после удаления самого checkout'а)"""
+        pathlib.Path(self.usage_dir, commit_id).unlink(missing_ok=True)
+
+    def evict(self, remove: typing.Callable[[pathlib.Path], None] | None = None) -> list[pathlib.Path]:
+        """
+        Вытесняет давно не использованные checkout'ы без держателей, пока хранилище превышает лимит.
+        :param remove: функция удаления дерева (checkout'ы принадлежат root)
+        """
+        removed = lru.evict(self._root,
+                            self._max_size,
+                            keep=set(self.holders().values()),
+                            remove=remove,
+                            usage=lambda path: self.usage(path.name))
+
+        for path in removed:
+            self.forget(path.name)
+
+        return removed
+
+    def _usage_file(self, commit_id: str) -> pathlib.Path:
+        """
+        Файл учета использования checkout'а; создается при первом обращении
+        с размером checkout'а и временем его извлечения.
+        """
+        usage_file = pathlib.Path(self.usage_dir, commit_id)
+        if usage_file.exists():
+            return usage_file
+
+        self.usage_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = usage_file.with_name(f".{commit_id}.{os.getpid()}")
+        tmp_file.write_text(str(lru.exclusive_usage(self.path(commit_id))))
+        mtime = self.path(commit_id).lstat().st_mtime
+        os.utime(tmp_file, (mtime, mtime))
+        tmp_file.replace(usage_file)
+
+        return usage_file
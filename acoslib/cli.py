@@ -0,0 +1,203 @@
+"""
+Командная строка acoslib.
+
+    python -m acoslib [опции] <команда> <ветка> ...
+
+Пути берутся из тех же переменных окружения, что и у сценариев (STREAMS_ROOT, SCRIPTS_ROOT,
+MKIMAGE_PROFILES_ROOT), либо из опций. Запросы к индексу и каталогу образов не загружают libostree
+(--no-sync), поэтому выполняются быстро; сборочные команды загружают ее при первом обращении к репозиторию.
+Функция main годится как точка входа console_scripts.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import typing
+
+if typing.TYPE_CHECKING:
+    from acoslib import models
+
+
+def _repository(args: argparse.Namespace) -> models.Repository:
+    from acoslib import models
+
+    for option in ("stream_root", "script_root"):
+        if not getattr(args, option):
+            raise SystemExit(f"--{option.replace('_', '-')} (or its environment variable) must be set")
+
+    return models.Repository(args.osname,
+                             root=args.root,
+                             stream_root=args.stream_root,
+                             script_root=args.script_root,
+                             mkimage_root=args.mkimage_root or "")
+
+
+def _reference(args: argparse.Namespace) -> models.Reference:
+    from acoslib import models
+
+    repository = _repository(args)
+    if args.ref.count("/") == 3:
+        return models.SubReference.from_ostree(repository, args.ref)
+    return models.Reference.from_ostree(repository, args.ref)
+
+
+def _print(args: argparse.Namespace, rows: list[dict], columns: tuple[str, ...]) -> None:
+    if args.json:
+        print(json.dumps(rows, default=str, indent=2))
+        return
+
+    for row in rows:
+        print("\t".join("" if row.get(column) is None else str(row[column]) for column in columns))
+
+
+def cmd_ref(args: argparse.Namespace) -> None:
+    ref = _reference(args)
+    _print(args, [{"ref": ref.ostree_ref,
+                   "ref_dir": ref.repository.stream_root / ref.ostree_ref_dir,
+                   "repo_dir": ref.repo_dir,
+                   "archive_repo_dir": ref.archive_repo_dir,
+                   "image_dir": ref.image_dir}],
+           ("ref", "ref_dir", "repo_dir", "archive_repo_dir", "image_dir"))
+
+
+def cmd_commits(args: argparse.Namespace) -> None:
+    from acoslib import models
+    from acoslib.index import CommitIndex
+
+    ref = _reference(args)
+    index = CommitIndex(ref.index_path) if args.no_sync else models.Commit(ref).index()
+
+    with index:
+        rows = index.by_prefix(args.prefix) if args.prefix else index.by_date()
+
+    rows = rows[-args.limit:] if args.limit else rows
+    _print(args, rows, ("sha256", "version", "date"))
+
+
+def cmd_images(args: argparse.Namespace) -> None:
+    from acoslib.catalog import ImageCatalog
+    from acoslib.types import ImageFormat
+
+    ref = _reference(args)
+    catalog = ImageCatalog(ref.image_dir)
+    records = catalog.all(ImageFormat(args.format) if args.format else None)
+
+    _print(args, [record.as_dict(ref.image_dir) for record in records],
+           ("format", "version", "commit", "size", "location"))
+
+
+def cmd_build(args: argparse.Namespace) -> None:
+    from acoslib.types import ImageFormat
+
+    ref = _reference(args)
+    scheduler = ref.repository.plan([ref],
+                                    [ImageFormat(fmt) for fmt in args.images],
+                                    workers=args.workers,
+                                    update=args.update)
+    scheduler.run()
+
+    tasks, total = scheduler.critical_path()
+    logging.info(f"critical path {total:.1f}s :: {' -> '.join(task.name for task in tasks)}")
+
+
+def cmd_update(args: argparse.Namespace) -> None:
+    _reference(args).update()
+
+
+def cmd_publish(args: argparse.Namespace) -> None:
+    published = _reference(args).publish()
+    _print(args, [{"ref": ref, "commits": len(commits)} for ref, commits in published.items()], ("ref", "commits"))
+
+
+def cmd_prune(args: argparse.Namespace) -> None:
+    from acoslib.prune import RetentionPolicy
+
+    policy = RetentionPolicy(keep_last=args.keep_last,
+                             keep_newer_than=datetime.timedelta(days=args.keep_days) if args.keep_days else None)
+    report = _reference(args).prune(policy, dry_run=args.dry_run)
+
+    if args.json:
+        print(json.dumps(report.as_dict(), default=str, indent=2))
+        return
+
+    _print(args, [{"item": item, "bytes": size} for item, size in (("repo", report.repo_bytes),
+                                                                   ("vars", report.vars_bytes),
+                                                                   ("roots", report.roots_bytes),
+                                                                   ("images", report.images_bytes),
+                                                                   ("total", report.total_bytes))],
+           ("item", "bytes"))
+
+
+def parser() -> argparse.ArgumentParser:
+    root = argparse.ArgumentParser(prog="acoslib", description="ALT Container OS repository tool")
+    root.add_argument("--osname", default="altcos")
+    root.add_argument("--root", default=os.getcwd())
+    root.add_argument("--stream-root", default=os.environ.get("STREAMS_ROOT"))
+    root.add_argument("--script-root", default=os.environ.get("SCRIPTS_ROOT"))
+    root.add_argument("--mkimage-root", default=os.environ.get("MKIMAGE_PROFILES_ROOT"))
+    root.add_argument("--json", action="store_true", help="print results as JSON")
+    root.add_argument("--trace", metavar="FILE", help="write build spans as JSON lines")
+    root.add_argument("-v", "--verbose", action="store_true")
+
+    commands = root.add_subparsers(dest="command", required=True)
+
+    def command(name: str, func: typing.Callable, help: str) -> argparse.ArgumentParser:
+        sub = commands.add_parser(name, help=help)
+        sub.add_argument("ref", help="altcos/x86_64/sisyphus or altcos/x86_64/sisyphus/<subref>")
+        sub.set_defaults(func=func)
+        return sub
+
+    command("ref", cmd_ref, "show reference paths")
+
+    sub = command("commits", cmd_commits, "list commits of the reference")
+    sub.add_argument("--prefix", help="only commits whose sha256 starts with the prefix")
+    sub.add_argument("--limit", type=int, default=0, help="only the last N commits")
+    sub.add_argument("--no-sync", action="store_true", help="read the commit index without touching the repo")
+
+    sub = command("images", cmd_images, "list built images from the image catalog")
+    sub.add_argument("--format", choices=["qcow2", "raw"])
+
+    sub = command("build", cmd_build, "build the reference (and its base) and optionally images")
+    sub.add_argument("--images", nargs="*", default=[], choices=["qcow2", "raw"])
+    sub.add_argument("--workers", type=int, default=4)
+    sub.add_argument("--update", action="store_true",
+                     help="update packages of the base reference first; nothing is rebuilt if they did not change")
+
+    command("update", cmd_update, "update packages of the base reference and commit them if they changed")
+    command("publish", cmd_publish, "publish new commits into the archive repo")
+
+    sub = command("prune", cmd_prune, "remove commits, vars, roots and images outside the retention policy")
+    sub.add_argument("--keep-last", type=int, help="keep the last N commits")
+    sub.add_argument("--keep-days", type=float, help="keep commits newer than N days")
+    sub.add_argument("--dry-run", action="store_true", help="only report reclaimable bytes")
+
+    return root
+
+
+def main(argv: typing.Sequence[str] | None = None) -> int:
+    args = parser().parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    exporter = None
+    if args.trace:
+        from acoslib import tracing
+        exporter = tracing.add_exporter(tracing.JsonLinesExporter(args.trace))
+
+    try:
+        args.func(args)
+    finally:
+        if exporter is not None:
+            from acoslib import tracing
+            tracing.remove_exporter(exporter)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
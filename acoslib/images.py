@@ -1,23 +1,45 @@
 from __future__ import annotations
 
 import abc
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import logging
 import os
 import pathlib
+import shutil
+import tempfile
+import typing
 
-from acoslib import models
+from acoslib import tracing
+from acoslib.catalog import ImageCatalog, ImageRecord
 from acoslib.types import ImageFormat
-from acoslib.utils import cmdlib
+from acoslib.utils import cmdlib, lru
+from acoslib.utils import compress as compression
+
+if typing.TYPE_CHECKING:
+    from acoslib import models
+
+# Запас при вычислении размера диска образа: множитель к объему содержимого и фиксированная добавка, байт
+ROOT_SIZE_FACTOR = 1.5
+ROOT_SIZE_HEADROOM = 1024 ** 3
 
 
 class ImageItem:
     __slots__ = (
         "_location",
         "_format",
+        "_metadata",
     )
 
-    def __init__(self, location: str | os.PathLike, img_format: models.ImageFormat) -> None:
+    def __init__(self,
+                 location: str | os.PathLike,
+                 img_format: ImageFormat,
+                 metadata: dict | None = None) -> None:
         self._location = pathlib.Path(location)
         self._format = img_format
+        self._metadata = metadata or {}
 
         if not self._location.exists():
             raise FileExistsError(f"image item {self._location} not exists")
@@ -30,24 +52,128 @@ class ImageItem:
     def format(self) -> ImageFormat:
         return self._format
 
+    @property
+    def metadata(self) -> dict:
+        """Размер, sha256 и (если образ сжимался) путь и sha256 сжатой копии"""
+        return self._metadata
+
 
 class BaseImage(abc.ABC):
+    FORMAT: ImageFormat
+
     @classmethod
-    @abc.abstractmethod
-    def create(cls, reference: models.Reference, commit_id: Commit) -> BaseImage:
-        raise NotImplementedError
+    def create(cls,
+               reference: models.Reference,
+               commit: models.Commit,
+               force: bool = False,
+               compress: str | None = None) -> BaseImage:
+        """
+        Собирает образ коммита.
+        Если образ этого коммита уже есть в каталоге, он возвращается без пересборки (если не задан force).
+        :param compress: кодек (zstd, xz) для сжатой копии образа, создаваемой за тот же проход, что и sha256
+        """
+        return create_many(reference, commit, [cls], force, compress)[cls.FORMAT]
+
+    @classmethod
+    async def acreate(cls,
+                      reference: models.Reference,
+                      commit: models.Commit,
+                      force: bool = False,
+                      compress: str | None = None) -> BaseImage:
+        return (await acreate_many(reference, commit, [cls], force, compress))[cls.FORMAT]
+
+    @classmethod
+    def compress(cls, reference: models.Reference, commit: models.Commit, codec: str = "zstd") -> BaseImage:
+        """Сжимает уже собранный образ коммита и обновляет его запись в каталоге"""
+        record = cls.catalog(reference).get(cls.FORMAT, commit.sha256)
+        if record is None:
+            raise FileNotFoundError(f"{cls.FORMAT.value} image of commit {commit.sha256} not found")
+
+        return cls.from_record(cls._register(reference, commit, record.location, codec))
 
     @classmethod
-    @abc.abstractmethod
     def all(cls, reference: models.Reference) -> list[BaseImage]:
+        """Образы каталога формата, упорядоченные по времени изменения (последний - самый новый)"""
+        img_dir = cls.image_dir(reference)
+
+        if not img_dir.exists():
+            raise FileNotFoundError(f"directory {img_dir} not found")
+
+        img_list = sorted(img_dir.glob(f"*.{cls.FORMAT.value}"), key=lambda img: img.stat().st_mtime)
+
+        return [cls.from_item(ImageItem(img, cls.FORMAT)) for img in img_list]
+
+    @classmethod
+    @abc.abstractmethod
+    def from_item(cls, item: ImageItem) -> BaseImage:
         raise NotImplementedError
 
     @abc.abstractmethod
     def items(self) -> dict[str, ImageItem]:
         raise NotImplementedError
 
+    @classmethod
+    def from_record(cls, record: ImageRecord) -> BaseImage:
+        return cls.from_item(ImageItem(record.location, cls.FORMAT, record.metadata()))
+
+    @classmethod
+    def image_dir(cls, reference: models.Reference) -> pathlib.Path:
+        return pathlib.Path(reference.image_dir, cls.FORMAT.value)
+
+    @classmethod
+    def catalog(cls, reference: models.Reference) -> ImageCatalog:
+        return ImageCatalog(reference.image_dir)
+
+    @classmethod
+    def find(cls, reference: models.Reference, commit: models.Commit) -> BaseImage | None:
+        """Уже собранный образ коммита"""
+        record = cls.catalog(reference).get(cls.FORMAT, commit.sha256)
+        return cls.from_record(record) if record else None
+
+    @classmethod
+    def latest(cls, reference: models.Reference) -> BaseImage | None:
+        record = cls.catalog(reference).latest(cls.FORMAT)
+        return cls.from_record(record) if record else None
+
+    @classmethod
+    def _location(cls, reference: models.Reference, commit: models.Commit) -> pathlib.Path:
+        img_dir = cls.image_dir(reference)
+        img_dir.mkdir(parents=True, exist_ok=True)
+
+        return pathlib.Path(img_dir, f"{commit.version or commit.sha256}.{cls.FORMAT.value}")
+
+    @classmethod
+    def _register(cls,
+                  reference: models.Reference,
+                  commit: models.Commit,
+                  location: pathlib.Path,
+                  codec: str | None = None) -> ImageRecord:
+        """
+        Вносит образ в каталог.
+        sha256 и сжатая копия (если задан codec) получаются за одно чтение образа.
+        """
+        compressed = location.with_name(location.name + compression.suffix(codec)) if codec else None
+        with tracing.span("image.register", ref=str(reference.ostree_ref), format=cls.FORMAT.value, codec=codec):
+            digest, compressed_digest = compression.digest_and_compress(location, compressed, codec or "zstd")
+
+        return cls.catalog(reference).add(ImageRecord(commit=commit.sha256,
+                                                      version=commit.version,
+                                                      format=cls.FORMAT,
+                                                      location=location,
+                                                      size=location.stat().st_size,
+                                                      digest=digest,
+                                                      created=datetime.datetime.now(datetime.timezone.utc),
+                                                      compressed=compressed,
+                                                      compressed_digest=compressed_digest))
+
+    @classmethod
+    def _export_cmd(cls, reference: models.Reference, raw_file: pathlib.Path, location: pathlib.Path) -> str:
+        return (f"sudo -E {reference.repository.script_root}/cmd_export_image.sh "
+                f"{cls.FORMAT.value} {raw_file} {location}")
+
 
 class QcowImage(BaseImage):
+    FORMAT = ImageFormat.QCOW
 
     __slots__ = (
         "_disk",
@@ -57,25 +183,185 @@ class QcowImage(BaseImage):
         self._disk = disk
 
     @classmethod
-    def create(cls, reference: models.Reference, commit: Commit) -> BaseImage:
-        cmdlib.runcmd(
-            cmd=f"sudo -E {reference.repository.script_root}/cmd_make_qcow2.sh {reference.ostree_ref} {commit.sha256}")
-        return QcowImage.all(reference)[-1]
+    def create(cls,
+               reference: models.Reference,
+               commit: models.Commit,
+               force: bool = False,
+               compress: str | None = None,
+               direct: bool = False) -> BaseImage:
+        """
+        :param direct: разворачивать коммит сразу в qcow2 через qemu-nbd, без промежуточного raw-диска
+        """
+        if not direct:
+            return super().create(reference, commit, force, compress)
+
+        if not force and (image := cls.find(reference, commit)):
+            return image
+
+        location = cls._location(reference, commit)
+        cmdlib.runcmd(_deploy_cmd(reference, commit, location), stream=True)
+        return cls.from_record(cls._register(reference, commit, location, compress))
+
+    @classmethod
+    async def acreate(cls,
+                      reference: models.Reference,
+                      commit: models.Commit,
+                      force: bool = False,
+                      compress: str | None = None,
+                      direct: bool = False) -> BaseImage:
+        if not direct:
+            return await super().acreate(reference, commit, force, compress)
+
+        if not force and (image := cls.find(reference, commit)):
+            return image
+
+        location = cls._location(reference, commit)
+        await cmdlib.arun(_deploy_cmd(reference, commit, location),
+                          resources=(cmdlib.LOOP_DEVICE, cmdlib.ROOT),
+                          stream=True)
+        record = await asyncio.to_thread(cls._register, reference, commit, location, compress)
+        return cls.from_record(record)
 
     @classmethod
-    def all(cls, reference: models.Reference) -> list[BaseImage]:
-        qcow_dir = pathlib.Path(reference.image_dir, ImageFormat.QCOW.value)
+    def from_item(cls, item: ImageItem) -> BaseImage:
+        return QcowImage(item)
 
-        if not qcow_dir.exists():
-            raise FileNotFoundError(f"directory {qcow_dir} not found")
+    def items(self) -> dict[str, ImageItem]:
+        return {"disk": self._disk}
 
-        img_list = []
 
-        for img in qcow_dir.glob(f"*.{ImageFormat.QCOW.value}"):
-            img_list.append(QcowImage(ImageItem(img, ImageFormat.QCOW)))
+class RawImage(BaseImage):
+    FORMAT = ImageFormat.RAW
 
-        return img_list
+    __slots__ = (
+        "_disk",
+    )
+
+    def __init__(self, disk: ImageItem) -> None:
+        self._disk = disk
+
+    @classmethod
+    def from_item(cls, item: ImageItem) -> BaseImage:
+        return RawImage(item)
 
     def items(self) -> dict[str, ImageItem]:
         return {"disk": self._disk}
 
+
+def _pending(reference: models.Reference,
+             commit: models.Commit,
+             image_types: typing.Iterable[type[BaseImage]],
+             force: bool) -> tuple[dict[ImageFormat, BaseImage], list[type[BaseImage]]]:
+    ready, pending = {}, []
+    for image_type in image_types:
+        if not force and (image := image_type.find(reference, commit)):
+            logging.info(f"image {image.items()['disk'].location} already exists")
+            ready[image_type.FORMAT] = image
+        else:
+            pending.append(image_type)
+    return ready, pending
+
+
+@contextlib.contextmanager
+def _scratch_dir(reference: models.Reference) -> typing.Iterator[pathlib.Path]:
+    reference.image_dir.mkdir(parents=True, exist_ok=True)
+    scratch = pathlib.Path(tempfile.mkdtemp(dir=reference.image_dir, prefix=".deploy-"))
+    try:
+        yield scratch
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def root_size(commit: models.Commit) -> int:
+    """
+    Размер диска для развертывания коммита: объем дерева коммита и его var с запасом
+    на метаданные файловой системы, копии ядра в /boot и первую загрузку.
+    """
+    payload = commit.content_size() + lru.disk_usage(commit.var_dir)
+    size = int(payload * ROOT_SIZE_FACTOR) + ROOT_SIZE_HEADROOM
+
+    return -(-size // 1024 ** 2) * 1024 ** 2
+
+
+def _deploy_cmd(reference: models.Reference, commit: models.Commit, target: pathlib.Path) -> str:
+    return (f"ROOT_SIZE={root_size(commit)} sudo -E {reference.repository.script_root}/cmd_deploy_sysroot.sh "
+            f"{reference.ostree_ref} {commit.sha256} {target}")
+
+
+@tracing.traced("image.create_many")
+def create_many(reference: models.Reference,
+                commit: models.Commit,
+                image_types: typing.Iterable[type[BaseImage]],
+                force: bool = False,
+                compress: str | None = None,
+                direct: bool = False) -> dict[ImageFormat, BaseImage]:
+    """
+    Собирает образы коммита в нескольких форматах.
+    Коммит развертывается в sysroot на временном raw-диске один раз,
+    затем диск параллельно экспортируется во все недостающие форматы.
+    Каждый образ читается один раз: при этом считается его sha256 и (если задан compress) пишется сжатая копия.
+    :param direct: если собирается только qcow2, разворачивать коммит сразу в него через qemu-nbd
+        (для нескольких форматов raw-диск нужен все равно, и direct не используется)
+    """
+    images, pending = _pending(reference, commit, image_types, force)
+    if not pending:
+        return images
+
+    if direct and pending == [QcowImage]:
+        images[ImageFormat.QCOW] = QcowImage.create(reference, commit, True, compress, direct=True)
+        return images
+
+    with _scratch_dir(reference) as scratch:
+        raw_file = pathlib.Path(scratch, "disk.raw")
+        with tracing.span("image.deploy", ref=str(reference.ostree_ref)), tracing.script_phases() as trace_env:
+            cmdlib.runcmd(trace_env + _deploy_cmd(reference, commit, raw_file), stream=True)
+
+        @tracing.propagate
+        def export(image_type: type[BaseImage]) -> BaseImage:
+            location = image_type._location(reference, commit)
+            with tracing.span("image.export", ref=str(reference.ostree_ref), format=image_type.FORMAT.value):
+                cmdlib.runcmd(image_type._export_cmd(reference, raw_file, location), stream=True)
+            return image_type.from_record(image_type._register(reference, commit, location, compress))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(pending)) as executor:
+            for image in executor.map(export, pending):
+                images[image.FORMAT] = image
+
+    return images
+
+
+@tracing.traced("image.create_many")
+async def acreate_many(reference: models.Reference,
+                       commit: models.Commit,
+                       image_types: typing.Iterable[type[BaseImage]],
+                       force: bool = False,
+                       compress: str | None = None,
+                       direct: bool = False) -> dict[ImageFormat, BaseImage]:
+    images, pending = _pending(reference, commit, image_types, force)
+    if not pending:
+        return images
+
+    if direct and pending == [QcowImage]:
+        images[ImageFormat.QCOW] = await QcowImage.acreate(reference, commit, True, compress, direct=True)
+        return images
+
+    with _scratch_dir(reference) as scratch:
+        raw_file = pathlib.Path(scratch, "disk.raw")
+        with tracing.span("image.deploy", ref=str(reference.ostree_ref)), tracing.script_phases() as trace_env:
+            await cmdlib.arun(trace_env + _deploy_cmd(reference, commit, raw_file),
+                              resources=(cmdlib.LOOP_DEVICE, cmdlib.ROOT),
+                              stream=True)
+
+        async def export(image_type: type[BaseImage]) -> BaseImage:
+            location = image_type._location(reference, commit)
+            with tracing.span("image.export", ref=str(reference.ostree_ref), format=image_type.FORMAT.value):
+                await cmdlib.arun(image_type._export_cmd(reference, raw_file, location),
+                                  resources=(cmdlib.ROOT,),
+                                  stream=True)
+            record = await asyncio.to_thread(image_type._register, reference, commit, location, compress)
+            return image_type.from_record(record)
+
+        for image in await asyncio.gather(*[export(image_type) for image_type in pending]):
+            images[image.FORMAT] = image
+
+    return images
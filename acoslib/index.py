@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import datetime
+import json
+import os
+import pathlib
+import sqlite3
+import typing
+
+
+class Version(typing.NamedTuple):
+    """Версия коммита вида `<stream>.<date>.<major>.<minor>`"""
+    stream: str
+    date: str
+    major: int
+    minor: int
+
+    @classmethod
+    def parse(cls, version: str) -> Version | None:
+        parts = version.lower().split(".") if version else []
+        if len(parts) != 4 or not (parts[2].isdigit() and parts[3].isdigit()):
+            return None
+        return cls(parts[0], parts[1], int(parts[2]), int(parts[3]))
+
+    @property
+    def var_subdir(self) -> pathlib.Path:
+        """Каталог vars/<date>/<major>/<minor> версии (аналог version_var_subdir в functions.sh)"""
+        return pathlib.Path(self.date, str(self.major), str(self.minor))
+
+    def __str__(self) -> str:
+        return f"{self.stream}.{self.date}.{self.major}.{self.minor}"
+
+
+class CommitIndex:
+    """
+    Персистентный индекс коммитов ветки.
+    Хранится в SQLite-базе в каталоге ветки и пополняется инкрементально:
+    новые коммиты дописываются при обходе истории от головы до первого уже известного коммита.
+    Там же ведется реестр версий ветки: версия <-> коммит <-> каталог vars.
+    Следующая версия выделяется в транзакции с блокировкой записи, поэтому параллельные сборки не получат одну версию.
+    """
+
+    FILENAME = "commits.db"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS commits (
+            sha256 TEXT PRIMARY KEY,
+            parent_id TEXT,
+            version TEXT,
+            date INTEGER NOT NULL,
+            metadata TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS commits_version ON commits (version);
+        CREATE INDEX IF NOT EXISTS commits_date ON commits (date);
+        CREATE TABLE IF NOT EXISTS versions (
+            version TEXT PRIMARY KEY,
+            date TEXT NOT NULL,
+            major INTEGER NOT NULL,
+            minor INTEGER NOT NULL,
+            sha256 TEXT UNIQUE
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS versions_number ON versions (date, major, minor);
+    """
+
+    # Даты коммитов ostree хранятся с точностью до секунды; коммиты одной секунды упорядочиваются по версии
+    _SELECT = "SELECT commits.* FROM commits LEFT JOIN versions ON versions.sha256 = commits.sha256"
+    _ORDER = "commits.date {0}, versions.date {0}, versions.major {0}, versions.minor {0}"
+
+    __slots__ = (
+        "_path",
+        "_conn",
+    )
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self._path = pathlib.Path(path)
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._conn = sqlite3.connect(self._path, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self._SCHEMA)
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self) -> CommitIndex:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def contains(self, sha256: str) -> bool:
+        cur = self._conn.execute("SELECT 1 FROM commits WHERE sha256 = ?", (sha256,))
+        return cur.fetchone() is not None
+
+    def add(self, rows: typing.Iterable[dict]) -> int:
+        """
+        Добавляет коммиты в индекс одной транзакцией.
+        :param rows: словари с ключами sha256, parent_id, version, date, metadata
+        :return: количество добавленных записей
+        """
+        rows = [self._to_row(row) for row in rows]
+        with self._conn:
+            cur = self._conn.executemany(
+                "INSERT OR REPLACE INTO commits (sha256, parent_id, version, date, metadata) "
+                "VALUES (:sha256, :parent_id, :version, :date, :metadata)",
+                rows)
+            count = cur.rowcount
+
+            for row in rows:
+                if version := Version.parse(row["version"]):
+                    self._bind(version, row["sha256"])
+
+        return count
+
+    def remove(self, sha256s: typing.Iterable[str]) -> int:
+        """
+        Удаляет коммиты из индекса (после очистки истории ветки).
+        Записи реестра версий сохраняются, чтобы версии удаленных коммитов не выделялись повторно.
+        """
+        with self._conn:
+            cur = self._conn.executemany("DELETE FROM commits WHERE sha256 = ?", ((sha256,) for sha256 in sha256s))
+        return cur.rowcount
+
+    def get(self, sha256: str) -> dict | None:
+        cur = self._conn.execute("SELECT * FROM commits WHERE sha256 = ?", (sha256,))
+        row = cur.fetchone()
+        return self._from_row(row) if row else None
+
+    def by_prefix(self, prefix: str) -> list[dict]:
+        """Поиск по префиксу sha256 (диапазонный запрос по первичному ключу)"""
+        prefix = prefix.lower()
+        cur = self._conn.execute(
+            f"{self._SELECT} WHERE commits.sha256 >= ? AND commits.sha256 < ? ORDER BY {self._ORDER.format('ASC')}",
+            (prefix, prefix + "~"))
+        return [self._from_row(row) for row in cur]
+
+    def by_version(self, version: str) -> list[dict]:
+        cur = self._conn.execute(f"{self._SELECT} WHERE commits.version = ? ORDER BY {self._ORDER.format('ASC')}",
+                                 (version,))
+        return [self._from_row(row) for row in cur]
+
+    def by_date(self,
+                since: datetime.datetime | None = None,
+                until: datetime.datetime | None = None) -> list[dict]:
+        """Коммиты в полуинтервале [since, until), упорядоченные по дате"""
+        since_ts = int(since.timestamp()) if since else 0
+        until_ts = int(until.timestamp()) if until else 2 ** 63 - 1
+        cur = self._conn.execute(
+            f"{self._SELECT} WHERE commits.date >= ? AND commits.date < ? ORDER BY {self._ORDER.format('ASC')}",
+            (since_ts, until_ts))
+        return [self._from_row(row) for row in cur]
+
+    def last(self) -> dict | None:
+        cur = self._conn.execute(f"{self._SELECT} ORDER BY {self._ORDER.format('DESC')} LIMIT 1")
+        row = cur.fetchone()
+        return self._from_row(row) if row else None
+
+    def allocate_version(self, stream: str, date: str, major: int | None = None) -> Version:
+        """
+        Резервирует следующую свободную версию.
+        :param major: номер сборки внутри даты; без него выделяется новый major (с minor = 0),
+                      иначе - следующий minor для date.major
+        """
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            if major is None:
+                cur = self._conn.execute("SELECT MAX(major) FROM versions WHERE date = ?", (date,))
+                last = cur.fetchone()[0]
+                version = Version(stream, date, 0 if last is None else last + 1, 0)
+            else:
+                cur = self._conn.execute("SELECT MAX(minor) FROM versions WHERE date = ? AND major = ?",
+                                         (date, major))
+                last = cur.fetchone()[0]
+                version = Version(stream, date, major, 0 if last is None else last + 1)
+
+            self._bind(version, None)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+        return version
+
+    def release_version(self, version: Version) -> None:
+        """Освобождает зарезервированную, но так и не закоммиченную версию"""
+        with self._conn:
+            self._conn.execute("DELETE FROM versions WHERE version = ? AND sha256 IS NULL", (str(version),))
+
+    def version_of(self, sha256: str) -> Version | None:
+        cur = self._conn.execute("SELECT version FROM versions WHERE sha256 = ?", (sha256,))
+        row = cur.fetchone()
+        return Version.parse(row["version"]) if row else None
+
+    def commit_of(self, version: str | Version) -> str | None:
+        cur = self._conn.execute("SELECT sha256 FROM versions WHERE version = ?", (str(version).lower(),))
+        row = cur.fetchone()
+        return row["sha256"] if row else None
+
+    def _bind(self, version: Version, sha256: str | None) -> None:
+        self._conn.execute(
+            "INSERT INTO versions (version, date, major, minor, sha256) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (version) DO UPDATE SET sha256 = COALESCE(excluded.sha256, sha256)",
+            (str(version), version.date, version.major, version.minor, sha256))
+
+    @staticmethod
+    def _to_row(row: dict) -> dict:
+        return {
+            "sha256": row["sha256"],
+            "parent_id": row.get("parent_id"),
+            "version": row.get("version"),
+            "date": int(row["date"].timestamp()),
+            "metadata": json.dumps(row.get("metadata") or {}, default=str),
+        }
+
+    @staticmethod
+    def _from_row(row: sqlite3.Row) -> dict:
+        return {
+            "sha256": row["sha256"],
+            "parent_id": row["parent_id"],
+            "version": row["version"],
+            "date": datetime.datetime.fromtimestamp(row["date"], tz=datetime.timezone.utc),
+            "metadata": json.loads(row["metadata"]),
+        }
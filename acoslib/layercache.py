@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import typing
+
+import yaml
+
+from acoslib.utils import lru
+
+
+class LayerCache:
+    """
+    Кэш промежуточных слоев сборки подветки.
+    После каждого действия altconf изменения верхнего слоя overlay (roots/upper) с предыдущего действия
+    сохраняются инкрементальным архивом tar (--listed-incremental): слой хранит только изменения своего действия,
+    а снимок состояния (layer.snar) служит основой архива следующего действия.
+    Ключ слоя - родительский коммит, хеш дерева root подветки и хеш всех действий до текущего включительно,
+    поэтому повторная сборка продолжается с самого глубокого слоя, для которого совпали входные данные
+    и префикс действий. Для восстановления слоя нужны все слои до него.
+    """
+
+    # Ограничение размера кэша по умолчанию, байт
+    MAX_SIZE = 20 * 1024 ** 3
+
+    ARCHIVE = "layer.tar"
+    SNAPSHOT = "layer.snar"
+    ENV = "env.json"
+
+    __slots__ = (
+        "_root",
+        "_max_size",
+    )
+
+    def __init__(self, root: str | os.PathLike, max_size: int = MAX_SIZE) -> None:
+        self._root = pathlib.Path(root)
+        self._max_size = max_size
+
+    @property
+    def root(self) -> pathlib.Path:
+        return self._root
+
+    @staticmethod
+    def keys(parent_id: str, actions: list[dict], root_hash: str | None = None) -> list[str]:
+        """
+        Ключи слоев для каждого префикса списка действий.
+        :param root_hash: хеш дерева root подветки (его читают действия, например butane)
+        """
+        digest = hashlib.sha256(parent_id.encode())
+        digest.update((root_hash or "").encode())
+        keys = []
+        for action in actions:
+            digest.update(yaml.safe_dump(action, sort_keys=True).encode())
+            keys.append(digest.copy().hexdigest())
+        return keys
+
+    def layer_dir(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self._root, key)
+
+    def archive(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.layer_dir(key), self.ARCHIVE)
+
+    def snapshot(self, key: str) -> pathlib.Path:
+        return pathlib.Path(self.layer_dir(key), self.SNAPSHOT)
+
+    def lookup(self, key: str) -> dict | None:
+        """
+        Возвращает окружение, сохраненное вместе со слоем, если слой есть в кэше.
+        Найденный слой отмечается как использованный.
+        """
+        env_file = pathlib.Path(self.layer_dir(key), self.ENV)
+        if not (self.archive(key).exists() and env_file.exists()):
+            return None
+
+        lru.touch(self.layer_dir(key))
+        return json.loads(env_file.read_text())
+
+    def deepest(self, keys: list[str]) -> tuple[int, dict] | None:
+        """Индекс самого глубокого слоя, все слои до которого есть в кэше, и его окружение"""
+        found = None
+        for i, key in enumerate(keys):
+            if (env := self.lookup(key)) is None:
+                break
+            found = i, env
+        return found
+
+    def prepare(self, key: str) -> pathlib.Path:
+        """Создает каталог слоя и возвращает путь, по которому нужно записать архив"""
+        self.layer_dir(key).mkdir(parents=True, exist_ok=True)
+        return self.archive(key)
+
+    def commit(self, key: str, env: dict[str, typing.Any]) -> None:
+        """Фиксирует записанный слой; окружение пишется последним и служит признаком готовности слоя"""
+        env_file = pathlib.Path(self.layer_dir(key), self.ENV)
+        tmp_file = env_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(env))
+        tmp_file.replace(env_file)
+
+    def evict(self, keep: typing.Container[str] = ()) -> list[pathlib.Path]:
+        return lru.evict(self._root, self._max_size, keep)
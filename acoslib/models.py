@@ -1,23 +1,35 @@
 from __future__ import annotations
 
+import asyncio
+import concurrent.futures
+import contextlib
 import datetime
+import itertools
+import logging
 import os
 import pathlib
-import re
+import shlex
 import subprocess
+import sys
 import tempfile
+import time
 import typing
 
-import gi
 import yaml
 
-gi.require_version("OSTree", "1.0")
-
-from gi.repository import OSTree, Gio
-
 from acoslib.types import Arch, Stream, ImageFormat
-from acoslib.images import QcowImage, BaseImage
-from acoslib.utils import cmdlib
+from acoslib.images import QcowImage, RawImage, BaseImage, create_many, acreate_many
+from acoslib.index import CommitIndex, Version
+from acoslib.catalog import ImageCatalog, ImageRecord
+from acoslib.prune import PruneReport, RetentionPolicy, reclaimable
+from acoslib.layercache import LayerCache
+from acoslib.checkouts import CheckoutStore
+from acoslib import tracing
+from acoslib.scheduler import Scheduler, Task
+from acoslib.utils import cmdlib, fingerprint, lru
+from acoslib.utils.shell import ShellSession, CommandResult
+from acoslib.utils.filelock import flock, aflock
+from acoslib.utils.lazygi import OSTree, Gio, GLib
 
 
 class Repository:
@@ -32,6 +44,7 @@ class Repository:
         "_stream_root",
         "_script_root",
         "_mkimage_root",
+        "_pkg_mirror",
     )
 
     def __init__(self,
@@ -39,12 +52,17 @@ class Repository:
                  root: str | os.PathLike,
                  stream_root: str | os.PathLike,
                  script_root: str | os.PathLike,
-                 mkimage_root: str | os.PathLike) -> None:
+                 mkimage_root: str | os.PathLike,
+                 pkg_mirror: str | os.PathLike | None = None) -> None:
+        """
+        :param pkg_mirror: локальный apt-репозиторий, из которого ставятся пакеты вместо сетевых источников
+        """
         self._osname = osname
         self._root = pathlib.Path(root)
         self._stream_root = pathlib.Path(stream_root)
         self._script_root = pathlib.Path(script_root)
         self._mkimage_root = pathlib.Path(mkimage_root)
+        self._pkg_mirror = pathlib.Path(pkg_mirror) if pkg_mirror else None
 
     @property
     def osname(self) -> str:
@@ -66,6 +84,70 @@ class Repository:
     def mkimage_root(self) -> pathlib.Path:
         return self._mkimage_root
 
+    @property
+    def pkg_mirror(self) -> pathlib.Path | None:
+        return self._pkg_mirror
+
+    @property
+    def layer_cache_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._stream_root, ".cache", "layers")
+
+    @property
+    def pkg_cache_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._stream_root, ".cache", "rpms")
+
+    @property
+    def image_cache_dir(self) -> pathlib.Path:
+        """Кэш блобов и архивов контейнерных образов для действия podman"""
+        return pathlib.Path(self._stream_root, ".cache", "images")
+
+    def plan(self,
+             refs: typing.Iterable[Reference],
+             formats: typing.Iterable[ImageFormat] = (),
+             workers: int = 4,
+             update: bool = False) -> Scheduler:
+        """
+        Строит граф сборки: базовая ветка -> подветки -> образы.
+        Базовая ветка создается, только если ее bare-репозиторий еще не существует.
+        Для каждой (под)ветки собираются образы всех указанных форматов из ее последнего коммита
+        (одно развертывание sysroot на ветку).
+        Каждая задача выполняется под блокировкой своей ветки.
+        :param refs: базовые ветки и подветки; базовые ветки подветок добавляются автоматически
+        :param workers: число одновременно выполняемых задач
+        :param update: обновить пакеты существующих базовых веток (Reference.update); если пакеты не изменились,
+                       новый коммит не создается и подветки с образами не пересобираются
+        """
+        scheduler = Scheduler(workers)
+        formats = list(formats)
+        bases: dict[pathlib.Path, Task] = {}
+        refs = list(refs)
+
+        def base_task(ref: Reference) -> Task:
+            base = Reference(self, ref.arch, ref.stream)
+            if base.ostree_ref not in bases:
+                bases[base.ostree_ref] = scheduler.add(
+                    Task(str(base.ostree_ref), lambda: base._build_base(update), lock=base.lock))
+                add_images(base, bases[base.ostree_ref])
+            return bases[base.ostree_ref]
+
+        def add_images(ref: Reference, dep: Task) -> None:
+            if formats:
+                scheduler.add(Task(f"{ref.ostree_ref}:images",
+                                   lambda ref=ref: ref._build_images(formats),
+                                   deps=(dep,),
+                                   lock=ref.lock))
+
+        for ref in refs:
+            if not isinstance(ref, SubReference):
+                base_task(ref)
+
+        for ref in refs:
+            if isinstance(ref, SubReference):
+                task = scheduler.add(Task(str(ref.ostree_ref), ref.create, deps=(base_task(ref),), lock=ref.lock))
+                add_images(ref, task)
+
+        return scheduler
+
 
 class BareRepoExistsError(Exception):
     pass
@@ -80,12 +162,14 @@ class Reference:
         "_repository",
         "_arch",
         "_stream",
+        "_ostree_repo",
     )
 
     def __init__(self, repository: Repository, arch: Arch, stream: Stream) -> None:
         self._repository = repository
         self._arch = arch
         self._stream = stream
+        self._ostree_repo = None
 
     @property
     def repository(self) -> Repository:
@@ -125,6 +209,44 @@ class Reference:
                             self._stream.value,
                             "bare", "repo")
 
+    @property
+    def ostree_repo(self) -> OSTree.Repo:
+        """
+        Открытый bare-репозиторий ветки.
+        Репозиторий открывается один раз и переиспользуется всеми операциями над веткой.
+        """
+        if self._ostree_repo is None:
+            repo = OSTree.Repo.new(Gio.File.new_for_path(str(self.repo_dir)))
+            repo.open(None)
+            self._ostree_repo = repo
+        return self._ostree_repo
+
+    @property
+    def checkout_store_dir(self) -> pathlib.Path:
+        """Общее хранилище checkout'ов; лежит рядом с bare-репозиторием, чтобы checkout'ы были жесткими ссылками"""
+        return pathlib.Path(self.repo_dir.parent.parent, "checkouts")
+
+    @property
+    def checkout_store(self) -> CheckoutStore:
+        return CheckoutStore(self.checkout_store_dir)
+
+    @property
+    def archive_repo_dir(self) -> pathlib.Path:
+        """archive-репозиторий, из которого клиенты получают обновления"""
+        return pathlib.Path(self._repository.stream_root,
+                            self._repository.osname,
+                            self._arch.value,
+                            self._stream.value,
+                            "archive", "repo")
+
+    @property
+    def index_path(self) -> pathlib.Path:
+        return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, CommitIndex.FILENAME)
+
+    @property
+    def merged_dir(self) -> pathlib.Path:
+        return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, "roots", "merged")
+
     @property
     def image_dir(self) -> pathlib.Path:
         return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, "images")
@@ -134,21 +256,64 @@ class Reference:
         return pathlib.Path(self.repository.stream_root, self.ostree_baseref, "mkimage-profiles")
 
     @property
-    def version(self, commit_id: str = None) -> str:
-        if not commit_id:
-            date, major, minor = datetime.datetime.now().strftime("%Y%m%d"), 0, 0
-        else:
-            vars_path = pathlib.Path(self.repository.stream_root, self.ostree_ref, "vars")
-            commit_link = pathlib.Path(vars_path, commit_id)
+    def stream_name(self) -> str:
+        """Префикс версий ветки: поток и (для подветок) имя подветки, например `sisyphus_k8s`"""
+        path = str(self.ostree_ref).lower().split('/')
+        return '_'.join(path[2:])
+
+    @property
+    def version(self) -> str | None:
+        """Версия головного коммита ветки"""
+        head = Commit(self).latest()
+        return head.version if head else None
 
-            link_target = commit_link.readlink()
+    def version_of(self, commit_id: str) -> Version | None:
+        """Версия коммита по реестру версий ветки (без обхода каталога vars)"""
+        with Commit(self).index() as index:
+            return index.version_of(commit_id)
 
-            date, major, minor = link_target[:3]
+    def next_version(self, parent: Commit | None = None, date: str | None = None) -> Version:
+        """
+        Резервирует версию для нового коммита ветки.
+        От родителя с версией date.major.minor наследуются date и major, minor увеличивается;
+        без родителя выделяется новый major для date (по умолчанию - сегодняшней).
+        """
+        parent_version = Version.parse(parent.version) if parent else None
 
-        path = str(self.ostree_ref).lower().split('/')
-        stream = '_'.join(path[2:])
+        with Commit(self).index() as index:
+            if parent_version:
+                return index.allocate_version(self.stream_name, parent_version.date, parent_version.major)
+            return index.allocate_version(self.stream_name, date or datetime.datetime.now().strftime("%Y%m%d"))
 
-        return f"{stream}.{date}.{major}.{minor}"
+    @contextlib.contextmanager
+    def reserve_version(self, parent: Commit | None = None, date: str | None = None) -> typing.Iterator[Version]:
+        """Резервирует версию на время сборки коммита и освобождает ее, если сборка завершилась ошибкой"""
+        version = self.next_version(parent, date)
+        try:
+            yield version
+        except BaseException:
+            self._release_version(version)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def areserve_version(self,
+                               parent: Commit | None = None,
+                               date: str | None = None) -> typing.AsyncIterator[Version]:
+        """Асинхронный вариант reserve_version: обращения к индексу (sqlite) выполняются в отдельном потоке"""
+        version = await asyncio.to_thread(self.next_version, parent, date)
+        try:
+            yield version
+        except BaseException:
+            await asyncio.to_thread(self._release_version, version)
+            raise
+
+    def _release_version(self, version: Version) -> None:
+        with CommitIndex(self.index_path) as index:
+            index.release_version(version)
+
+    def _refresh_index(self) -> None:
+        """Дописывает в индекс коммиты, появившиеся после сборки"""
+        Commit(self).index().close()
 
     @classmethod
     def from_ostree(cls, repository: Repository, ostree_ref: str, **extra) -> Reference:
@@ -158,57 +323,502 @@ class Reference:
 
         return cls(repository, Arch(parts[1]), Stream(parts[2]))
 
+    @property
+    def lock_path(self) -> pathlib.Path:
+        return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, ".lock")
+
+    def lock(self) -> typing.ContextManager[pathlib.Path]:
+        """
+        Межпроцессная блокировка каталога ветки на время сборочной операции.
+        Ее берут сборки (create, update) и очистка (prune); повторный захват внутри удерживаемой блокировки
+        (например, сборка в задаче Repository.plan) не ждет.
+        """
+        return flock(self.lock_path)
+
+    def alock(self) -> typing.AsyncContextManager[pathlib.Path]:
+        return aflock(self.lock_path)
+
     def ostree_repo_exists(self) -> bool:
-        repo_dir = str(self.repo_dir)
         try:
-            OSTree.Repo.new(Gio.File.new_for_path(repo_dir)).open(None)
-        except gi.repository.GLib.GError:
+            self.ostree_repo
+        except GLib.GError:
             return False
         return True
 
+    @tracing.traced("reference.clear_roots")
     def clear_roots(self) -> Reference:
-        cmdlib.runcmd(f"{self.repository.script_root}/cmd_clear_roots.sh {self.ostree_ref}")
+        cmdlib.runcmd(self._clear_roots_cmd())
+        self.checkout_store.release(self._checkout_holder)
+        return self
+
+    @tracing.traced("reference.clear_roots")
+    async def aclear_roots(self) -> Reference:
+        await cmdlib.arun(self._clear_roots_cmd(), resources=(cmdlib.ROOT,))
+        await asyncio.to_thread(self.checkout_store.release, self._checkout_holder)
         return self
 
+    @tracing.traced("reference.checkout")
     def checkout(self, commit_id: str) -> Reference:
-        cmdlib.runcmd(f"{self.repository.script_root}/cmd_ostree_checkout.sh {self.ostree_ref} {commit_id}")
+        self._hold_checkout(commit_id)
+        cmdlib.runcmd(self._checkout_cmd(commit_id))
+        return self
+
+    @tracing.traced("reference.checkout")
+    async def acheckout(self, commit_id: str) -> Reference:
+        await asyncio.to_thread(self._hold_checkout, commit_id)
+        await cmdlib.arun(self._checkout_cmd(commit_id), resources=(cmdlib.ROOT,))
+        return self
+
+    @tracing.traced("reference.sync")
+    def sync(self, commit_id: str, version: str, incremental: bool = False) -> Reference:
+        """
+        Переносит var верхнего слоя в vars и готовит дерево к коммиту.
+        :param incremental: оставить изменения в roots/upper для commit(..., incremental=True)
+                            вместо копирования их в checkout
+        """
+        cmdlib.runcmd(self._sync_cmd(commit_id, version, incremental), stream=True)
         return self
 
-    def sync(self, commit_id: str, version: str) -> Reference:
-        cmdlib.runcmd(f"{self.repository.script_root}/cmd_sync_updates.sh "
-                      f"{self.ostree_ref} {commit_id} {version}")
+    @tracing.traced("reference.sync")
+    async def async_updates(self, commit_id: str, version: str, incremental: bool = False) -> Reference:
+        """Асинхронный вариант sync (cmd_sync_updates.sh); имя async зарезервировано языком"""
+        await cmdlib.arun(self._sync_cmd(commit_id, version, incremental), resources=(cmdlib.ROOT,), stream=True)
         return self
 
+    @tracing.traced("reference.rootfs2repo")
     def rootfs2repo(self) -> Reference:
-        cmdlib.runcmd(f"sudo -E {self.repository.script_root}/cmd_rootfs2repo.sh {self.ostree_ref}")
+        with self.reserve_version(date=self._rootfs_date()) as version:
+            cmdlib.runcmd(self._rootfs2repo_cmd(version), stream=True)
+        self._refresh_index()
+        return self
+
+    @tracing.traced("reference.rootfs2repo")
+    async def arootfs2repo(self) -> Reference:
+        async with self.areserve_version(date=self._rootfs_date()) as version:
+            await cmdlib.arun(self._rootfs2repo_cmd(version), resources=(cmdlib.ROOT,), stream=True)
+        await asyncio.to_thread(self._refresh_index)
+        return self
+
+    @tracing.traced("reference.commit")
+    def commit(self,
+               commit_id: str,
+               version: Version | None = None,
+               build_fingerprint: str | None = None,
+               incremental: bool = False) -> Reference:
+        """
+        Коммитит подготовленное дерево поверх commit_id.
+        :param version: зарезервированная версия (reserve_version); без нее версия выделяется здесь
+        :param incremental: строить коммит из дерева commit_id и изменений roots/upper (acoslib.ostreecommit),
+                            не перехешируя checkout целиком; требует sync(..., incremental=True)
+        """
+        if version is None:
+            with self.reserve_version(Commit(self).load(commit_id)) as version:
+                return self.commit(commit_id, version, build_fingerprint, incremental)
+
+        cmdlib.runcmd(self._commit_cmd(commit_id, version, build_fingerprint, incremental))
+        self.checkout_store.release(self._checkout_holder)
+        self._refresh_index()
         return self
 
-    def commit(self, commit_id: str) -> Reference:
-        cmdlib.runcmd(
-            f"{self.repository.script_root}/cmd_ostree_commit.sh {self.ostree_ref} {commit_id} {self.version}")
+    @tracing.traced("reference.commit")
+    async def acommit(self,
+                      commit_id: str,
+                      version: Version | None = None,
+                      build_fingerprint: str | None = None,
+                      incremental: bool = False) -> Reference:
+        if version is None:
+            parent = await asyncio.to_thread(Commit(self).load, commit_id)
+            async with self.areserve_version(parent) as version:
+                return await self.acommit(commit_id, version, build_fingerprint, incremental)
+
+        await cmdlib.arun(self._commit_cmd(commit_id, version, build_fingerprint, incremental),
+                          resources=(cmdlib.ROOT,))
+        await asyncio.to_thread(self.checkout_store.release, self._checkout_holder)
+        await asyncio.to_thread(self._refresh_index)
         return self
 
+    @tracing.traced("reference.create")
     def create(self) -> Reference:
-        if not self.mkimage_dir.exists():
-            raise ImageProfileExistsError(
-                f"Image profile for {self.ostree_ref} not exists. Use `mkprofile` method firstly")
+        with self.lock():
+            self._check_mkimage_dir()
+            return self.rootfs2repo()
 
-        return self.rootfs2repo()
+    @tracing.traced("reference.create")
+    async def acreate(self) -> Reference:
+        async with self.alock():
+            self._check_mkimage_dir()
+            return await self.arootfs2repo()
 
+    @tracing.traced("reference.update")
     def update(self) -> Reference:
-        last_commit = Commit(self).all()[-1]
-        self.clear_roots().checkout(last_commit.sha256)
-        RPM(self).update().upgrade().update_kernel()
-        return self
+        """
+        Обновляет пакеты и ядро головного коммита ветки и коммитит результат.
+        Отпечаток набора пакетов rpmdb и ядра (RPM.digest) хранится в метаданных коммита; если он совпадает
+        с отпечатком головного коммита, sync и commit пропускаются и голова ветки не меняется,
+        поэтому подветки (SubReference.up_to_date) и образы (каталог образов) не пересобираются.
+        """
+        with self.lock():
+            last_commit = Commit(self).latest()
+            self.clear_roots().checkout(last_commit.sha256)
+
+            rpm = RPM(self).update().upgrade().update_kernel()
+            rpm.evict_cache()
+
+            if self._up_to_date(last_commit, rpm):
+                return self.clear_roots()
+
+            with self.reserve_version(last_commit) as version:
+                return self.sync(last_commit.sha256, str(version), incremental=True) \
+                    .commit(last_commit.sha256, version, rpm.digest(), incremental=True)
+
+    @tracing.traced("reference.update")
+    async def aupdate(self) -> Reference:
+        async with self.alock():
+            last_commit = await asyncio.to_thread(Commit(self).latest)
+            await self.aclear_roots()
+            await self.acheckout(last_commit.sha256)
+
+            rpm = RPM(self)
+            await rpm.aupdate()
+            await rpm.aupgrade()
+            await rpm.aupdate_kernel()
+            await asyncio.to_thread(rpm.evict_cache)
+
+            if await asyncio.to_thread(self._up_to_date, last_commit, rpm):
+                return await self.aclear_roots()
+
+            async with self.areserve_version(last_commit) as version:
+                await self.async_updates(last_commit.sha256, str(version), incremental=True)
+                return await self.acommit(last_commit.sha256, version, rpm.digest(), incremental=True)
+
+    def static_deltas(self) -> set[str]:
+        """Имена уже сгенерированных static-delta (`from-to` или `to` для дельт с нуля)"""
+        repo = self.ostree_repo
+        repo.reload_config(None)
+        _, names = repo.list_static_delta_names(None)
+        return set(names)
+
+    @tracing.traced("reference.generate_deltas")
+    def generate_deltas(self, window: int = 1, from_scratch: bool = True, workers: int = 4) -> list[str]:
+        """
+        Генерирует static-delta для обновления клиентов.
+        :param window: число последних пар соседних коммитов (родитель -> потомок), для которых строятся дельты
+        :param from_scratch: построить также дельту с нуля для головного коммита
+        :param workers: число одновременно генерируемых дельт
+        Уже существующие дельты пропускаются, summary обновляется один раз в конце.
+        :return: имена сгенерированных дельт
+        """
+        pending = self._pending_deltas(window, from_scratch)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda delta: cmdlib.runcmd(self._delta_cmd(*delta), stream=True), pending))
+
+        if pending:
+            cmdlib.runcmd(self._summary_cmd())
+
+        return [self._delta_name(*delta) for delta in pending]
+
+    @tracing.traced("reference.generate_deltas")
+    async def agenerate_deltas(self, window: int = 1, from_scratch: bool = True) -> list[str]:
+        pending = await asyncio.to_thread(self._pending_deltas, window, from_scratch)
+
+        await asyncio.gather(*[cmdlib.arun(self._delta_cmd(*delta), resources=(cmdlib.ROOT,), stream=True)
+                               for delta in pending])
+
+        if pending:
+            await cmdlib.arun(self._summary_cmd(), resources=(cmdlib.ROOT,))
+
+        return [self._delta_name(*delta) for delta in pending]
 
+    @tracing.traced("reference.publish")
+    def publish(self, refs: typing.Iterable[Reference] = ()) -> dict[str, list[str]]:
+        """
+        Переносит новые коммиты ветки (и веток refs того же bare-репозитория) в archive-репозиторий.
+        Копируются только объекты коммитов, появившихся после опубликованной головы ветки,
+        summary перегенерируется один раз на всю пачку.
+        Archive-репозиторий, как и bare, принадлежит root и доступен остальным только на чтение
+        (его раздает веб-сервер), поэтому изменяется через sudo.
+        :return: опубликованные коммиты по веткам (от новых к старым)
+        """
+        if not self.archive_repo_dir.exists():
+            cmdlib.runcmd(f"sudo install -d -o root -g root -m 0755 {self.archive_repo_dir}")
+            cmdlib.runcmd(f"sudo ostree init --repo={self.archive_repo_dir} --mode=archive")
+
+        published = {}
+        for ref in (self, *refs):
+            if commits := ref._unpublished():
+                cmdlib.runcmd(ref._publish_cmd(len(commits)), stream=True)
+                published[str(ref.ostree_ref)] = commits
+
+        if published:
+            cmdlib.runcmd(f"sudo ostree summary --repo={self.archive_repo_dir} --update")
+
+        return published
+
+    @tracing.traced("reference.prune")
+    def prune(self, policy: RetentionPolicy, dry_run: bool = False, workers: int = 4) -> PruneReport:
+        """
+        Очищает ветку по политике хранения: удаляет коммиты, не попавшие в политику, вместе с их каталогами vars,
+        образами и checkout'ами общего хранилища, roots поверх удаляемого коммита и каталоги vars без коммитов,
+        затем недостижимые объекты bare-репозитория.
+        Выполняется под блокировкой ветки, поэтому не пересекается с ее сборками;
+        независимые деревья (репозиторий, vars, образы, хранилище checkout'ов) очищаются параллельно.
+        :param dry_run: только оценить освобождаемый объем, ничего не удаляя
+        """
+        with self.lock():
+            commits = self._own_commits()
+            keep = policy.keep(commits)
+            kept = [commit.sha256 for commit in commits[:keep]]
+            pruned = [commit.sha256 for commit in commits[keep:]]
+
+            var_paths = self._prunable_vars(pruned)
+            records = self._prunable_images(pruned)
+            image_paths = [path for record in records for path in (record.location, record.compressed) if path]
+            checkouts = [commit_id for commit_id in pruned
+                         if self.checkout_store.exists(commit_id) and not self.checkout_store.refcount(commit_id)]
+            roots_dir = self.merged_dir.parent
+            stale_roots = any(pathlib.Path(roots_dir, commit_id).exists() for commit_id in pruned)
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                objects = executor.submit(reclaimable, self.ostree_repo, kept, pruned)
+                var_sizes = executor.map(lru.disk_usage, var_paths)
+                image_sizes = executor.map(lru.disk_usage, image_paths)
+                roots_size = executor.submit(lru.disk_usage, roots_dir) if stale_roots else None
+
+                report = PruneReport(ref=str(self.ostree_ref),
+                                     dry_run=dry_run,
+                                     kept=kept,
+                                     pruned=pruned,
+                                     objects=objects.result()[0],
+                                     repo_bytes=objects.result()[1],
+                                     vars=var_paths,
+                                     vars_bytes=sum(var_sizes),
+                                     roots_bytes=roots_size.result() if roots_size else 0,
+                                     images=image_paths,
+                                     images_bytes=sum(image_sizes),
+                                     checkouts=checkouts)
+
+            if dry_run:
+                return report
+
+            if stale_roots:
+                self.clear_roots()
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self._remove_images, records),
+                           executor.submit(self._remove_checkouts, checkouts)]
+                if pruned:
+                    futures.append(executor.submit(cmdlib.runcmd, self._prune_cmd(pruned)))
+                if var_paths:
+                    futures.append(executor.submit(cmdlib.runcmd, self._remove_cmd(var_paths)))
+
+                for future in futures:
+                    future.result()
+
+            if pruned:
+                with CommitIndex(self.index_path) as index:
+                    index.remove(pruned)
+
+        logging.info(f"{self.ostree_ref} pruned {len(pruned)} commits, {report.total_bytes} bytes")
+        return report
+
+    @tracing.traced("reference.mkprofile")
     def mkprofile(self) -> Reference:
-        cmdlib.runcmd(
-            f"{self.repository.script_root}/cmd_mkimage-profiles.sh "
-            f"{self.stream.value} "
-            f"{self.arch.value}"
-        )
+        cmdlib.runcmd(self._mkprofile_cmd())
         return self
 
+    @tracing.traced("reference.mkprofile")
+    async def amkprofile(self) -> Reference:
+        await cmdlib.arun(self._mkprofile_cmd(), resources=(cmdlib.NETWORK,))
+        return self
+
+    def _build_base(self, update: bool = False) -> Reference:
+        if self.ostree_repo_exists():
+            return self.update() if update else self
+        return self.mkprofile().create()
+
+    def _up_to_date(self, last_commit: Commit, rpm: RPM) -> bool:
+        """Набор пакетов и ядро после обновления совпадают с головным коммитом"""
+        if rpm.digest() != last_commit.metadata.get(Commit.FINGERPRINT_KEY):
+            return False
+
+        logging.info(f"{self.ostree_ref} packages are up to date :: {last_commit.sha256}")
+        return True
+
+    def _build_images(self, formats: list[ImageFormat]) -> dict[ImageFormat, BaseImage]:
+        return Image(self).create_many(formats, Commit(self).latest())
+
+    def _unpublished(self) -> list[str]:
+        archive = OSTree.Repo.new(Gio.File.new_for_path(str(self.archive_repo_dir)))
+        archive.open(None)
+        _, published_head = archive.resolve_rev(str(self.ostree_ref), True)
+
+        commits = []
+        for commit in Commit(self).iter():
+            if commit.sha256 == published_head:
+                break
+            commits.append(commit.sha256)
+
+        return commits
+
+    def _own_commits(self) -> list[Commit]:
+        """Коммиты ветки от головы к корню; обход останавливается на первом коммите с версией другой ветки"""
+        commits = []
+        for commit in Commit(self).iter():
+            version = Version.parse(commit.version)
+            if version and version.stream != self.stream_name:
+                break
+            commits.append(commit)
+
+        return commits
+
+    def _prunable_vars(self, pruned: list[str]) -> list[pathlib.Path]:
+        """
+        Ссылки vars/<commit> удаляемых коммитов и каталоги vars/<date>/<major>/<minor>,
+        на которые не ссылается ни один оставшийся коммит.
+        """
+        vars_dir = pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, "vars")
+        if not vars_dir.exists():
+            return []
+
+        pruned = set(pruned)
+        links = [entry for entry in vars_dir.iterdir() if entry.is_symlink()]
+        paths = [link for link in links if link.name in pruned]
+        used = {os.path.normpath(os.readlink(link)) for link in links if link.name not in pruned}
+
+        for date_dir in vars_dir.iterdir():
+            if date_dir.is_symlink() or not date_dir.name.isdigit():
+                continue
+            for version_dir in date_dir.glob("*/*"):
+                if version_dir.is_dir() and str(version_dir.relative_to(vars_dir)) not in used:
+                    paths.append(version_dir)
+
+        return paths
+
+    def _prunable_images(self, pruned: list[str]) -> list[ImageRecord]:
+        pruned = set(pruned)
+        return [record for record in ImageCatalog(self.image_dir).all() if record.commit in pruned]
+
+    def _remove_images(self, records: list[ImageRecord]) -> None:
+        catalog = ImageCatalog(self.image_dir)
+        for record in records:
+            catalog.remove(record.format, record.commit)
+
+        if paths := [path for record in records for path in (record.location, record.compressed) if path]:
+            cmdlib.runcmd(self._remove_cmd(paths))
+
+    def _remove_checkouts(self, commit_ids: list[str]) -> None:
+        store = self.checkout_store
+
+        with store.lock():
+            for commit_id in commit_ids:
+                if store.exists(commit_id) and not store.refcount(commit_id):
+                    cmdlib.runcmd(self._store_cmd("remove", store.root, commit_id))
+                    store.forget(commit_id)
+
+    def _prune_cmd(self, commit_ids: list[str]) -> str:
+        # Модуль acoslib.prune запускается через sudo тем же интерпретатором
+        return (f"sudo env PYTHONPATH={pathlib.Path(__file__).resolve().parent.parent} "
+                f"{sys.executable} -m acoslib.prune --repo={self.repo_dir} "
+                f"{' '.join(f'--delete-commit={commit_id}' for commit_id in commit_ids)}")
+
+    @staticmethod
+    def _remove_cmd(paths: typing.Iterable[pathlib.Path]) -> str:
+        return f"sudo rm -rf {' '.join(map(str, paths))}"
+
+    def _publish_cmd(self, depth: int) -> str:
+        # depth считается от головы: 0 - только головной коммит
+        return (f"sudo ostree pull-local --repo={self.archive_repo_dir} --depth={depth - 1} "
+                f"{self.repo_dir} {self.ostree_ref}")
+
+    def _pending_deltas(self, window: int, from_scratch: bool) -> list[tuple[str | None, str]]:
+        commits = list(itertools.islice(Commit(self).iter(), max(window, 1)))
+        if not commits:
+            return []
+
+        deltas = [(commit.parent_id, commit.sha256) for commit in commits[:window] if commit.parent_id]
+        if from_scratch:
+            deltas.append((None, commits[0].sha256))
+
+        existing = self.static_deltas()
+        return [delta for delta in deltas if self._delta_name(*delta) not in existing]
+
+    @staticmethod
+    def _delta_name(from_id: str | None, to_id: str) -> str:
+        return f"{from_id}-{to_id}" if from_id else to_id
+
+    def _delta_cmd(self, from_id: str | None, to_id: str) -> str:
+        from_arg = f"--from={from_id}" if from_id else "--empty"
+        return f"sudo ostree static-delta generate --repo={self.repo_dir} {from_arg} --to={to_id}"
+
+    def _summary_cmd(self) -> str:
+        return f"sudo ostree summary --repo={self.repo_dir} --update"
+
+    def _check_mkimage_dir(self) -> None:
+        if not self.mkimage_dir.exists():
+            raise ImageProfileExistsError(
+                f"Image profile for {self.ostree_ref} not exists. Use `mkprofile` method firstly")
+
+    @property
+    def _checkout_holder(self) -> str:
+        """Имя держателя checkout'а в общем хранилище: roots ветки"""
+        return str(self.ostree_ref_dir).replace("/", ":")
+
+    def _hold_checkout(self, commit_id: str) -> None:
+        """
+        Извлекает коммит в общее хранилище (если его там еще нет) и закрепляет его за roots ветки.
+        Сборки поверх одного коммита используют один checkout.
+        """
+        store = self.checkout_store
+
+        with store.lock():
+            if not store.exists(commit_id):
+                cmdlib.runcmd(self._store_cmd("checkout", self.ostree_ref, commit_id, store.root))
+            store.hold(self._checkout_holder, commit_id)
+            store.evict(remove=lambda path: cmdlib.runcmd(self._store_cmd("remove", store.root, path.name)))
+
+    def _store_cmd(self, operation: str, *args) -> str:
+        return f"{self.repository.script_root}/cmd_checkout_store.sh {operation} {' '.join(map(str, args))}"
+
+    def _clear_roots_cmd(self) -> str:
+        return f"{self.repository.script_root}/cmd_clear_roots.sh {self.ostree_ref}"
+
+    def _checkout_cmd(self, commit_id: str) -> str:
+        return (f"CHECKOUT_STORE={self.checkout_store_dir} "
+                f"{self.repository.script_root}/cmd_ostree_checkout.sh {self.ostree_ref} {commit_id}")
+
+    def _sync_cmd(self, commit_id: str, version: str, incremental: bool = False) -> str:
+        return (f"{self.repository.script_root}/cmd_sync_updates.sh "
+                f"{self.ostree_ref} {commit_id} {version} {'upper' if incremental else 'root'}")
+
+    def _rootfs_date(self) -> str:
+        """Дата сборки rootfs из имени архива mkimage-profiles (acos-<date>-<arch>.tar)"""
+        archive = pathlib.Path(self.mkimage_dir, f"acos-latest-{self.arch.value}.tar").resolve()
+        return archive.name.split("-")[1]
+
+    def _rootfs2repo_cmd(self, version: Version) -> str:
+        return f"VERSION_MAJOR={version.major} sudo -E {self.repository.script_root}/cmd_rootfs2repo.sh {self.ostree_ref}"
+
+    def _commit_cmd(self,
+                    commit_id: str,
+                    version: Version,
+                    build_fingerprint: str | None = None,
+                    incremental: bool = False) -> str:
+        env = ""
+        if incremental:
+            # Модуль acoslib.ostreecommit запускается через sudo тем же интерпретатором
+            env = (f"COMMIT_TREE=upper "
+                   f"PYTHON={sys.executable} "
+                   f"ACOSLIB_ROOT={pathlib.Path(__file__).resolve().parent.parent} ")
+
+        return (f"{env}{self.repository.script_root}/cmd_ostree_commit.sh "
+                f"{self.ostree_ref} {commit_id} {version} {build_fingerprint or ''}").rstrip()
+
+    def _mkprofile_cmd(self) -> str:
+        return (f"{self.repository.script_root}/cmd_mkimage-profiles.sh "
+                f"{self.stream.value} "
+                f"{self.arch.value}")
+
 
 class SubReference(Reference):
     __slots__ = (
@@ -252,8 +862,33 @@ class SubReference(Reference):
         return self._root_dir
 
     @property
-    def merged_dir(self) -> pathlib.Path:
-        return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir, "roots", "merged")
+    def subref_dir(self) -> pathlib.Path:
+        return pathlib.Path(self.repository.stream_root, self.ostree_ref_dir)
+
+    def fingerprint(self, parent: Commit) -> str:
+        """
+        Отпечаток входных данных сборки подветки: родительский коммит, altconf.yml и дерево root.
+        Вычисляется по файлам, уже скопированным в каталог подветки (create_subref_files).
+        """
+        altconf = pathlib.Path(self.subref_dir, "altconf.yml")
+
+        return fingerprint.combine(parent.sha256,
+                                   fingerprint.hash_file(altconf) if altconf.exists() else None,
+                                   self.root_hash())
+
+    def root_hash(self) -> str | None:
+        """Хеш дерева root подветки (None, если его нет)"""
+        root = pathlib.Path(self.subref_dir, "root")
+        return fingerprint.hash_tree(root) if root.exists() else None
+
+    def up_to_date(self, build_fingerprint: str) -> Commit | None:
+        """Возвращает головной коммит подветки, если он собран из тех же входных данных"""
+        head = Commit(self).latest()
+
+        if head and head.metadata.get(Commit.FINGERPRINT_KEY) == build_fingerprint:
+            return head
+
+        return None
 
     @classmethod
     def from_ostree(cls, repository: Repository, ostree_ref: str, **extra) -> Reference:
@@ -267,56 +902,117 @@ class SubReference(Reference):
     def from_baseref(cls, base: Reference, **extra) -> SubReference:
         return cls(base.repository, base.arch, base.stream, **extra)
 
+    @tracing.traced("subref.create_subref_files")
     def create_subref_files(self) -> SubReference:
-        cmdlib.runcmd(
-            f"sudo -E {self.repository.script_root}/cmd_create_subref_files.sh "
-            f"{self.ostree_ref_dir} "
-            f"{self.altconf} "
-            f"{self.root_dir}")
+        cmdlib.runcmd(self._create_subref_files_cmd())
         return self
 
+    @tracing.traced("subref.create_subref_files")
+    async def acreate_subref_files(self) -> SubReference:
+        await cmdlib.arun(self._create_subref_files_cmd(), resources=(cmdlib.ROOT,))
+        return self
+
+    @tracing.traced("subref.checkout")
     def checkout(self, commit: Commit) -> Reference:
-        cmdlib.runcmd(
-            f"{self.repository.script_root}/cmd_ostree_checkout.sh "
-            f"{self.ostree_baseref} {commit.sha256} {self.ostree_ref} all")
+        self._hold_checkout(commit.sha256)
+        cmdlib.runcmd(self._checkout_cmd(commit))
+        return self
+
+    @tracing.traced("subref.checkout")
+    async def acheckout(self, commit: Commit) -> Reference:
+        await asyncio.to_thread(self._hold_checkout, commit.sha256)
+        await cmdlib.arun(self._checkout_cmd(commit), resources=(cmdlib.ROOT,))
         return self
 
+    @tracing.traced("subref.create")
     def create(self) -> Reference:
-        if not self.ostree_repo_exists():
-            raise BareRepoExistsError(f"Bare repo does not exist for {self.ostree_ref}")
+        with self.lock():
+            self._check_bare_repo()
+
+            if self._root_dir or self._altconf:
+                self.create_subref_files()
+
+            last_commit = Commit(super()).latest()
+            last_commit_id = last_commit.sha256
+
+            build_fingerprint = self.fingerprint(last_commit)
+            if head := self.up_to_date(build_fingerprint):
+                logging.info(f"{self.ostree_ref} is up to date :: {head.sha256}")
+                return self
+
+            with self.reserve_version(last_commit) as version:
+                self.checkout(last_commit)
+
+                AltConf(self, LayerCache(self.repository.layer_cache_dir)).exec(str(self.merged_dir), last_commit_id)
+
+                return self.sync(last_commit_id,
+                                 str(version),
+                                 incremental=True).commit(last_commit_id, version, build_fingerprint, incremental=True)
 
-        if self._root_dir or self._altconf:
-            self.create_subref_files()
+    @tracing.traced("subref.create")
+    async def acreate(self) -> Reference:
+        async with self.alock():
+            await asyncio.to_thread(self._check_bare_repo)
 
-        last_commit = Commit(super()).all()[-1]
-        last_commit_id = last_commit.sha256
-        last_commit_version = last_commit.version
+            if self._root_dir or self._altconf:
+                await self.acreate_subref_files()
 
-        self.checkout(last_commit)
+            last_commit = await asyncio.to_thread(Commit(super()).latest)
 
-        AltConf(self).exec(str(self.merged_dir))
+            # Хеширование root/ и чтение метаданных коммитов не должны блокировать задачи других веток
+            build_fingerprint = await asyncio.to_thread(self.fingerprint, last_commit)
+            if head := await asyncio.to_thread(self.up_to_date, build_fingerprint):
+                logging.info(f"{self.ostree_ref} is up to date :: {head.sha256}")
+                return self
 
-        return self.sync(last_commit_id,
-                         last_commit_version).commit(last_commit_id)
+            async with self.areserve_version(last_commit) as version:
+                await self.acheckout(last_commit)
+
+                # Действия altconf выполняются последовательно, поэтому переносятся в отдельный поток целиком
+                await asyncio.to_thread(AltConf(self, LayerCache(self.repository.layer_cache_dir)).exec,
+                                        str(self.merged_dir),
+                                        last_commit.sha256)
+
+                await self.async_updates(last_commit.sha256, str(version), incremental=True)
+                return await self.acommit(last_commit.sha256, version, build_fingerprint, incremental=True)
+
+    def _check_bare_repo(self) -> None:
+        if not self.ostree_repo_exists():
+            raise BareRepoExistsError(f"Bare repo does not exist for {self.ostree_ref}")
+
+    def _create_subref_files_cmd(self) -> str:
+        return (f"sudo -E {self.repository.script_root}/cmd_create_subref_files.sh "
+                f"{self.ostree_ref_dir} "
+                f"{self.altconf} "
+                f"{self.root_dir}")
+
+    def _checkout_cmd(self, commit: Commit) -> str:
+        return (f"CHECKOUT_STORE={self.checkout_store_dir} "
+                f"{self.repository.script_root}/cmd_ostree_checkout.sh "
+                f"{self.ostree_baseref} {commit.sha256} {self.ostree_ref} all")
 
 
 class Commit:
+    # Ключ метаданных коммита с отпечатком сборки: входных данных подветки (SubReference.fingerprint)
+    # или набора пакетов и ядра базовой ветки после обновления (RPM.digest)
+    FINGERPRINT_KEY = "altcos_fingerprint"
+
     __slots__ = (
         "_reference",
         "_sha256",
         "_version",
         "_date",
         "_parent_id",
+        "_metadata",
     )
 
-    _COMMIT_INFO_RE = re.compile(r"(commit .*\n(Parent:.*\n|)ContentChecksum: .*\nDate:.*\nVersion: .*\n)")
-
     def __init__(self, reference: Reference, **kwargs) -> None:
         self._reference = reference
         self._sha256 = kwargs.get("sha256")
         self._version = kwargs.get("version")
         self._date = kwargs.get("date")
         self._parent_id = kwargs.get("parent_id")
+        self._metadata = kwargs.get("metadata") or {}
 
     @property
     def reference(self) -> Reference:
@@ -338,62 +1034,171 @@ class Commit:
     def parent_id(self) -> str:
         return self._parent_id
 
-    def all(self) -> list[Commit] | None:
-        cp = cmdlib.runcmd(
-            f"ostree log {self._reference.ostree_ref} --repo {self._reference.repo_dir}"
-        )
+    @property
+    def metadata(self) -> dict:
+        return self._metadata
+
+    def iter(self) -> typing.Iterator[Commit]:
+        """
+        Лениво обходит историю ветки от головы к корню по родительским коммитам.
+        Коммиты, отсутствующие в репозитории (обрезанная история), завершают обход.
+        """
+        repo = self._reference.ostree_repo
+
+        _, checksum = repo.resolve_rev(str(self._reference.ostree_ref), True)
+
+        while checksum:
+            _, variant = repo.load_variant_if_exists(OSTree.ObjectType.COMMIT, checksum)
+            if variant is None:
+                return
 
-        info = self._COMMIT_INFO_RE.findall(cp.stdout.decode())
+            commit = self._from_variant(checksum, variant)
+            yield commit
 
-        if not info:
+            checksum = commit.parent_id
+
+    def latest(self) -> Commit | None:
+        """Возвращает головной коммит ветки без обхода истории"""
+        return next(self.iter(), None)
+
+    def all(self) -> list[Commit] | None:
+        """
+        История ветки от корня к голове.
+        Порядок берется из цепочки родителей, а не из дат: даты коммитов ostree хранятся с точностью до секунды.
+        """
+        commit_list = list(self.iter())
+
+        if not commit_list:
             return None
 
-        commit_list = []
+        return commit_list[::-1]
+
+    def index(self) -> CommitIndex:
+        """
+        Открывает индекс коммитов ветки и дописывает в него коммиты,
+        появившиеся после последней синхронизации.
+        Обход истории останавливается на первом уже проиндексированном коммите.
+        """
+        index = CommitIndex(self._reference.index_path)
+
+        if not self._reference.ostree_repo_exists():
+            return index
+
+        new_commits = []
+        for commit in self.iter():
+            if index.contains(commit.sha256):
+                break
+            new_commits.append(commit)
+
+        index.add(commit.as_dict() for commit in new_commits)
+
+        return index
+
+    def find(self, prefix: str) -> Commit | None:
+        """Ищет коммит по (сокращенному) sha256"""
+        with self.index() as index:
+            rows = index.by_prefix(prefix)
+
+        if len(rows) > 1:
+            raise ValueError(f"Commit {prefix} is ambiguous")
+
+        return Commit(self._reference, **rows[0]) if rows else None
 
-        for part in info:
-            [sha256, version, date, parent_id] = [None] * 4
+    def by_version(self, version: str) -> Commit | None:
+        with self.index() as index:
+            rows = index.by_version(version)
 
-            for field in part[0].split('\n'):
-                if not field:
-                    continue
+        return Commit(self._reference, **rows[-1]) if rows else None
 
-                raw = field.split()
-                name, value = raw[0], ' '.join(raw[1:])
+    def between(self,
+                since: datetime.datetime | None = None,
+                until: datetime.datetime | None = None) -> list[Commit]:
+        with self.index() as index:
+            rows = index.by_date(since, until)
 
-                match name.lower():
-                    case "commit":
-                        sha256 = value
-                    case "version:":
-                        version = value
-                    case "date:":
-                        date = datetime.datetime.strptime(value, "%Y-%m-%d %H:%M:%S %z")
-                    case "parent:":
-                        parent_id = value
+        return [Commit(self._reference, **row) for row in rows]
 
-            commit_list.append(Commit(self._reference,
-                                      sha256=sha256,
-                                      version=version,
-                                      date=date,
-                                      parent_id=parent_id))
+    def content_size(self) -> int:
+        """
+        Объем дерева коммита в байтах по размеру объектов в репозитории.
+        Объекты, общие для нескольких файлов, учитываются один раз, как и при развертывании.
+        """
+        repo = self._reference.ostree_repo
+        _, objects = repo.traverse_commit(self._sha256, 0, None)
 
-        return sorted(commit_list,
-                      key=lambda item: item.date)
+        total = 0
+        for name in objects:
+            checksum, objtype = OSTree.object_name_deserialize(name) if isinstance(name, GLib.Variant) else name
+            _, size = repo.query_object_storage_size(objtype, checksum, None)
+            total += size
 
-    def create(self, commit_id: str, version: str) -> None:
-        self.reference.checkout(commit_id).sync(commit_id, version).commit(commit_id)
+        return total
+
+    @property
+    def var_dir(self) -> pathlib.Path:
+        return pathlib.Path(self._reference.repository.stream_root, self._reference.ostree_ref_dir,
+                            "vars", self._sha256, "var")
+
+    def as_dict(self) -> dict:
+        return {
+            "sha256": self._sha256,
+            "parent_id": self._parent_id,
+            "version": self._version,
+            "date": self._date,
+            "metadata": self._metadata,
+        }
+
+    def _from_variant(self, checksum: str, variant: GLib.Variant) -> Commit:
+        metadata = variant.get_child_value(0).unpack()
+        timestamp = OSTree.commit_get_timestamp(variant)
+
+        return Commit(self._reference,
+                      sha256=checksum,
+                      version=metadata.get("version"),
+                      date=datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc),
+                      parent_id=OSTree.commit_get_parent(variant),
+                      metadata=metadata)
+
+    def load(self, checksum: str) -> Commit:
+        """Загружает коммит ветки по полному sha256"""
+        _, variant = self._reference.ostree_repo.load_variant(OSTree.ObjectType.COMMIT, checksum)
+        return self._from_variant(checksum, variant)
+
+    def create(self, commit_id: str) -> None:
+        with self._reference.reserve_version(self.load(commit_id)) as version:
+            self.reference.checkout(commit_id) \
+                .sync(commit_id, str(version), incremental=True) \
+                .commit(commit_id, version, incremental=True)
 
 
 class AltConf:
+    """
+    Конфигурация подветки altconf.yml и выполнение ее действий поверх смонтированного overlay.
+    Значения переменных действия env экспортируются в сессию оболочки дословно (через shlex.quote):
+    символы $ и обратные кавычки в значении больше не раскрываются при экспорте, как раньше,
+    когда переменные передавались префиксом export k="v" перед каждой командой.
+    Подстановка выполняется только там, где переменная используется (env.cmd, run, butane).
+    """
+
+    # Число одновременно копируемых образов действия podman по умолчанию (podman: {jobs: N})
+    PODMAN_JOBS = 4
+
     __slots__ = (
         "_subref",
         "_path",
         "_mtime",
         "_content",
         "_env",
+        "_cache",
+        "_session",
+        "_results",
     )
 
-    def __init__(self, subref: SubReference) -> None:
+    def __init__(self, subref: SubReference, cache: LayerCache | None = None) -> None:
         self._subref = subref
+        self._cache = cache
+        self._session: ShellSession | None = None
+        self._results: list[CommandResult] = []
         self._path = pathlib.Path(self.subref.repository.stream_root,
                                   subref.ostree_ref_dir,
                                   "altconf.yml")
@@ -422,47 +1227,121 @@ class AltConf:
     def mtime(self) -> float:
         return self._mtime
 
-    def exec(self, merged_dir: str) -> None:
-        self._env["MERGED_DIR"] = merged_dir
+    @property
+    def results(self) -> list[CommandResult]:
+        """Код возврата и время выполнения команд действий env, run и butane последнего exec"""
+        return self._results
 
-        actions = self._content.get("actions")
+    @tracing.traced("altconf.exec")
+    def exec(self, merged_dir: str, parent_id: str | None = None) -> None:
+        """
+        Выполняет действия altconf в смонтированном overlay.
+        Действия env, run и butane выполняются в одной сессии оболочки root на всю сборку.
+        :param parent_id: коммит, от которого собирается подветка; без него кэш слоев не используется
+        """
+        self._results = []
 
-        for sub_act in actions:
-            for k, v in sub_act.items():
-                if v is None:
-                    continue
-
-                match k:
-                    case "rpms":
-                        self._rpm_act(v)
-                    case "env":
-                        self._env_act(v, merged_dir)
-                    case "podman":
-                        self._podman_act(v, merged_dir)
-                    case "butane":
-                        self._butane_act(v, merged_dir)
-                    case "run":
-                        self._run_act(v, merged_dir)
+        with ShellSession("sudo -E bash --noprofile --norc") as self._session:
+            try:
+                self._exec(merged_dir, parent_id)
+            finally:
+                self._session = None
 
-    def _rpm_act(self, value: list[str]) -> None:
-        script_root = self._subref.repository.script_root
+    def _setenv(self, name: str, value: str) -> None:
+        self._env[name] = value
+        if self._session is not None:
+            self._session.export(name, value)
+
+    def _session_run(self, cmd: str, name: str) -> CommandResult:
+        result = self._session.run(cmd, name=name)
+        self._results.append(result)
+        return result
+
+    def _exec(self, merged_dir: str, parent_id: str | None) -> None:
+        self._setenv("MERGED_DIR", merged_dir)
 
-        RPM(self.subref).update()
+        actions = self._coalesce(self._content.get("actions"))
 
-        pkg_names = " ".join(value)
+        if not (self._cache and parent_id):
+            for sub_act in actions:
+                self._exec_action(sub_act, merged_dir)
+            return
+
+        keys = LayerCache.keys(parent_id, actions, self._subref.root_hash())
+        start = 0
+
+        if cached := self._cache.deepest(keys):
+            depth, env = cached
+            logging.info(f"resume {self._subref.ostree_ref} from cached layer {depth + 1}/{len(actions)}")
+            cmdlib.runcmd(self._layer_cache_cmd("restore", *[self._cache.archive(key) for key in keys[:depth + 1]]))
+            for name, value in env.items():
+                self._setenv(name, value)
+            start = depth + 1
+
+        for i in range(start, len(actions)):
+            self._exec_action(actions[i], merged_dir)
+
+            # Архив слоя содержит только изменения действия относительно снимка предыдущего слоя
+            base = (self._cache.snapshot(keys[i - 1]),) if i else ()
+            cmdlib.runcmd(self._layer_cache_cmd("save", self._cache.prepare(keys[i]), *base))
+            self._cache.commit(keys[i], {k: v for k, v in self._env.items() if k != "MERGED_DIR"})
+
+        self._cache.evict(keep=keys)
+
+    def _exec_action(self, sub_act: dict, merged_dir: str) -> None:
+        for k, v in sub_act.items():
+            if v is None:
+                continue
+
+            with tracing.span(f"altconf.{k}", ref=str(self._subref.ostree_ref)):
+                self._exec_action_item(k, v, merged_dir)
+
+    def _exec_action_item(self, k: str, v: typing.Any, merged_dir: str) -> None:
+        match k:
+            case "rpms":
+                self._rpm_act(v)
+            case "env":
+                self._env_act(v, merged_dir)
+            case "podman":
+                self._podman_act(v, merged_dir)
+            case "butane":
+                self._butane_act(v, merged_dir)
+            case "run":
+                self._run_act(v, merged_dir)
+
+    def _layer_cache_cmd(self, operation: str, *paths: pathlib.Path) -> str:
+        return (f"{self._subref.repository.script_root}/cmd_layer_cache.sh "
+                f"{operation} {self._subref.ostree_ref} {' '.join(map(str, paths))}")
+
+    @staticmethod
+    def _coalesce(actions: list[dict]) -> list[dict]:
+        """
+        Объединяет идущие подряд действия rpms в одно, чтобы пакеты ставились одной транзакцией apt.
+        Действия других типов разрывают цепочку, так как могут зависеть от уже установленных пакетов.
+        """
+        coalesced = []
+        for sub_act in actions:
+            if coalesced and set(sub_act) == {"rpms"} and set(coalesced[-1]) == {"rpms"}:
+                coalesced[-1] = {"rpms": [*(coalesced[-1]["rpms"] or []), *(sub_act["rpms"] or [])]}
+            else:
+                coalesced.append(sub_act)
+        return coalesced
 
-        RPM(self.subref).install(pkg_names)
+    def _rpm_act(self, value: list[str]) -> None:
+        rpm = RPM(self.subref)
+        rpm.update().install(value)
+        rpm.evict_cache()
 
     def _env_act(self, value: dict, merged_dir: str) -> None:
         for k, v in value.items():
-            cmd = self._make_export_env_cmd()
+            cmd = ":"
             if isinstance(v, dict):
                 if env_cmd := v.get("cmd"):
-                    cmd += f"sudo chroot {merged_dir} sh -c \"{env_cmd}\""
+                    cmd = f"chroot {merged_dir} sh -c \"{env_cmd}\""
             else:
-                cmd += f"{k}=\"{v}\";echo ${k}"
+                cmd = f"{k}=\"{v}\";echo ${k}"
 
-            self._env[k] = cmdlib.runcmd(cmd).stdout.decode().replace("\n", " ")
+            self._setenv(k, self._session_run(cmd, f"env {k}").output.replace("\n", " "))
 
     def _podman_act(self, value: dict, merged_dir: str) -> None:
         images = value.get("images")
@@ -472,17 +1351,22 @@ class AltConf:
             return
 
         if images:
-            images = " ".join(images)
+            images = list(images)
 
             if env_list_images:
                 for env_name in env_list_images.split(','):
-                    images += f" {self._env[env_name]}"
+                    images.append(self._env[env_name])
+
+            cmd = (f"{self._make_export_env_cmd()}IMAGE_CACHE={self._subref.repository.image_cache_dir} "
+                   f"{self._subref.repository.script_root}/cmd_skopeo_copy.sh {merged_dir}")
 
-            cmd = f"{self._subref.repository.script_root}/cmd_skopeo_copy.sh {merged_dir} {images}"
+            # Образы копируются параллельно; общие слои и готовые архивы берутся из кэша образов
+            with concurrent.futures.ThreadPoolExecutor(max_workers=value.get("jobs", self.PODMAN_JOBS)) as executor:
+                futures = [executor.submit(tracing.propagate(cmdlib.runcmd), f"{cmd} {shlex.quote(image)}")
+                           for image in dict.fromkeys(images)]
 
-            cmdlib.runcmd(
-                f"{self._make_export_env_cmd()}{cmd}"
-            )
+                for future in futures:
+                    future.result()
 
     def _butane_act(self, value: dict, merged_dir: str) -> None:
         script_root = self._subref.repository.script_root
@@ -490,28 +1374,25 @@ class AltConf:
 
         abs_ref_dir = self._subref.ostree_ref_dir.absolute()
         cmd = f"echo \"{butane_yml}\" | {script_root}/cmd_ignition.sh {abs_ref_dir} {merged_dir}"
-        cmdlib.runcmd(
-            f"{self._make_export_env_cmd()}{cmd}",
-        )
+        self._session_run(cmd, "butane")
 
     def _run_act(self, value: typing.Any, merged_dir: str) -> None:
-        cmd = f"sudo chroot {merged_dir} bash -c \"{''.join(value)}\""
-        cmdlib.runcmd(
-            f"{self._make_export_env_cmd()}{cmd}"
-        )
+        cmd = f"chroot {merged_dir} bash -c \"{''.join(value)}\""
+        self._session_run(cmd, "run")
 
     def _make_export_env_cmd(self) -> str:
         """
-        Формирует команду для экспорта переменных окружения из self._env
-        :return:
+        Формирует команду для экспорта переменных окружения из self._env.
+        Значения экспортируются дословно (shlex.quote), как и в сессию оболочки действий env, run и butane.
         """
-        cmd = [f"export {k}=\"{v}\"" for k, v in self._env.items()]
-        return ";".join(cmd).strip() + ";"
+        cmd = [f"export {k}={shlex.quote(v)}" for k, v in self._env.items()]
+        return ";".join(cmd).strip() + ";" if cmd else ""
 
 
 class Image:
     _FACTORY_LIST = {
         ImageFormat.QCOW: QcowImage,
+        ImageFormat.RAW: RawImage,
     }
 
     __slots__ = (
@@ -521,24 +1402,92 @@ class Image:
     def __init__(self, reference: Reference) -> None:
         self._reference = reference
 
-    def create(self, img_format: ImageFormat, commit: Commit) -> BaseImage:
-        return self._FACTORY_LIST.get(img_format).create(self._reference, commit)
+    def create(self,
+               img_format: ImageFormat,
+               commit: Commit,
+               force: bool = False,
+               compress: str | None = None,
+               direct: bool = False) -> BaseImage:
+        """
+        Собирает образ коммита; уже собранный образ возвращается из каталога, если не задан force.
+        :param compress: кодек (zstd, xz) для сжатой копии образа
+        :param direct: разворачивать коммит сразу в qcow2 через qemu-nbd, без промежуточного raw-диска
+        """
+        return self.create_many([img_format], commit, force, compress, direct)[img_format]
+
+    async def acreate(self,
+                      img_format: ImageFormat,
+                      commit: Commit,
+                      force: bool = False,
+                      compress: str | None = None,
+                      direct: bool = False) -> BaseImage:
+        return (await self.acreate_many([img_format], commit, force, compress, direct))[img_format]
+
+    def create_many(self,
+                    formats: typing.Iterable[ImageFormat],
+                    commit: Commit,
+                    force: bool = False,
+                    compress: str | None = None,
+                    direct: bool = False) -> dict[ImageFormat, BaseImage]:
+        """Собирает образы коммита во всех форматах за одно развертывание sysroot"""
+        return create_many(self._reference, commit, [self._factory(fmt) for fmt in formats], force, compress, direct)
+
+    async def acreate_many(self,
+                           formats: typing.Iterable[ImageFormat],
+                           commit: Commit,
+                           force: bool = False,
+                           compress: str | None = None,
+                           direct: bool = False) -> dict[ImageFormat, BaseImage]:
+        return await acreate_many(self._reference, commit, [self._factory(fmt) for fmt in formats],
+                                  force, compress, direct)
+
+    def compress(self, img_format: ImageFormat, commit: Commit, codec: str = "zstd") -> BaseImage:
+        return self._factory(img_format).compress(self._reference, commit, codec)
 
     def all(self, img_format: ImageFormat) -> list[BaseImage]:
-        return self._FACTORY_LIST.get(img_format).all(self._reference)
+        return self._factory(img_format).all(self._reference)
+
+    def find(self, img_format: ImageFormat, commit: Commit) -> BaseImage | None:
+        return self._factory(img_format).find(self._reference, commit)
+
+    def latest(self, img_format: ImageFormat) -> BaseImage | None:
+        return self._factory(img_format).latest(self._reference)
+
+    def _factory(self, img_format: ImageFormat) -> type[BaseImage]:
+        if img_format not in self._FACTORY_LIST:
+            raise ValueError(f"Image format {img_format.value} is not supported")
+        return self._FACTORY_LIST[img_format]
 
 
 class RPM:
+    # Время в секундах, в течение которого индексы apt считаются свежими
+    UPDATE_TTL = 3600
+    UPDATE_STAMP = ".acoslib-updated"
+    # Ограничение размера общего кэша пакетов, байт
+    CACHE_MAX_SIZE = 10 * 1024 ** 3
+    # Служебные файлы apt в каталоге кэша, не подлежащие вытеснению
+    CACHE_KEEP = ("lock", "partial")
+
     __slots__ = (
         "_reference",
         "_updated",
         "_pkgs",
+        "_mirror",
     )
 
-    def __init__(self, reference: Reference) -> None:
+    def __init__(self, reference: Reference, mirror: str | os.PathLike | None = None) -> None:
+        """
+        :param mirror: локальный apt-репозиторий (или каталог с пакетами), используемый вместо сетевых источников
+        """
         self._reference = reference
         self._updated = False
         self._pkgs = None
+        mirror = mirror or reference.repository.pkg_mirror
+        self._mirror = pathlib.Path(mirror).absolute() if mirror else None
+
+    @property
+    def reference(self) -> Reference:
+        return self._reference
 
     @property
     def updated(self) -> bool:
@@ -546,27 +1495,184 @@ class RPM:
 
     @property
     def pkgs(self) -> list[str]:
+        """Пакеты rpmdb checkout'а ветки после последнего upgrade/update_kernel"""
         return self._pkgs
 
-    def install(self, *pkgs: str) -> subprocess.CompletedProcess:
-        return cmdlib.runcmd(f"stdbuf -oL {self._reference.repository.script_root}/cmd_apt-get_install.sh "
-                             f"{self._reference.ostree_ref} {''.join(pkgs)}")
+    def kernels(self) -> list[str]:
+        """Версии ядер checkout'а ветки (каталоги lib/modules)"""
+        modules_dir = pathlib.Path(self._reference.merged_dir, "lib", "modules")
+        return sorted(path.name for path in modules_dir.iterdir()) if modules_dir.exists() else []
+
+    def digest(self) -> str:
+        """Отпечаток набора пакетов rpmdb и версий ядер; не зависит от порядка вывода rpm -qa"""
+        return fingerprint.combine(*sorted(self._pkgs or ()), *self.kernels())
+
+    @property
+    def mirror(self) -> pathlib.Path | None:
+        return self._mirror
+
+    @property
+    def cache_dir(self) -> pathlib.Path:
+        """Общий для всех веток кэш скачанных пакетов; монтируется в var/cache/apt/archives chroot-а"""
+        return self._reference.repository.pkg_cache_dir
+
+    def evict_cache(self, max_size: int = CACHE_MAX_SIZE) -> list[pathlib.Path]:
+        """
+        Удаляет давно не использованные пакеты из общего кэша, пока он больше max_size.
+        Исключительная блокировка ждет завершения сценариев apt (они держат ее разделяемой);
+        служебные lock и partial/ самого apt не удаляются.
+        """
+        with flock(pathlib.Path(self.cache_dir, ".lock")):
+            return lru.evict(self.cache_dir, max_size, keep=self.CACHE_KEEP)
+
+    @property
+    def stamp_path(self) -> pathlib.Path:
+        """Метка последнего apt-get update; лежит в верхнем слое overlay и исчезает вместе с ним"""
+        return pathlib.Path(self._reference.merged_dir, "var", "lib", "apt", "lists", self.UPDATE_STAMP)
+
+    @tracing.traced("rpm.install")
+    def install(self, *pkgs: str | typing.Iterable[str]) -> subprocess.CompletedProcess | None:
+        """
+        Устанавливает пакеты одной транзакцией apt.
+        Принимает имена пакетов и/или их списки; повторы отбрасываются.
+        """
+        if not (pkg_list := self._flatten(pkgs)):
+            return None
+        return cmdlib.runcmd(self._install_cmd(*pkg_list), stream=True)
+
+    @tracing.traced("rpm.install")
+    async def ainstall(self, *pkgs: str | typing.Iterable[str]) -> subprocess.CompletedProcess | None:
+        if not (pkg_list := self._flatten(pkgs)):
+            return None
+        return await cmdlib.arun(self._install_cmd(*pkg_list), resources=(cmdlib.NETWORK, cmdlib.ROOT), stream=True)
+
+    def fresh(self, ttl: float = UPDATE_TTL) -> bool:
+        """Индексы apt обновлялись в текущем checkout ветки не раньше, чем ttl секунд назад"""
+        try:
+            return time.time() - self.stamp_path.stat().st_mtime < ttl
+        except OSError:
+            return False
 
-    def update(self) -> RPM:
-        cmdlib.runcmd(f"stdbuf -oL {self._reference.repository.script_root}/cmd_apt-get_update.sh "
-                      f"{self._reference.ostree_ref}")
+    @tracing.traced("rpm.update")
+    def update(self, ttl: float = UPDATE_TTL) -> RPM:
+        """
+        Обновляет индексы apt.
+        :param ttl: не обновлять, если индексы свежее ttl секунд (0 - обновлять всегда)
+        """
+        if self.fresh(ttl):
+            logging.info(f"apt indexes of {self._reference.ostree_ref} are fresh, skip update")
+            return self
+
+        cmdlib.runcmd(self._update_cmd())
+        return self
+
+    @tracing.traced("rpm.update")
+    async def aupdate(self, ttl: float = UPDATE_TTL) -> RPM:
+        if self.fresh(ttl):
+            logging.info(f"apt indexes of {self._reference.ostree_ref} are fresh, skip update")
+            return self
+
+        await cmdlib.arun(self._update_cmd(), resources=(cmdlib.NETWORK, cmdlib.ROOT))
         return self
 
+    @tracing.traced("rpm.upgrade")
     def upgrade(self) -> RPM:
         with tempfile.NamedTemporaryFile(dir="/tmp", prefix="ostree_") as tmpfile:
-            output = cmdlib.runcmd(f"{self._reference.repository.script_root}/cmd_apt-get_dist-upgrade.sh"
-                                   f"{self._reference.ostree_ref} {tmpfile.name}")
-            self._updated = "0 upgraded, 0 newly installed, 0 removed and 0 not upgraded" in output
-            self._pkgs = tmpfile.read().decode().split("\n")
+            lines = cmdlib.iterlines(self._upgrade_cmd(tmpfile.name))
+            self._read_upgrade_result(self._log_lines(lines), tmpfile)
+
+        return self
+
+    @tracing.traced("rpm.upgrade")
+    async def aupgrade(self) -> RPM:
+        self._updated = False
+
+        with tempfile.NamedTemporaryFile(dir="/tmp", prefix="ostree_") as tmpfile:
+            await cmdlib.arun(self._upgrade_cmd(tmpfile.name),
+                              resources=(cmdlib.NETWORK, cmdlib.ROOT),
+                              callback=self._stream_upgrade_line)
+            self._pkgs = self._read_pkgs(tmpfile)
 
         return self
 
+    @tracing.traced("rpm.update_kernel")
     def update_kernel(self) -> RPM:
-        cmdlib.runcmd(f"{self._reference.repository.script_root}/cmd_update_kernel.sh {self._reference.ostree_ref}")
+        with tempfile.NamedTemporaryFile(dir="/tmp", prefix="ostree_") as tmpfile:
+            cmdlib.runcmd(self._update_kernel_cmd(tmpfile.name), stream=True)
+            self._pkgs = self._read_pkgs(tmpfile)
+
+        return self
+
+    @tracing.traced("rpm.update_kernel")
+    async def aupdate_kernel(self) -> RPM:
+        with tempfile.NamedTemporaryFile(dir="/tmp", prefix="ostree_") as tmpfile:
+            await cmdlib.arun(self._update_kernel_cmd(tmpfile.name),
+                              resources=(cmdlib.NETWORK, cmdlib.ROOT),
+                              stream=True)
+            self._pkgs = self._read_pkgs(tmpfile)
 
         return self
+
+    @staticmethod
+    def _flatten(pkgs: tuple[str | typing.Iterable[str], ...]) -> list[str]:
+        pkg_list = []
+        for item in pkgs:
+            pkg_list.extend([item] if isinstance(item, str) else item)
+        return list(dict.fromkeys(pkg for pkg in pkg_list if pkg))
+
+    @staticmethod
+    def _is_summary(line: str) -> bool:
+        return "upgraded," in line and "newly installed" in line
+
+    @staticmethod
+    def _log_lines(lines: typing.Iterable[str]) -> typing.Iterator[str]:
+        for line in lines:
+            logging.info(f" OUTPUT :: {line}")
+            yield line
+
+    def _read_upgrade_result(self, lines: typing.Iterable[str], pkg_list: typing.IO[bytes]) -> None:
+        """
+        Разбирает вывод dist-upgrade построчно, не накапливая его целиком.
+        :param lines: строки вывода команды (итератор вычитывается до конца)
+        """
+        self._updated = False
+        for line in lines:
+            self._read_upgrade_line(line)
+
+        self._pkgs = self._read_pkgs(pkg_list)
+
+    def _stream_upgrade_line(self, line: str) -> None:
+        """Обработчик строк вывода dist-upgrade в асинхронном режиме: строка пишется в лог и сразу разбирается"""
+        logging.info(f" OUTPUT :: {line}")
+        self._read_upgrade_line(line)
+
+    def _read_upgrade_line(self, line: str) -> None:
+        if self._is_summary(line):
+            # Пакеты, оставленные без обновления ("N not upgraded"), изменений не означают
+            self._updated = not line.strip().startswith("0 upgraded, 0 newly installed, 0 removed")
+
+    @staticmethod
+    def _read_pkgs(pkg_list: typing.IO[bytes]) -> list[str]:
+        return [pkg for pkg in pkg_list.read().decode().split("\n") if pkg]
+
+    def _pkg_env(self) -> str:
+        env = f"PKG_CACHE_DIR={self.cache_dir} "
+        if self._mirror:
+            env += f"PKG_MIRROR_DIR={self._mirror} "
+        return env
+
+    def _install_cmd(self, *pkgs: str) -> str:
+        return (f"{self._pkg_env()}stdbuf -oL {self._reference.repository.script_root}/cmd_apt-get_install.sh "
+                f"{self._reference.ostree_ref} {' '.join(pkgs)}")
+
+    def _update_cmd(self) -> str:
+        return (f"{self._pkg_env()}stdbuf -oL {self._reference.repository.script_root}/cmd_apt-get_update.sh "
+                f"{self._reference.ostree_ref}")
+
+    def _upgrade_cmd(self, pkg_list_file: str) -> str:
+        return (f"{self._pkg_env()}{self._reference.repository.script_root}/cmd_apt-get_dist-upgrade.sh "
+                f"{self._reference.ostree_ref} {pkg_list_file}")
+
+    def _update_kernel_cmd(self, pkg_list_file: str) -> str:
+        return (f"{self._pkg_env()}{self._reference.repository.script_root}/cmd_update_kernel.sh "
+                f"{self._reference.ostree_ref} {pkg_list_file}")
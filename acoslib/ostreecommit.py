@@ -0,0 +1,174 @@
+"""
+Инкрементальный коммит верхнего слоя overlay поверх родительского коммита.
+
+Дерево нового коммита строится из дерева родителя, к которому применяются только изменения
+из roots/upper: новые и измененные файлы записываются в репозиторий, удаления (whiteout-устройства overlayfs)
+и непрозрачные каталоги (trusted.overlay.opaque) убирают соответствующие записи родителя.
+Неизмененные файлы берутся из родителя по контрольным суммам и не перечитываются.
+
+Запускается от root (bare-репозиторий принадлежит root) из cmd_ostree_commit.sh:
+    python -m acoslib.ostreecommit --repo REPO --branch REF --parent COMMIT --tree UPPER [--add-metadata-string K=V ...]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import pathlib
+import stat
+
+import gi
+
+gi.require_version("OSTree", "1.0")
+
+from gi.repository import OSTree, Gio, GLib
+
+_OPAQUE_XATTR = "trusted.overlay.opaque"
+_OVERLAY_XATTR_PREFIX = "trusted.overlay."
+
+
+def _is_whiteout(st: os.stat_result) -> bool:
+    return stat.S_ISCHR(st.st_mode) and st.st_rdev == 0
+
+
+def _is_opaque(path: pathlib.Path) -> bool:
+    try:
+        return os.getxattr(path, _OPAQUE_XATTR, follow_symlinks=False) == b"y"
+    except OSError:
+        return False
+
+
+def _subtree(mtree: OSTree.MutableTree, parts: tuple[str, ...]) -> OSTree.MutableTree | None:
+    """Подкаталог дерева по компонентам пути (None, если его нет в родителе)"""
+    for name in parts:
+        try:
+            _, _, mtree = mtree.lookup(name)
+        except GLib.GError:
+            return None
+        if mtree is None:
+            return None
+    return mtree
+
+
+def apply_whiteouts(mtree: OSTree.MutableTree, upper: pathlib.Path) -> int:
+    """
+    Удаляет из дерева родителя пути, скрытые в верхнем слое overlay.
+    :return: число примененных удалений
+    """
+    removed = 0
+
+    for dirpath, dirnames, filenames in os.walk(upper):
+        rel = pathlib.Path(dirpath).relative_to(upper).parts
+        parent = None
+
+        for name in [*dirnames, *filenames]:
+            path = pathlib.Path(dirpath, name)
+            st = path.lstat()
+
+            opaque = stat.S_ISDIR(st.st_mode) and _is_opaque(path)
+            if not (_is_whiteout(st) or opaque):
+                continue
+
+            parent = parent or _subtree(mtree, rel)
+            if parent is None:
+                break
+
+            parent.remove(name, True)
+            if opaque:
+                parent.ensure_dir(name)
+            removed += 1
+
+    return removed
+
+
+def _commit_filter(repo: OSTree.Repo, path: str, file_info: Gio.FileInfo) -> OSTree.RepoCommitFilterResult:
+    mode = file_info.get_attribute_uint32("unix::mode")
+
+    if stat.S_ISCHR(mode) and file_info.get_attribute_uint32("unix::rdev") == 0:
+        return OSTree.RepoCommitFilterResult.SKIP
+
+    # Аналог --mode-ro-executables
+    if stat.S_ISREG(mode) and mode & 0o111:
+        file_info.set_attribute_uint32("unix::mode", mode & ~0o222)
+
+    return OSTree.RepoCommitFilterResult.ALLOW
+
+
+def _xattrs_reader(upper: pathlib.Path):
+    """Читает xattrs файлов верхнего слоя без служебных атрибутов overlayfs"""
+
+    def read(repo: OSTree.Repo, path: str, file_info: Gio.FileInfo) -> GLib.Variant:
+        full_path = upper / path.lstrip("/")
+        xattrs = []
+
+        for name in os.listxattr(full_path, follow_symlinks=False):
+            if name.startswith(_OVERLAY_XATTR_PREFIX):
+                continue
+            value = os.getxattr(full_path, name, follow_symlinks=False)
+            xattrs.append((name.encode() + b"\0", value))
+
+        return GLib.Variant("a(ayay)", xattrs)
+
+    return read
+
+
+def commit_upper(repo_path: str | os.PathLike,
+                 branch: str,
+                 parent: str,
+                 upper: str | os.PathLike,
+                 metadata: dict[str, str]) -> str:
+    """
+    Создает коммит ветки branch: дерево parent с примененным верхним слоем upper.
+    :return: sha256 нового коммита
+    """
+    upper = pathlib.Path(upper)
+
+    repo = OSTree.Repo.new(Gio.File.new_for_path(str(repo_path)))
+    repo.open(None)
+
+    repo.prepare_transaction(None)
+    try:
+        # Файлы верхнего слоя, являющиеся жесткими ссылками на объекты репозитория, не перехешируются
+        repo.scan_hardlinks(None)
+
+        mtree = OSTree.MutableTree.new_from_commit(repo, parent)
+        apply_whiteouts(mtree, upper)
+
+        modifier = OSTree.RepoCommitModifier.new(OSTree.RepoCommitModifierFlags.NONE, _commit_filter)
+        modifier.set_xattr_callback(_xattrs_reader(upper))
+        modifier.set_devino_cache(OSTree.RepoDevInoCache.new())
+
+        repo.write_directory_to_mtree(Gio.File.new_for_path(str(upper)), mtree, modifier, None)
+        _, root = repo.write_mtree(mtree, None)
+
+        # Родителем в истории, как и у `ostree commit -b`, служит голова ветки, а не коммит, из дерева которого
+        # строится новый (для подветки это коммит базовой ветки)
+        _, head = repo.resolve_rev(branch, True)
+
+        metadata_variant = GLib.Variant("a{sv}", {k: GLib.Variant("s", v) for k, v in metadata.items()})
+        _, checksum = repo.write_commit(head, "", None, metadata_variant, root, None)
+
+        repo.transaction_set_ref(None, branch, checksum)
+        repo.commit_transaction(None)
+    except BaseException:
+        repo.abort_transaction(None)
+        raise
+
+    return checksum
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Commit an overlay upper layer on top of its parent commit")
+    parser.add_argument("--repo", required=True)
+    parser.add_argument("--branch", required=True)
+    parser.add_argument("--parent", required=True)
+    parser.add_argument("--tree", required=True, help="overlay upper directory")
+    parser.add_argument("--add-metadata-string", action="append", default=[], metavar="KEY=VALUE")
+    args = parser.parse_args()
+
+    metadata = dict(item.split("=", 1) for item in args.add_metadata_string)
+
+    print(commit_upper(args.repo, args.branch, args.parent, args.tree, metadata))
+
+
+if __name__ == "__main__":
+    main()
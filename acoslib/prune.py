@@ -0,0 +1,147 @@
+"""
+Очистка ветки по политике хранения.
+
+Из истории ветки сохраняется непрерывная часть от головы: последние keep_last коммитов
+и все коммиты моложе keep_newer_than (головной коммит сохраняется всегда).
+Вместе с удаляемыми коммитами удаляются их каталоги vars, образы и checkout'ы общего хранилища,
+а недостижимые из веток объекты bare-репозитория удаляются prune'ом.
+
+Удаление коммитов выполняется от root (bare-репозиторий принадлежит root) из Reference.prune:
+    python -m acoslib.prune --repo REPO --delete-commit COMMIT [--delete-commit COMMIT ...]
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import typing
+
+from acoslib.utils.lazygi import OSTree, Gio, GLib
+
+if typing.TYPE_CHECKING:
+    from acoslib import models
+
+
+class RetentionPolicy(typing.NamedTuple):
+    keep_last: int | None = None
+    keep_newer_than: datetime.timedelta | None = None
+
+    def keep(self, commits: typing.Sequence[models.Commit], now: datetime.datetime | None = None) -> int:
+        """
+        Число сохраняемых коммитов.
+        :param commits: коммиты ветки от головы к корню
+        """
+        if self.keep_last is None and self.keep_newer_than is None:
+            raise ValueError("Retention policy must set keep_last or keep_newer_than")
+
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+
+        keep = max(1, self.keep_last or 0)
+        if self.keep_newer_than is not None:
+            for i, commit in enumerate(commits):
+                if now - commit.date < self.keep_newer_than:
+                    keep = max(keep, i + 1)
+
+        return min(keep, len(commits))
+
+
+class PruneReport(typing.NamedTuple):
+    """
+    Результат (или, при dry_run, план) очистки ветки.
+    Объем объектов репозитория - оценка снизу: объекты, достижимые из других веток, не учитываются.
+    Checkout'ы хранилища состоят из жестких ссылок на объекты репозитория, поэтому их объем отдельно не считается.
+    """
+    ref: str
+    dry_run: bool
+    kept: list[str]
+    pruned: list[str]
+    objects: int
+    repo_bytes: int
+    vars: list[pathlib.Path]
+    vars_bytes: int
+    roots_bytes: int
+    images: list[pathlib.Path]
+    images_bytes: int
+    checkouts: list[str]
+
+    @property
+    def total_bytes(self) -> int:
+        return self.repo_bytes + self.vars_bytes + self.roots_bytes + self.images_bytes
+
+    def as_dict(self) -> dict:
+        return {**self._asdict(), "total_bytes": self.total_bytes}
+
+
+def _object_names(repo: OSTree.Repo, commit_id: str, depth: int) -> set[tuple[str, OSTree.ObjectType]]:
+    """Объекты коммита и depth его предков"""
+    _, objects = repo.traverse_commit(commit_id, depth, None)
+
+    names = set()
+    for name in objects:
+        checksum, objtype = OSTree.object_name_deserialize(name) if isinstance(name, GLib.Variant) else name
+        names.add((checksum, objtype))
+
+    return names
+
+
+def reclaimable(repo: OSTree.Repo, kept: typing.Sequence[str], pruned: typing.Sequence[str]) -> tuple[int, int]:
+    """
+    Объекты, которые освободятся после удаления хвоста истории pruned.
+    :param kept: сохраняемые коммиты ветки от головы
+    :param pruned: удаляемые коммиты ветки, следующие за kept
+    :return: число объектов и их объем в байтах
+    """
+    if not pruned:
+        return 0, 0
+
+    reachable = _object_names(repo, kept[0], len(kept) - 1) if kept else set()
+
+    _, refs = repo.list_refs(None, None)
+    for checksum in set(refs.values()) - set(kept) - set(pruned):
+        reachable |= _object_names(repo, checksum, -1)
+
+    unique = _object_names(repo, pruned[0], len(pruned) - 1) - reachable
+
+    total = 0
+    for checksum, objtype in unique:
+        _, size = repo.query_object_storage_size(objtype, checksum, None)
+        total += size
+
+    return len(unique), total
+
+
+def delete_commits(repo_path: str | os.PathLike, commits: typing.Iterable[str]) -> dict:
+    """
+    Удаляет коммиты и static-delta к ним, затем недостижимые из веток объекты; обновляет summary.
+    :return: число просмотренных и удаленных объектов и освобожденный объем
+    """
+    repo = OSTree.Repo.new(Gio.File.new_for_path(str(repo_path)))
+    repo.open(None)
+
+    for commit_id in commits:
+        repo.delete_object(OSTree.ObjectType.COMMIT, commit_id, None)
+
+    repo.prune_static_deltas(None, None)
+    _, objects_total, objects_pruned, pruned_bytes = repo.prune(OSTree.RepoPruneFlags.REFS_ONLY, -1, None)
+    repo.regenerate_summary(None, None)
+
+    return {
+        "objects_total": objects_total,
+        "objects_pruned": objects_pruned,
+        "bytes": pruned_bytes,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Delete commits and prune unreachable objects of a bare repo")
+    parser.add_argument("--repo", required=True)
+    parser.add_argument("--delete-commit", action="append", default=[], metavar="COMMIT")
+    args = parser.parse_args()
+
+    print(json.dumps(delete_commits(args.repo, args.delete_commit)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import time
+import typing
+
+
+class CycleError(Exception):
+    pass
+
+
+class Task:
+    """
+    Узел графа сборки.
+    :param func: выполняемое действие
+    :param deps: задачи, которые должны завершиться до запуска этой
+    :param lock: фабрика контекстного менеджера, удерживаемого на время выполнения (например, блокировка ветки)
+    """
+
+    __slots__ = (
+        "_name",
+        "_func",
+        "_deps",
+        "_lock",
+        "_started",
+        "_finished",
+        "_result",
+    )
+
+    def __init__(self,
+                 name: str,
+                 func: typing.Callable[[], typing.Any],
+                 deps: typing.Iterable[Task] = (),
+                 lock: typing.Callable[[], typing.ContextManager] | None = None) -> None:
+        self._name = name
+        self._func = func
+        self._deps = tuple(deps)
+        self._lock = lock
+        self._started = None
+        self._finished = None
+        self._result = None
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def deps(self) -> tuple[Task, ...]:
+        return self._deps
+
+    @property
+    def result(self) -> typing.Any:
+        return self._result
+
+    @property
+    def duration(self) -> float:
+        """Время выполнения задачи в секундах (0, если задача не выполнялась)"""
+        if self._started is None or self._finished is None:
+            return 0.0
+        return self._finished - self._started
+
+    def run(self) -> typing.Any:
+        logging.info(f"start task :: {self._name}")
+
+        self._started = time.monotonic()
+        try:
+            if self._lock:
+                with self._lock():
+                    self._result = self._func()
+            else:
+                self._result = self._func()
+        finally:
+            self._finished = time.monotonic()
+
+        logging.info(f"finish task :: {self._name} ({self.duration:.1f}s)")
+        return self._result
+
+    def __repr__(self) -> str:
+        return f"Task({self._name!r})"
+
+
+class Scheduler:
+    """
+    Выполняет граф задач пулом потоков: задача запускается, как только завершены все ее зависимости.
+    После выполнения позволяет получить критический путь графа по фактическому времени задач.
+    """
+
+    __slots__ = (
+        "_tasks",
+        "_workers",
+    )
+
+    def __init__(self, workers: int = 4) -> None:
+        self._tasks: dict[str, Task] = {}
+        self._workers = workers
+
+    @property
+    def tasks(self) -> list[Task]:
+        return list(self._tasks.values())
+
+    def add(self, task: Task) -> Task:
+        if task.name in self._tasks:
+            raise ValueError(f"Task {task.name} already exists")
+
+        for dep in task.deps:
+            if dep.name not in self._tasks:
+                raise ValueError(f"Dependency {dep.name} of task {task.name} is not scheduled")
+
+        self._tasks[task.name] = task
+        return task
+
+    def run(self) -> dict[str, typing.Any]:
+        """
+        Выполняет все задачи.
+        При ошибке новые задачи не запускаются, уже запущенные дожидаются завершения, исключение пробрасывается.
+        :return: результаты задач по именам
+        """
+        waiting = {task: set(task.deps) for task in self.tasks}
+        dependents: dict[Task, list[Task]] = {task: [] for task in waiting}
+        for task in waiting:
+            for dep in task.deps:
+                dependents[dep].append(task)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            running = {}
+
+            def submit_ready() -> None:
+                for task in [task for task, deps in waiting.items() if not deps]:
+                    del waiting[task]
+                    running[executor.submit(task.run)] = task
+
+            submit_ready()
+
+            while running:
+                done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_EXCEPTION)
+
+                for future in done:
+                    task = running.pop(future)
+                    if future.exception():
+                        for pending in running:
+                            pending.cancel()
+                        concurrent.futures.wait(running)
+                        raise future.exception()
+
+                    for dependent in dependents[task]:
+                        waiting[dependent].discard(task)
+
+                submit_ready()
+
+        if waiting:
+            raise CycleError(f"Tasks {sorted(task.name for task in waiting)} have cyclic dependencies")
+
+        return {task.name: task.result for task in self.tasks}
+
+    def critical_path(self) -> tuple[list[Task], float]:
+        """
+        Самая длинная по суммарному времени цепочка зависимых задач.
+        :return: задачи цепочки в порядке выполнения и ее длительность в секундах
+        """
+        best: dict[Task, tuple[float, Task | None]] = {}
+
+        # Задачи добавляются только после своих зависимостей, поэтому порядок вставки топологический
+        for task in self.tasks:
+            prev = max(task.deps, key=lambda dep: best[dep][0], default=None)
+            best[task] = (task.duration + (best[prev][0] if prev else 0.0), prev)
+
+        if not best:
+            return [], 0.0
+
+        last = max(best, key=lambda task: best[task][0])
+        total = best[last][0]
+
+        path = []
+        while last:
+            path.append(last)
+            last = best[last][1]
+
+        return path[::-1], total
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import contextlib
+import contextvars
+import functools
+import inspect
+import itertools
+import json
+import os
+import pathlib
+import resource
+import shutil
+import tempfile
+import threading
+import time
+import typing
+
+
+class Span:
+    """
+    Интервал выполнения операции сборки.
+    Счетчики (процессорное время, записанные байты) снимаются для всего процесса,
+    поэтому у параллельно выполняющихся span'ов они пересекаются.
+    children_rss_high_water - не пик span'а, а накопленный максимум: наибольший RSS среди всех
+    дочерних процессов, завершившихся с запуска процесса до конца span'а (ru_maxrss для RUSAGE_CHILDREN
+    не сбрасывается). Он растет только тогда, когда span запустил процесс крупнее всех предыдущих.
+    """
+
+    __slots__ = (
+        "name",
+        "attrs",
+        "span_id",
+        "parent_id",
+        "thread_id",
+        "start",
+        "wall",
+        "cpu",
+        "children_rss_high_water",
+        "bytes_written",
+        "error",
+    )
+
+    def __init__(self,
+                 name: str,
+                 attrs: dict[str, typing.Any] | None = None,
+                 parent_id: int | None = None,
+                 start: float | None = None) -> None:
+        self.name = name
+        self.attrs = attrs or {}
+        self.span_id = next(_IDS)
+        self.parent_id = parent_id
+        self.thread_id = threading.get_native_id()
+        self.start = time.time() if start is None else start
+        self.wall: float | None = None
+        self.cpu: float | None = None
+        self.children_rss_high_water: int | None = None
+        self.bytes_written: int | None = None
+        self.error: str | None = None
+
+    def as_dict(self) -> dict[str, typing.Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Exporter(typing.Protocol):
+    def export(self, span: Span) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class JsonLinesExporter:
+    """Дописывает каждый завершенный span строкой JSON в файл"""
+
+    __slots__ = (
+        "_path",
+        "_lock",
+    )
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self._path = pathlib.Path(path)
+        self._lock = threading.Lock()
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.as_dict(), default=str)
+        with self._lock, self._path.open("a") as file:
+            file.write(line + "\n")
+
+    def close(self) -> None:
+        pass
+
+
+class ChromeTraceExporter:
+    """
+    Собирает span'ы в формате Chrome trace (chrome://tracing, Perfetto).
+    Файл записывается при закрытии экспортера.
+    """
+
+    __slots__ = (
+        "_path",
+        "_lock",
+        "_events",
+    )
+
+    def __init__(self, path: str | os.PathLike) -> None:
+        self._path = pathlib.Path(path)
+        self._lock = threading.Lock()
+        self._events = []
+
+    @property
+    def path(self) -> pathlib.Path:
+        return self._path
+
+    def export(self, span: Span) -> None:
+        args = {**span.attrs,
+                "cpu": span.cpu,
+                "children_rss_high_water": span.children_rss_high_water,
+                "bytes_written": span.bytes_written}
+        if span.error:
+            args["error"] = span.error
+
+        event = {
+            "name": span.name,
+            "ph": "X",
+            "ts": int(span.start * 1e6),
+            "dur": int((span.wall or 0) * 1e6),
+            "pid": os.getpid(),
+            "tid": span.thread_id,
+            "args": {k: v for k, v in args.items() if v is not None},
+        }
+        with self._lock:
+            self._events.append(event)
+
+    def close(self) -> None:
+        with self._lock:
+            events = list(self._events)
+
+        tmp_file = self._path.with_name(f".{self._path.name}.tmp")
+        tmp_file.write_text(json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str))
+        tmp_file.replace(self._path)
+
+
+_IDS = itertools.count(1)
+_CURRENT: contextvars.ContextVar[Span | None] = contextvars.ContextVar("acoslib_span", default=None)
+_EXPORTERS: list[Exporter] = []
+
+
+def add_exporter(exporter: Exporter) -> Exporter:
+    _EXPORTERS.append(exporter)
+    return exporter
+
+
+def remove_exporter(exporter: Exporter) -> None:
+    """Отключает экспортер и закрывает его (Chrome trace записывается в этот момент)"""
+    with contextlib.suppress(ValueError):
+        _EXPORTERS.remove(exporter)
+    exporter.close()
+
+
+def enabled() -> bool:
+    return bool(_EXPORTERS)
+
+
+def current() -> Span | None:
+    return _CURRENT.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attrs) -> typing.Iterator[Span | None]:
+    """
+    Измеряет выполнение блока как span, вложенный в текущий.
+    Без подключенных экспортеров ничего не измеряет и возвращает None.
+    """
+    if not _EXPORTERS:
+        yield None
+        return
+
+    parent = _CURRENT.get()
+    item = Span(name, attrs, parent.span_id if parent else None)
+    token = _CURRENT.set(item)
+
+    start = time.monotonic()
+    cpu_start = _cpu_time()
+    written_start = _bytes_written()
+    try:
+        yield item
+    except BaseException as e:
+        item.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _CURRENT.reset(token)
+
+        item.wall = time.monotonic() - start
+        item.cpu = _cpu_time() - cpu_start
+        item.children_rss_high_water = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+        if written_start is not None and (written := _bytes_written()) is not None:
+            item.bytes_written = written - written_start
+
+        _export(item)
+
+
+def traced(name: str, **attrs) -> typing.Callable:
+    """
+    Декоратор: выполняет функцию (или сопрограмму) внутри span'а name.
+    Если первый аргумент связан с веткой (Reference, AltConf, RPM, образ), в атрибуты попадает ее имя.
+    """
+
+    def decorator(func: typing.Callable) -> typing.Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, **_ref_attrs(args), **attrs):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, **_ref_attrs(args), **attrs):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(func: typing.Callable) -> typing.Callable:
+    """
+    Привязывает функцию к текущему span'у, чтобы span'ы, открытые в ней в пуле потоков,
+    оставались его потомками (потоки пула не наследуют контекст).
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def script_phases() -> typing.Iterator[str]:
+    """
+    Префикс окружения для сценария, размечающего свои фазы функцией trace_phase (scripts/functions.sh).
+    После выполнения блока фазы сценария экспортируются как дочерние span'ы текущего.
+    """
+    if not _EXPORTERS:
+        yield ""
+        return
+
+    # Файл доступен только владельцу (сценарии, запущенные через sudo, пишут в него от root)
+    trace_dir = tempfile.mkdtemp(prefix="acoslib-trace-")
+    trace_file = os.path.join(trace_dir, "phases.jsonl")
+    os.close(os.open(trace_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+    try:
+        yield f"ACOSLIB_TRACE_FILE={trace_file} "
+    finally:
+        try:
+            parent = _CURRENT.get()
+            for line in pathlib.Path(trace_file).read_text().splitlines():
+                record = json.loads(line)
+
+                item = Span(record["name"], {"returncode": record["returncode"]},
+                            parent.span_id if parent else None,
+                            start=record["start"])
+                item.wall = record["end"] - record["start"]
+                _export(item)
+        finally:
+            shutil.rmtree(trace_dir, ignore_errors=True)
+
+
+def _export(item: Span) -> None:
+    for exporter in list(_EXPORTERS):
+        exporter.export(item)
+
+
+def _ref_attrs(args: tuple) -> dict[str, str]:
+    if not args:
+        return {}
+
+    obj = args[0]
+    for attr in ("subref", "reference"):
+        if not hasattr(obj, "ostree_ref") and hasattr(obj, attr):
+            obj = getattr(obj, attr)
+
+    return {"ref": str(obj.ostree_ref)} if hasattr(obj, "ostree_ref") else {}
+
+
+def _cpu_time() -> float:
+    """Процессорное время процесса и его завершившихся дочерних процессов"""
+    usage = [resource.getrusage(who) for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    return sum(u.ru_utime + u.ru_stime for u in usage)
+
+
+def _bytes_written() -> int | None:
+    """Байты, записанные на устройства процессом и его завершившимися дочерними процессами"""
+    try:
+        with open("/proc/self/io") as file:
+            for line in file:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
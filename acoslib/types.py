@@ -12,4 +12,5 @@ class Stream(enum.Enum):
 
 class ImageFormat(enum.Enum):
     QCOW = "qcow2"
+    RAW = "raw"
     ISO = "iso"
@@ -1,8 +1,52 @@
+import asyncio
+import collections
+import contextlib
+import gzip
 import logging
+import os
+import signal
 import subprocess
+import typing
+import weakref
 
+# Ресурсы, доступ к которым ограничивается при асинхронном запуске команд
+LOOP_DEVICE = "loop_device"
+NETWORK = "network"
+ROOT = "root"
+
+_LIMITS = {
+    LOOP_DEVICE: 4,
+    NETWORK: 4,
+    ROOT: 8,
+}
+
+# Число последних строк вывода, сохраняемых для отчета об ошибке в потоковом режиме
+TAIL_SIZE = 200
+
+_SEMAPHORES: weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, asyncio.Semaphore]] = \
+    weakref.WeakKeyDictionary()
+
+
+def runcmd(cmd: str,
+           quite: bool = False,
+           stream: bool = False,
+           callback: typing.Callable[[str], None] | None = None,
+           log_file: str | os.PathLike | None = None) -> subprocess.CompletedProcess:
+    """
+    Выполняет команду оболочки.
+    :param stream: читать вывод построчно по мере поступления, не накапливая его в памяти
+    :param callback: обработчик строк вывода в потоковом режиме (по умолчанию строки пишутся в лог)
+    :param log_file: файл, в который дописывается полный вывод команды (gzip)
+    В потоковом режиме stderr объединяется со stdout, а в результате остаются только последние TAIL_SIZE строк.
+    """
+    if stream or callback or log_file:
+        tail = collections.deque(maxlen=TAIL_SIZE)
+
+        for line in iterlines(cmd, quite=quite, log_file=log_file, tail=tail):
+            handle_line(line, quite, callback)
+
+        return subprocess.CompletedProcess(cmd, 0, "\n".join(tail).encode(), b"")
 
-def runcmd(cmd: str, quite: bool = False) -> subprocess.CompletedProcess:
     if not quite:
         logging.info(f"start command :: `{cmd}`")
 
@@ -25,3 +69,171 @@ def runcmd(cmd: str, quite: bool = False) -> subprocess.CompletedProcess:
 
     return cp
 
+
+def iterlines(cmd: str,
+              quite: bool = False,
+              log_file: str | os.PathLike | None = None,
+              tail: collections.deque | None = None) -> typing.Iterator[str]:
+    """
+    Выполняет команду и возвращает итератор по строкам ее вывода (stderr объединяется со stdout).
+    :param tail: кольцевой буфер последних строк; при ненулевом коде возврата они попадают в лог и в исключение
+    Если итератор закрыт до завершения команды, процесс уничтожается.
+    """
+    if tail is None:
+        tail = collections.deque(maxlen=TAIL_SIZE)
+
+    if not quite:
+        logging.info(f"start command :: `{cmd}`")
+
+    with contextlib.ExitStack() as stack:
+        spool = stack.enter_context(gzip.open(log_file, "at")) if log_file else None
+        proc = stack.enter_context(subprocess.Popen(cmd,
+                                                    shell=True,
+                                                    stdout=subprocess.PIPE,
+                                                    stderr=subprocess.STDOUT,
+                                                    start_new_session=True))
+        finished = False
+        try:
+            for raw in proc.stdout:
+                line = raw.decode(errors="replace").rstrip("\n")
+                tail.append(line)
+                if spool:
+                    spool.write(line + "\n")
+                yield line
+            finished = True
+        finally:
+            if not finished:
+                kill_group(proc)
+
+        returncode = proc.wait()
+
+    if returncode:
+        raise_with_tail(cmd, returncode, tail)
+
+
+def set_limit(resource: str, limit: int) -> None:
+    """
+    Задает максимальное число одновременно выполняемых команд, использующих ресурс.
+    Действует на семафоры, созданные после вызова.
+    """
+    if limit < 1:
+        raise ValueError(f"Limit for {resource} must be positive")
+
+    _LIMITS[resource] = limit
+
+    for semaphores in _SEMAPHORES.values():
+        semaphores.pop(resource, None)
+
+
+def _semaphore(resource: str) -> asyncio.Semaphore:
+    semaphores = _SEMAPHORES.setdefault(asyncio.get_running_loop(), {})
+
+    if resource not in semaphores:
+        semaphores[resource] = asyncio.Semaphore(_LIMITS.get(resource, 1))
+
+    return semaphores[resource]
+
+
+def kill_group(proc: subprocess.Popen | asyncio.subprocess.Process) -> None:
+    """Убивает группу процессов, запущенную с start_new_session (команда вместе с ее потомками)"""
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+def handle_line(line: str, quite: bool, callback: typing.Callable[[str], None] | None) -> None:
+    """Передает строку вывода команды в callback или, если он не задан, в лог"""
+    if callback:
+        callback(line)
+    elif not quite:
+        logging.info(f" OUTPUT :: {line}")
+
+
+def raise_with_tail(cmd: str, returncode: int, tail: collections.deque) -> typing.NoReturn:
+    """Пишет в лог последние строки вывода упавшей команды и бросает subprocess.CalledProcessError с ними"""
+    output = "\n".join(tail)
+    if output:
+        logging.error(f" OUTPUT (last {len(tail)} lines) :: {output}")
+
+    raise subprocess.CalledProcessError(returncode, cmd, output.encode(), b"")
+
+
+async def _astream(proc: asyncio.subprocess.Process,
+                   quite: bool,
+                   callback: typing.Callable[[str], None] | None,
+                   log_file: str | os.PathLike | None,
+                   tail: collections.deque) -> None:
+    with gzip.open(log_file, "at") if log_file else contextlib.nullcontext() as spool:
+        async for raw in proc.stdout:
+            line = raw.decode(errors="replace").rstrip("\n")
+            tail.append(line)
+            if spool:
+                spool.write(line + "\n")
+            handle_line(line, quite, callback)
+            # Буферизованные строки читаются без переключения задач; уступаем циклу, чтобы сработали отмена и таймаут
+            await asyncio.sleep(0)
+
+    await proc.wait()
+
+
+async def arun(cmd: str,
+               quite: bool = False,
+               timeout: float | None = None,
+               resources: tuple[str, ...] = (),
+               stream: bool = False,
+               callback: typing.Callable[[str], None] | None = None,
+               log_file: str | os.PathLike | None = None) -> subprocess.CompletedProcess:
+    """
+    Асинхронный аналог runcmd (параметры stream, callback и log_file имеют тот же смысл).
+    :param timeout: время ожидания в секундах, по истечении которого команда завершается (subprocess.TimeoutExpired)
+    :param resources: ресурсы (LOOP_DEVICE, NETWORK, ROOT, ...), слоты которых занимает команда
+    При отмене задачи или истечении таймаута вся группа процессов команды уничтожается.
+    """
+    async with contextlib.AsyncExitStack() as stack:
+        # Семафоры захватываются в фиксированном порядке, чтобы исключить взаимную блокировку
+        for resource in sorted(set(resources)):
+            await stack.enter_async_context(_semaphore(resource))
+
+        if not quite:
+            logging.info(f"start command :: `{cmd}`")
+
+        stream = stream or callback is not None or log_file is not None
+        tail = collections.deque(maxlen=TAIL_SIZE)
+
+        proc = await asyncio.create_subprocess_shell(
+            cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if stream else asyncio.subprocess.PIPE,
+            start_new_session=True)
+        try:
+            if stream:
+                await asyncio.wait_for(_astream(proc, quite, callback, log_file, tail), timeout)
+            else:
+                stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            kill_group(proc)
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except asyncio.CancelledError:
+            kill_group(proc)
+            await proc.wait()
+            raise
+
+    if stream:
+        if proc.returncode:
+            raise_with_tail(cmd, proc.returncode, tail)
+
+        return subprocess.CompletedProcess(cmd, proc.returncode, "\n".join(tail).encode(), b"")
+
+    if proc.returncode:
+        if stdout:
+            logging.error(f" STDOUT :: {stdout.decode()}")
+        if stderr:
+            logging.error(f" STDERR :: {stderr.decode()}")
+
+        raise subprocess.CalledProcessError(proc.returncode, cmd, stdout, stderr)
+
+    if not quite:
+        logging.info(f" STDOUT :: {stdout.decode()}")
+        logging.info(f" STDERR :: {stderr.decode()}")
+
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import pathlib
+import subprocess
+import threading
+
+_CHUNK_SIZE = 4 << 20
+
+# Многопоточные (блочные) компрессоры: команда и расширение сжатого файла
+CODECS = {
+    "zstd": (["zstd", "-q", "-T0", "-c"], ".zst"),
+    "xz": (["xz", "-T0", "-c"], ".xz"),
+}
+
+
+def suffix(codec: str) -> str:
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec {codec}, expected one of {sorted(CODECS)}")
+    return CODECS[codec][1]
+
+
+def digest_and_compress(src: str | os.PathLike,
+                        dst: str | os.PathLike | None = None,
+                        codec: str = "zstd",
+                        level: int | None = None) -> tuple[str, str | None]:
+    """
+    За одно чтение файла считает его sha256 и (если задан dst) сжимает его внешним многопоточным компрессором.
+    Сжатый поток хешируется по мере записи; dst появляется атомарно только после успешного сжатия.
+    :return: sha256 исходного файла и sha256 сжатого файла (None, если сжатие не выполнялось)
+    """
+    src_digest = hashlib.sha256()
+
+    if dst is None:
+        with open(src, "rb") as file:
+            while chunk := file.read(_CHUNK_SIZE):
+                src_digest.update(chunk)
+        return src_digest.hexdigest(), None
+
+    suffix(codec)
+    cmd = [*CODECS[codec][0], *([f"-{level}"] if level is not None else [])]
+
+    dst = pathlib.Path(dst)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+    dst_digest = hashlib.sha256()
+    errors = []
+
+    def drain(proc: subprocess.Popen, out) -> None:
+        try:
+            while chunk := proc.stdout.read(_CHUNK_SIZE):
+                dst_digest.update(chunk)
+                out.write(chunk)
+        except BaseException as e:
+            errors.append(e)
+            # Без чтения stdout компрессор встанет на записи, а запись в его stdin - навсегда;
+            # после его завершения запись в stdin прервется BrokenPipeError
+            proc.kill()
+
+    try:
+        with open(src, "rb") as file, tmp.open("wb") as out:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            reader = threading.Thread(target=drain, args=(proc, out))
+            reader.start()
+            try:
+                while chunk := file.read(_CHUNK_SIZE):
+                    src_digest.update(chunk)
+                    proc.stdin.write(chunk)
+            except BrokenPipeError:
+                if not errors:
+                    raise
+            finally:
+                with contextlib.suppress(BrokenPipeError):
+                    proc.stdin.close()
+                reader.join()
+                returncode = proc.wait()
+                proc.stdout.close()
+
+        if errors:
+            raise errors[0]
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+        tmp.replace(dst)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+    return src_digest.hexdigest(), dst_digest.hexdigest()
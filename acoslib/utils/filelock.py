@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import contextvars
+import fcntl
+import os
+import pathlib
+import typing
+
+
+# Файлы, исключительная блокировка которых уже захвачена в текущем контексте выполнения
+_HELD: contextvars.ContextVar[frozenset[pathlib.Path]] = contextvars.ContextVar("acoslib_flocks", default=frozenset())
+
+
+@contextlib.contextmanager
+def flock(path: str | os.PathLike, shared: bool = False) -> typing.Iterator[pathlib.Path]:
+    """
+    Захватывает advisory-блокировку файла (fcntl.flock) на время выполнения блока.
+    Блокировка действует между процессами, поэтому защищает общий stream_root от параллельных сборок.
+    Повторный захват в том же контексте (вложенный вызов, сопрограмма или поток, унаследовавшие контекст)
+    при уже захваченной исключительной блокировке не ждет: иначе процесс ждал бы сам себя.
+    :param shared: разделяемая блокировка (несколько читателей) вместо исключительной
+    """
+    path = pathlib.Path(path).absolute()
+    if path in _HELD.get():
+        yield path
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with path.open("a") as file:
+        fcntl.flock(file, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        token = None if shared else _HELD.set(_HELD.get() | {path})
+        try:
+            yield path
+        finally:
+            if token is not None:
+                _HELD.reset(token)
+            fcntl.flock(file, fcntl.LOCK_UN)
+
+
+@contextlib.asynccontextmanager
+async def aflock(path: str | os.PathLike, poll: float = 0.1) -> typing.AsyncIterator[pathlib.Path]:
+    """Исключительная блокировка flock для сопрограмм: ожидание не блокирует цикл событий"""
+    path = pathlib.Path(path).absolute()
+    if path in _HELD.get():
+        yield path
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    with path.open("a") as file:
+        while True:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                await asyncio.sleep(poll)
+
+        token = _HELD.set(_HELD.get() | {path})
+        try:
+            yield path
+        finally:
+            _HELD.reset(token)
+            fcntl.flock(file, fcntl.LOCK_UN)
@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import pathlib
+import stat
+
+_CHUNK_SIZE = 1 << 20
+
+
+def hash_file(path: str | os.PathLike) -> str:
+    """sha256 содержимого файла"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_tree(root: str | os.PathLike) -> str:
+    """
+    sha256 дерева каталогов: учитываются относительные пути, права, цели ссылок и содержимое файлов.
+    Время модификации не учитывается, поэтому копия дерева дает тот же хеш.
+    """
+    root = pathlib.Path(root)
+    digest = hashlib.sha256()
+
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(dirnames + filenames):
+            path = pathlib.Path(dirpath, name)
+            st = path.lstat()
+
+            digest.update(f"{path.relative_to(root)}\0{st.st_mode:o}\0".encode())
+            if stat.S_ISLNK(st.st_mode):
+                digest.update(os.readlink(path).encode())
+            elif stat.S_ISREG(st.st_mode):
+                digest.update(hash_file(path).encode())
+            digest.update(b"\0")
+
+    return digest.hexdigest()
+
+
+def combine(*parts: str | None) -> str:
+    """sha256 от упорядоченного набора частей (отсутствующие части учитываются как пустые)"""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
@@ -0,0 +1,66 @@
+"""
+Отложенная загрузка libostree через gi.
+
+Загрузка typelib'ов OSTree/Gio/GLib заметно увеличивает время импорта библиотеки,
+хотя многим операциям (имена веток, каталоги, индекс, образы) репозиторий не нужен.
+Модули gi.repository загружаются при первом обращении к атрибуту заместителя:
+
+    from acoslib.utils.lazygi import OSTree, GLib
+
+    repo = OSTree.Repo.new(...)   # здесь загружается gi
+    except GLib.GError: ...       # выражение в except вычисляется только при исключении
+"""
+from __future__ import annotations
+
+import importlib
+import threading
+import types
+
+_VERSIONS = {
+    "OSTree": "1.0",
+}
+
+_lock = threading.Lock()
+
+
+class LazyModule:
+    __slots__ = (
+        "_name",
+        "_module",
+    )
+
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._module: types.ModuleType | None = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def load(self) -> types.ModuleType:
+        if self._module is None:
+            with _lock:
+                if self._module is None:
+                    self._module = _import(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<lazy gi.repository.{self._name} ({state})>"
+
+
+def _import(name: str) -> types.ModuleType:
+    import gi
+
+    for namespace, version in _VERSIONS.items():
+        gi.require_version(namespace, version)
+
+    return importlib.import_module(f"gi.repository.{name}")
+
+
+OSTree = LazyModule("OSTree")
+Gio = LazyModule("Gio")
+GLib = LazyModule("GLib")
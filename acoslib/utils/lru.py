@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import os
+import pathlib
+import shutil
+import typing
+
+
+def disk_usage(path: str | os.PathLike) -> int:
+    """
+    Размер файла или дерева каталогов в байтах (жесткие ссылки учитываются один раз).
+    Символические ссылки не разыменовываются: ссылка учитывается своим размером, а не размером цели.
+    """
+    path = pathlib.Path(path)
+    if path.is_symlink() or not path.is_dir():
+        return path.lstat().st_blocks * 512 if os.path.lexists(path) else 0
+
+    seen = set()
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            total += st.st_blocks * 512
+
+    return total
+
+
+def exclusive_usage(path: str | os.PathLike) -> int:
+    """
+    Объем в байтах, который освободится при удалении дерева каталогов:
+    каталоги и файлы, все жесткие ссылки на которые находятся внутри дерева.
+    Файлы, разделяемые с другими деревьями (например, объекты bare-репозитория в checkout'е), не учитываются.
+    """
+    path = pathlib.Path(path)
+    if path.is_symlink() or not path.is_dir():
+        return disk_usage(path)
+
+    inodes = {}
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        total += os.lstat(dirpath).st_blocks * 512
+        for name in filenames:
+            st = os.lstat(os.path.join(dirpath, name))
+            blocks, nlink, seen = inodes.get((st.st_dev, st.st_ino), (st.st_blocks, st.st_nlink, 0))
+            inodes[(st.st_dev, st.st_ino)] = (blocks, nlink, seen + 1)
+
+    return total + sum(blocks * 512 for blocks, nlink, seen in inodes.values() if seen >= nlink)
+
+
+def touch(path: str | os.PathLike) -> None:
+    """Отмечает запись кэша как использованную (время модификации служит меткой LRU)"""
+    os.utime(path, follow_symlinks=False)
+
+
+def evict(root: str | os.PathLike,
+          max_size: int,
+          keep: typing.Container[str] = (),
+          remove: typing.Callable[[pathlib.Path], None] | None = None,
+          usage: typing.Callable[[pathlib.Path], tuple[float, int]] | None = None) -> list[pathlib.Path]:
+    """
+    Удаляет давно не использованные записи каталога-кэша, пока его размер превышает max_size.
+    Записью считается каждый непосредственный потомок root; порядок определяется временем модификации.
+    :param keep: имена записей, которые нельзя удалять (используемые в данный момент)
+    :param remove: функция удаления записи (например, от root для деревьев, принадлежащих root)
+    :param usage: время последнего использования и размер записи,
+        если они хранятся отдельно от нее (по умолчанию - время модификации и disk_usage)
+    :return: удаленные записи
+    """
+    root = pathlib.Path(root)
+    if not root.exists():
+        return []
+
+    usage = usage or (lambda entry: (entry.lstat().st_mtime, disk_usage(entry)))
+    entries = [(entry, *usage(entry)) for entry in root.iterdir() if not entry.name.startswith(".")]
+    total = sum(size for _, _, size in entries)
+
+    removed = []
+    for entry, _, size in sorted(entries, key=lambda item: item[1]):
+        if total <= max_size:
+            break
+        if entry.name in keep:
+            continue
+
+        if remove is not None:
+            remove(entry)
+        elif entry.is_dir() and not entry.is_symlink():
+            shutil.rmtree(entry)
+        else:
+            entry.unlink()
+
+        total -= size
+        removed.append(entry)
+
+    return removed
@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import collections
+import logging
+import shlex
+import subprocess
+import time
+import typing
+import uuid
+
+from acoslib.utils import cmdlib
+
+
+class CommandResult(typing.NamedTuple):
+    name: str
+    returncode: int
+    duration: float
+    output: str
+
+
+class ShellSession:
+    """
+    Долгоживущая оболочка, команды которой передаются через stdin.
+    Переменные экспортируются в сессию один раз и доступны всем последующим командам.
+    Каждая команда выполняется в подоболочке (exit и cd не затрагивают сессию),
+    конец ее вывода отмечается строкой-маркером с кодом возврата.
+    """
+
+    __slots__ = (
+        "_cmd",
+        "_quite",
+        "_proc",
+        "_marker",
+    )
+
+    def __init__(self, cmd: str = "bash --noprofile --norc", quite: bool = False) -> None:
+        self._cmd = cmd
+        self._quite = quite
+        self._proc: subprocess.Popen | None = None
+        self._marker = f"__acoslib_{uuid.uuid4().hex}__"
+
+    def __enter__(self) -> ShellSession:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def running(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> ShellSession:
+        if not self._quite:
+            logging.info(f"start session :: `{self._cmd}`")
+
+        self._proc = subprocess.Popen(self._cmd,
+                                      shell=True,
+                                      stdin=subprocess.PIPE,
+                                      stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT,
+                                      start_new_session=True)
+        return self
+
+    def close(self) -> None:
+        if self._proc is None:
+            return
+
+        try:
+            self._proc.stdin.close()
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            cmdlib.kill_group(self._proc)
+            self._proc.wait()
+        finally:
+            self._proc.stdout.close()
+            self._proc = None
+
+    def export(self, name: str, value: str) -> None:
+        """Экспортирует переменную в сессию (значение передается как есть, без подстановок)"""
+        self._write(f"export {name}={shlex.quote(value)}\n")
+
+    def run(self,
+            cmd: str,
+            name: str | None = None,
+            callback: typing.Callable[[str], None] | None = None,
+            check: bool = True) -> CommandResult:
+        """
+        Выполняет команду в сессии, передавая строки вывода в лог (или callback) по мере поступления.
+        :param check: при ненулевом коде возврата бросать subprocess.CalledProcessError
+        :return: код возврата, время выполнения и полный вывод команды
+        """
+        name = name or cmd
+        if not self._quite:
+            logging.info(f"session command :: `{cmd}`")
+
+        start = time.monotonic()
+        # stdin команды отвязан от сессии, иначе она прочитала бы следующие команды
+        self._write(f"( eval {shlex.quote(cmd)} ) </dev/null\nprintf '\\n%s %d\\n' {self._marker} $?\n")
+
+        chunks = []
+        tail = collections.deque(maxlen=cmdlib.TAIL_SIZE)
+        returncode = None
+
+        for raw in self._proc.stdout:
+            text = raw.decode(errors="replace")
+
+            if text.startswith(self._marker):
+                returncode = int(text.split()[1])
+                break
+
+            chunks.append(text)
+            line = text.rstrip("\n")
+            tail.append(line)
+            cmdlib.handle_line(line, self._quite, callback)
+
+        if returncode is None:
+            raise subprocess.CalledProcessError(self._proc.wait(), self._cmd, "".join(chunks).encode(), b"")
+
+        # Маркер печатается с новой строки; этот перевод строки не относится к выводу команды
+        output = "".join(chunks)[:-1]
+        result = CommandResult(name, returncode, time.monotonic() - start, output)
+
+        if not self._quite:
+            logging.info(f"session command finished :: {name} :: rc={returncode} {result.duration:.2f}s")
+
+        if check and returncode:
+            cmdlib.raise_with_tail(cmd, returncode, tail)
+
+        return result
+
+    def _write(self, data: str) -> None:
+        if not self.running:
+            raise RuntimeError(f"Session `{self._cmd}` is not running")
+
+        self._proc.stdin.write(data.encode())
+        self._proc.stdin.flush()
@@ -0,0 +1,81 @@
+"""
+Офлайн-замеры горячих путей acoslib.
+
+    python -m benchmarks                        # все замеры, сравнение с baseline.json
+    python -m benchmarks commit index           # только замеры, имя которых содержит подстроку
+    python -m benchmarks --save-baseline        # записать результаты как новую базовую линию
+    python -m benchmarks --baseline my.json --strict
+
+Лучший из повторов сравнивается с базовой линией; замедление больше --tolerance и больше --floor секунд
+выводится как REGRESSION. Базовая линия зависит от машины, поэтому регрессии и отсутствие линии - предупреждения;
+код возврата 1 при регрессии - только с --strict и линией, снятой на том же хосте (--baseline).
+Превышение абсолютного предела замера (например, времени запуска CLI) всегда дает код возврата 1.
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import sys
+
+from benchmarks import bench_cmdlib, bench_models, bench_startup, bench_storage  # noqa: F401 (регистрация замеров)
+from benchmarks.harness import (BASELINE, BENCHMARKS, NOISE_FLOOR, TOLERANCE, available, load_baseline, measure,
+                                missing_baseline, over_budget, regressions, save_baseline)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Offline acoslib benchmarks")
+    parser.add_argument("filters", nargs="*", help="run benchmarks whose name contains any of these substrings")
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--baseline", default=BASELINE, help="baseline file (default: %(default)s)")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--floor", type=float, default=NOISE_FLOOR,
+                        help="slowdowns below this many seconds are treated as noise")
+    parser.add_argument("--strict", action="store_true", help="exit with 1 on regressions against the baseline")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+
+    baseline = load_baseline(args.baseline)
+    results = []
+
+    print(f"{'benchmark':28} {'ops':>8} {'best, s':>10} {'median, s':>10} {'p95, s':>10} {'ops/s':>12} "
+          f"{'peak mem, KiB':>14} {'baseline':>9}")
+    for name, item in BENCHMARKS.items():
+        if args.filters and not any(f in name for f in args.filters):
+            continue
+        if not available(item):
+            print(f"{name:28} skipped (requires {', '.join(item.requires)})")
+            continue
+
+        result = measure(item)
+        results.append(result)
+
+        change = ""
+        if name in baseline:
+            base = baseline[name]
+            change = f"{(result.best / base.get('best', base['median']) - 1) * 100:+.0f}%"
+        print(f"{name:28} {result.ops:>8} {result.best:>10.4f} {result.median:>10.4f} {result.p95:>10.4f} "
+              f"{result.throughput:>12.1f} {result.peak_memory // 1024:>14} {change:>9}")
+
+    failed = False
+    for result, budget in over_budget(results):
+        print(f"OVER BUDGET {result.name}: {result.median:.4f}s > {budget:.4f}s", file=sys.stderr)
+        failed = True
+
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        return int(failed)
+
+    for result in missing_baseline(results, baseline):
+        print(f"NO BASELINE {result.name}: run with --save-baseline to record it", file=sys.stderr)
+
+    for result, base in regressions(results, baseline, args.tolerance, args.floor):
+        print(f"REGRESSION {result.name}: best {result.best:.4f}s vs baseline {base.get('best', base['median']):.4f}s",
+              file=sys.stderr)
+        failed = failed or args.strict
+
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
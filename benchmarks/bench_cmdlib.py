@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import asyncio
+import pathlib
+
+from acoslib.utils import cmdlib
+from acoslib.utils.shell import ShellSession
+from benchmarks import fixtures
+from benchmarks.harness import benchmark
+
+
+@benchmark("cmdlib.runcmd_latency")
+def runcmd_latency(workdir: pathlib.Path):
+    """Запуск короткой команды: стоимость порождения оболочки"""
+    def run() -> int:
+        for _ in range(50):
+            cmdlib.runcmd("true", quite=True)
+        return 50
+
+    return run
+
+
+@benchmark("cmdlib.runcmd_stream")
+def runcmd_stream(workdir: pathlib.Path):
+    """Потоковое чтение объемного вывода сценария (строк в секунду)"""
+    script = pathlib.Path(fixtures.stub_script_root(workdir), "cmd_apt-get_dist-upgrade.sh")
+    lines = 200_000
+
+    def run() -> int:
+        cmdlib.runcmd(f"STUB_LINES={lines} {script}", quite=True, stream=True, callback=lambda line: None)
+        return lines
+
+    return run
+
+
+@benchmark("cmdlib.arun_parallel")
+def arun_parallel(workdir: pathlib.Path):
+    """Параллельный запуск сценариев с задержкой через семафоры ресурсов"""
+    script = pathlib.Path(fixtures.stub_script_root(workdir), "cmd_ostree_checkout.sh")
+    commands = 32
+
+    async def main() -> None:
+        await asyncio.gather(*[cmdlib.arun(f"STUB_LATENCY=0.05 {script}", quite=True, resources=(cmdlib.ROOT,))
+                               for _ in range(commands)])
+
+    def run() -> int:
+        asyncio.run(main())
+        return commands
+
+    return run
+
+
+@benchmark("shell.session_latency")
+def session_latency(workdir: pathlib.Path):
+    """Команда в долгоживущей сессии оболочки (сравнить с cmdlib.runcmd_latency)"""
+    def run() -> int:
+        with ShellSession(quite=True) as session:
+            session.export("BENCH", "value")
+            for _ in range(200):
+                session.run('echo "$BENCH"')
+        return 200
+
+    return run
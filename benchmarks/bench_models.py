@@ -0,0 +1,85 @@
+"""Замеры моделей; не требуют root и сети, замеры истории коммитов требуют libostree (gi)"""
+from __future__ import annotations
+
+import pathlib
+
+import yaml
+
+from benchmarks import fixtures
+from benchmarks.harness import benchmark
+
+HISTORY = 5000
+
+
+@benchmark("commit.all", repeat=3, requires=("gi",))
+def commit_all(workdir: pathlib.Path):
+    """Обход и сортировка всей истории ветки (коммитов в секунду)"""
+    from acoslib import models
+
+    with fixtures.reference(workdir) as ref:
+        fixtures.ostree_history(ref, HISTORY)
+
+        def run() -> int:
+            return len(models.Commit(ref).all())
+
+        yield run
+
+
+@benchmark("commit.index", repeat=3, requires=("gi",))
+def commit_index(workdir: pathlib.Path):
+    """Полная индексация истории и поиск коммита по префиксу через индекс"""
+    from acoslib import models
+
+    with fixtures.reference(workdir) as ref:
+        checksums = fixtures.ostree_history(ref, HISTORY)
+
+        def run() -> int:
+            ref.index_path.unlink(missing_ok=True)
+            commit = models.Commit(ref)
+            for checksum in checksums[::50]:
+                commit.find(checksum[:10])
+            return HISTORY
+
+        yield run
+
+
+@benchmark("image.all")
+def image_all(workdir: pathlib.Path):
+    """Список образов формата в каталоге с большим числом файлов"""
+    from acoslib.images import QcowImage
+
+    with fixtures.reference(workdir) as ref:
+        images = 5000
+        fixtures.image_dir(ref.image_dir, QcowImage.FORMAT.value, images)
+
+        def run() -> int:
+            return len(QcowImage.all(ref))
+
+        yield run
+
+
+@benchmark("altconf.exec", repeat=3, requires=("gi",))
+def altconf_exec(workdir: pathlib.Path):
+    """Выполнение altconf из множества действий env и run на заглушках sudo/chroot и сценариев"""
+    from acoslib import models
+
+    with fixtures.reference(workdir) as ref:
+        fixtures.ostree_history(ref, 1)
+
+        actions = [{"env": {f"VAR{i}": f"value{i}-$VAR{i - 1}" for i in range(j * 10, j * 10 + 10)}}
+                   for j in range(5)]
+        actions += [{"run": [f"echo $VAR{i} > /dev/null"]} for i in range(20)]
+        actions += [{"butane": {"variant": "fcos", "version": "1.3.0"}}]
+
+        altconf = pathlib.Path(ref.repository.stream_root, ref.ostree_ref_dir, "altconf.yml")
+        altconf.parent.mkdir(parents=True, exist_ok=True)
+        altconf.write_text(yaml.safe_dump({"from": str(ref.ostree_ref), "actions": actions}))
+
+        merged_dir = pathlib.Path(workdir, "merged")
+        merged_dir.mkdir()
+
+        def run() -> int:
+            models.AltConf(ref).exec(str(merged_dir))
+            return len(actions)
+
+        yield run
@@ -0,0 +1,43 @@
+"""Замеры времени запуска; не требуют libostree"""
+from __future__ import annotations
+
+import pathlib
+import subprocess
+import sys
+
+from benchmarks import fixtures
+from benchmarks.harness import benchmark
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Предел времени запуска CLI для запросов, не трогающих репозиторий (cron и сценарии вызывают его сотни раз в день)
+STARTUP_BUDGET = 0.5
+
+
+def _python(*args: str, env: dict | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, check=True)
+
+
+@benchmark("cli.startup", repeat=10, budget=STARTUP_BUDGET)
+def cli_startup(workdir: pathlib.Path):
+    """Запуск `python -m acoslib ref` (без загрузки libostree)"""
+    args = ["-m", "acoslib",
+            "--stream-root", str(pathlib.Path(workdir, "streams")),
+            "--script-root", str(fixtures.stub_script_root(pathlib.Path(workdir, "scripts"))),
+            "ref", f"{fixtures.OSNAME}/{fixtures.ARCH}/{fixtures.STREAM}"]
+
+    def run() -> int:
+        _python(*args)
+        return 1
+
+    return run
+
+
+@benchmark("import.models", repeat=10, budget=STARTUP_BUDGET)
+def import_models(workdir: pathlib.Path):
+    """Импорт acoslib.models; gi не должен загружаться до обращения к репозиторию"""
+    def run() -> int:
+        _python("-c", "import sys, acoslib.models; sys.exit('gi' in sys.modules)")
+        return 1
+
+    return run
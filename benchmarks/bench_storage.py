@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import datetime
+import hashlib
+import pathlib
+
+from acoslib.catalog import ImageCatalog, ImageRecord
+from acoslib.index import CommitIndex
+from acoslib.types import ImageFormat
+from acoslib.utils import fingerprint, lru
+from acoslib.utils import compress as compression
+from benchmarks import fixtures
+from benchmarks.harness import benchmark
+
+
+def _sha(i: int) -> str:
+    return hashlib.sha256(str(i).encode()).hexdigest()
+
+
+@benchmark("index.add")
+def index_add(workdir: pathlib.Path):
+    """Индексация длинной истории одной транзакцией (коммитов в секунду)"""
+    commits = 5000
+    rows = [{"sha256": _sha(i),
+             "parent_id": _sha(i - 1) if i else None,
+             "version": f"{fixtures.STREAM}.20240101.0.{i}",
+             "date": datetime.datetime.fromtimestamp(1_700_000_000 + i, tz=datetime.timezone.utc),
+             "metadata": {"version": f"{fixtures.STREAM}.20240101.0.{i}"}}
+            for i in range(commits)]
+
+    def run() -> int:
+        pathlib.Path(workdir, CommitIndex.FILENAME).unlink(missing_ok=True)
+        with CommitIndex(pathlib.Path(workdir, CommitIndex.FILENAME)) as index:
+            index.add(rows)
+        return commits
+
+    return run
+
+
+@benchmark("index.lookup")
+def index_lookup(workdir: pathlib.Path):
+    """Поиск коммитов по префиксу и версии в индексе из 5000 коммитов"""
+    setup = index_add(workdir)
+    setup()
+    index = CommitIndex(pathlib.Path(workdir, CommitIndex.FILENAME))
+    lookups = 2000
+
+    def run() -> int:
+        for i in range(0, lookups, 2):
+            index.by_prefix(_sha(i)[:8])
+            index.version_of(_sha(i + 1))
+        return lookups
+
+    return run
+
+
+@benchmark("catalog.add_get")
+def catalog_add_get(workdir: pathlib.Path):
+    """Регистрация образов в каталоге (атомарная перезапись под блокировкой) и чтение"""
+    images = 200
+    fixtures.image_dir(workdir, ImageFormat.QCOW.value, images)
+
+    def run() -> int:
+        pathlib.Path(workdir, ImageCatalog.FILENAME).unlink(missing_ok=True)
+        catalog = ImageCatalog(workdir)
+
+        for i in range(images):
+            location = pathlib.Path(workdir, "qcow2", f"{fixtures.STREAM}.20240101.0.{i}.qcow2")
+            catalog.add(ImageRecord(commit=_sha(i),
+                                    version=f"{fixtures.STREAM}.20240101.0.{i}",
+                                    format=ImageFormat.QCOW,
+                                    location=location,
+                                    size=0,
+                                    digest=_sha(-i),
+                                    created=datetime.datetime.now(datetime.timezone.utc)))
+
+        catalog = ImageCatalog(workdir)
+        for i in range(images):
+            catalog.get(ImageFormat.QCOW, _sha(i))
+
+        return images
+
+    return run
+
+
+@benchmark("fingerprint.hash_tree")
+def hash_tree(workdir: pathlib.Path):
+    """Отпечаток дерева файлов подветки (файлов в секунду)"""
+    files = 2000
+    root = fixtures.file_tree(pathlib.Path(workdir, "tree"), files)
+
+    def run() -> int:
+        fingerprint.hash_tree(root)
+        return files
+
+    return run
+
+
+@benchmark("lru.evict")
+def lru_evict(workdir: pathlib.Path):
+    """Подсчет размера и вытеснение записей кэша"""
+    entries = 500
+
+    def run() -> int:
+        root = pathlib.Path(workdir, "cache")
+        for i in range(entries):
+            fixtures.file_tree(pathlib.Path(root, f"entry{i}"), 4, size=1024)
+        lru.evict(root, max_size=0)
+        return entries
+
+    return run
+
+
+@benchmark("compress.digest", repeat=3)
+def compress_digest(workdir: pathlib.Path):
+    """sha256 образа за один проход чтения (байт в секунду)"""
+    size = 256 * 1024 ** 2
+    image = pathlib.Path(workdir, "disk.raw")
+    with image.open("wb") as file:
+        for _ in range(size // (1024 ** 2)):
+            file.write(b"\0" * 1024 ** 2)
+
+    def run() -> int:
+        compression.digest_and_compress(image)
+        return size
+
+    return run
@@ -0,0 +1,168 @@
+"""
+Синтетические данные для замеров: заглушки сценариев и системных команд,
+ostree-репозиторий с длинной историей и каталоги образов.
+Ничего из этого не требует root и сети.
+"""
+from __future__ import annotations
+
+import contextlib
+import os
+import pathlib
+import stat
+import typing
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+
+OSNAME = "altcos"
+ARCH = "x86_64"
+STREAM = "sisyphus"
+
+# Каждый сценарий-заглушка ждет STUB_LATENCY секунд и печатает STUB_LINES строк
+_STUB_SCRIPT = """#!/usr/bin/env bash
+sleep "${STUB_LATENCY:-0}"
+if [ "${STUB_LINES:-0}" -gt 0 ]
+then
+    yes "$(basename "$0") stub output line" | head -n "$STUB_LINES"
+fi
+"""
+
+# sudo выполняет команду от текущего пользователя, chroot - на хосте без смены корня
+_STUB_BIN = {
+    "sudo": """#!/usr/bin/env bash
+while [[ "$1" == -* ]]; do shift; done
+exec "$@"
+""",
+    "chroot": """#!/usr/bin/env bash
+shift
+exec "$@"
+""",
+}
+
+
+def _write_executable(path: pathlib.Path, content: str) -> None:
+    path.write_text(content)
+    path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def stub_script_root(root: pathlib.Path) -> pathlib.Path:
+    """Каталог с заглушками всех cmd_*.sh репозитория"""
+    root.mkdir(parents=True, exist_ok=True)
+
+    for script in SCRIPTS_DIR.glob("cmd_*.sh"):
+        _write_executable(pathlib.Path(root, script.name), _STUB_SCRIPT)
+    pathlib.Path(root, "functions.sh").write_text("")
+
+    return root
+
+
+@contextlib.contextmanager
+def stub_bin(root: pathlib.Path) -> typing.Iterator[pathlib.Path]:
+    """
+    Каталог с заглушками sudo и chroot; добавляется в начало PATH на время блока.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+
+    for name, content in _STUB_BIN.items():
+        _write_executable(pathlib.Path(root, name), content)
+
+    path = os.environ["PATH"]
+    os.environ["PATH"] = f"{root}{os.pathsep}{path}"
+    try:
+        yield root
+    finally:
+        os.environ["PATH"] = path
+
+
+@contextlib.contextmanager
+def repository(workdir: pathlib.Path) -> typing.Iterator:
+    """Repository с заглушками сценариев и пустым stream_root; заглушки sudo и chroot в PATH на время блока"""
+    from acoslib import models
+
+    with stub_bin(pathlib.Path(workdir, "bin")):
+        yield models.Repository(OSNAME,
+                                root=workdir,
+                                stream_root=pathlib.Path(workdir, "streams"),
+                                script_root=stub_script_root(pathlib.Path(workdir, "scripts")),
+                                mkimage_root=pathlib.Path(workdir, "mkimage-profiles"))
+
+
+@contextlib.contextmanager
+def reference(workdir: pathlib.Path) -> typing.Iterator:
+    from acoslib import models
+    from acoslib.types import Arch, Stream
+
+    with repository(workdir) as repo:
+        yield models.Reference(repo, Arch.X86_64, Stream.SISYPHUS)
+
+
+def ostree_history(ref, commits: int) -> list[str]:
+    """
+    Создает bare-user репозиторий ветки с линейной историей из commits коммитов.
+    Каждый коммит меняет один файл, метаданные содержат версию.
+    """
+    import gi
+
+    gi.require_version("OSTree", "1.0")
+    from gi.repository import OSTree, Gio, GLib
+
+    ref.repo_dir.mkdir(parents=True, exist_ok=True)
+    repo = OSTree.Repo.new(Gio.File.new_for_path(str(ref.repo_dir)))
+    repo.create(OSTree.RepoMode.BARE_USER_ONLY, None)
+
+    checksums = []
+    parent = None
+
+    repo.prepare_transaction(None)
+    try:
+        for i in range(commits):
+            mtree = OSTree.MutableTree.new_from_commit(repo, parent) if parent else OSTree.MutableTree.new()
+
+            content = f"commit {i}\n".encode()
+            stream = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(content))
+            file_info = Gio.FileInfo.new()
+            file_info.set_file_type(Gio.FileType.REGULAR)
+            file_info.set_size(len(content))
+            file_info.set_attribute_uint32("unix::uid", os.getuid())
+            file_info.set_attribute_uint32("unix::gid", os.getgid())
+            file_info.set_attribute_uint32("unix::mode", 0o100644)
+
+            object_stream, length = OSTree.raw_file_to_content_stream(stream, file_info, None)
+            _, checksum = repo.write_content(None, object_stream, length, None)
+            mtree.replace_file("counter", checksum)
+
+            _, root = repo.write_mtree(mtree, None)
+            version = f"{STREAM}.20240101.0.{i}"
+            metadata = GLib.Variant("a{sv}", {"version": GLib.Variant("s", version)})
+            _, parent = repo.write_commit(parent, "", None, metadata, root, None)
+            checksums.append(parent)
+
+        repo.transaction_set_ref(None, str(ref.ostree_ref), parent)
+        repo.commit_transaction(None)
+    except BaseException:
+        repo.abort_transaction(None)
+        raise
+
+    return checksums
+
+
+def image_dir(root: pathlib.Path, fmt: str, count: int) -> pathlib.Path:
+    """Каталог формата образов с count пустыми файлами образов с возрастающим временем изменения"""
+    img_dir = pathlib.Path(root, fmt)
+    img_dir.mkdir(parents=True, exist_ok=True)
+
+    for i in range(count):
+        path = pathlib.Path(img_dir, f"{STREAM}.20240101.0.{i}.{fmt}")
+        path.touch()
+        os.utime(path, (i, i))
+
+    return img_dir
+
+
+def file_tree(root: pathlib.Path, files: int, size: int = 4096, per_dir: int = 100) -> pathlib.Path:
+    """Дерево из files файлов по size байт"""
+    for i in range(files):
+        path = pathlib.Path(root, f"d{i // per_dir}", f"f{i}")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(os.urandom(size))
+
+    return root
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import contextlib
+import importlib
+import inspect
+import json
+import os
+import pathlib
+import resource
+import statistics
+import tempfile
+import time
+import tracemalloc
+import typing
+
+# Допустимое замедление лучшего из повторов относительно базовой линии (доля)
+TOLERANCE = 0.25
+# Замедление меньше этого (секунд) считается шумом: у замеров в десятки миллисекунд
+# разброс между запусками больше TOLERANCE
+NOISE_FLOOR = 0.05
+
+BASELINE = pathlib.Path(__file__).with_name("baseline.json")
+
+
+class Result(typing.NamedTuple):
+    """
+    Результат замера.
+    children_rss_high_water - накопленный максимум RSS дочерних процессов с запуска раннера
+    (как у tracing.Span), а не пик этого замера.
+    """
+    name: str
+    ops: int
+    best: float
+    median: float
+    p95: float
+    throughput: float
+    peak_memory: int
+    children_rss_high_water: int
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
+class Benchmark(typing.NamedTuple):
+    """
+    Замер горячего пути библиотеки.
+    setup(workdir) готовит данные и возвращает замеряемую функцию, которая возвращает число выполненных операций.
+    Если окружение замера нужно вернуть после него (например, PATH с заглушками), setup - генератор:
+    он отдает замеряемую функцию через yield, а после yield восстанавливает окружение.
+    budget - абсолютный предел медианы в секундах, не зависящий от базовой линии.
+    """
+    name: str
+    setup: typing.Callable[[pathlib.Path], typing.Callable[[], int] | typing.Iterator[typing.Callable[[], int]]]
+    repeat: int
+    requires: tuple[str, ...]
+    budget: float | None
+
+
+BENCHMARKS: dict[str, Benchmark] = {}
+
+
+def benchmark(name: str,
+              repeat: int = 5,
+              requires: tuple[str, ...] = (),
+              budget: float | None = None) -> typing.Callable:
+    """Регистрирует замер; requires - модули, без которых замер пропускается (например, gi)"""
+
+    def decorator(setup: typing.Callable) -> typing.Callable:
+        BENCHMARKS[name] = Benchmark(name, setup, repeat, requires, budget)
+        return setup
+
+    return decorator
+
+
+def available(item: Benchmark) -> bool:
+    for module in item.requires:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            return False
+    return True
+
+
+def measure(item: Benchmark) -> Result:
+    """
+    Выполняет замер repeat раз и еще один раз под tracemalloc для оценки пиковой памяти
+    (tracemalloc замедляет Python-код, поэтому в замеры времени этот прогон не входит).
+    """
+    with tempfile.TemporaryDirectory(prefix=f"acoslib-bench-{item.name}-") as workdir, \
+            _setup(item, pathlib.Path(workdir)) as run:
+
+        timings = []
+        ops = 0
+        for _ in range(item.repeat):
+            start = time.perf_counter()
+            ops = run()
+            timings.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            run()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    timings.sort()
+    median = statistics.median(timings)
+    p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+    return Result(name=item.name,
+                  ops=ops,
+                  best=timings[0],
+                  median=median,
+                  p95=p95,
+                  throughput=ops / median if median else 0.0,
+                  peak_memory=peak_memory,
+                  children_rss_high_water=resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+
+def _setup(item: Benchmark, workdir: pathlib.Path) -> typing.ContextManager[typing.Callable[[], int]]:
+    if inspect.isgeneratorfunction(item.setup):
+        return contextlib.contextmanager(item.setup)(workdir)
+    return contextlib.nullcontext(item.setup(workdir))
+
+
+def load_baseline(path: str | os.PathLike = BASELINE) -> dict[str, dict]:
+    path = pathlib.Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def save_baseline(results: typing.Iterable[Result], path: str | os.PathLike = BASELINE) -> None:
+    """Обновляет базовую линию замеренных путей; линии остальных замеров сохраняются"""
+    baseline = load_baseline(path)
+    baseline.update({result.name: result.as_dict() for result in results})
+
+    path = pathlib.Path(path)
+    tmp_file = path.with_name(f".{path.name}.tmp")
+    tmp_file.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+    tmp_file.replace(path)
+
+
+def regressions(results: typing.Iterable[Result],
+                baseline: dict[str, dict],
+                tolerance: float = TOLERANCE,
+                floor: float = NOISE_FLOOR) -> list[tuple[Result, dict]]:
+    """
+    Замеры, лучший из повторов которых хуже базовой линии больше чем на tolerance и больше чем на floor секунд.
+    Лучший повтор меньше всего зависит от фоновой нагрузки; для линий без него сравнивается медиана.
+    """
+    regressed = []
+    for result in results:
+        if (base := baseline.get(result.name)) is None:
+            continue
+
+        base_time = base.get("best", base["median"])
+        if result.best > base_time * (1 + tolerance) and result.best - base_time > floor:
+            regressed.append((result, base))
+
+    return regressed
+
+
+def missing_baseline(results: typing.Iterable[Result], baseline: dict[str, dict]) -> list[Result]:
+    """Замеры без базовой линии: их регрессии не обнаруживаются, пока линия не записана на этом хосте"""
+    return [result for result in results if result.name not in baseline]
+
+
+def over_budget(results: typing.Iterable[Result]) -> list[tuple[Result, float]]:
+    """Замеры, медиана которых превышает абсолютный предел"""
+    return [(result, BENCHMARKS[result.name].budget) for result in results
+            if BENCHMARKS[result.name].budget is not None and result.median > BENCHMARKS[result.name].budget]
@@ -20,6 +20,7 @@ rpm_list_file=$2
 roots_path=$STREAMS_ROOT/$ref_dir/roots
 merged_dir=$roots_path/merged
 check_apt_dirs $merged_dir
+mount_pkg_sources $merged_dir
 
-sudo chroot $merged_dir apt-get dist-upgrade -y -o RPM::DBPath='/lib/rpm'
+with_pkg_cache sudo chroot $merged_dir apt-get dist-upgrade -y -o RPM::DBPath='/lib/rpm'
 sudo chroot $merged_dir rpm -qa --dbpath=/lib/rpm > $rpm_list_file
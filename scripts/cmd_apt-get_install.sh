@@ -20,5 +20,6 @@ rpms=$*
 roots_path="$STREAMS_ROOT/$ref_dir/roots"
 merge_dir="$roots_path/merged"
 check_apt_dirs "$merge_dir"
+mount_pkg_sources "$merge_dir"
 
-sudo chroot "$merge_dir" apt-get install -y -o RPM::DBPath='/lib/rpm/' $rpms
+with_pkg_cache sudo chroot "$merge_dir" apt-get install -y -o RPM::DBPath='/lib/rpm/' $rpms
@@ -20,10 +20,15 @@ ref_dir=$(ref_to_dir "$ref")
 roots_path="$STREAMS_ROOT/$ref_dir/roots"
 merge_dir="$roots_path/merged"
 check_apt_dirs "$merge_dir"
+mount_pkg_sources "$merge_dir"
 #sudo sed -i -e 's/#rpm \[alt\] http/rpm [alt] http/' "$merge_dir"/usr/etc/apt/sources.list.d/alt.list
+# With PKG_MIRROR_DIR the sources are shadowed by the mirror for the lifetime of the script (mount_pkg_sources)
+if [ -z "$PKG_MIRROR_DIR" ]
+then
 (echo 'rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/x86_64 classic'
 echo 'rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/noarch classic'
 echo 'rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/x86_64-i586 classic') | sudo tee -a "$merge_dir"/usr/etc/apt/sources.list.d/alt.list
+fi
 
 #cat <<EOF > "$merge_dir"/usr/etc/apt/sources.list.d/alt.list
 #rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/x86_64 classic
@@ -31,4 +36,6 @@ echo 'rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/x86_64-i586 classic')
 #rpm [alt] http://mirror.yandex.ru/altlinux Sisyphus/x86_64-i586 classic
 #EOF
 
-sudo chroot "$merge_dir" apt-get update -o RPM::DBPath='/lib/rpm/'
\ No newline at end of file
+sudo chroot "$merge_dir" apt-get update -o RPM::DBPath='/lib/rpm/' || exit 1
+# Freshness stamp checked by acoslib RPM.update
+sudo touch "$merge_dir"/var/lib/apt/lists/.acoslib-updated
@@ -0,0 +1,48 @@
+#!/usr/bin/env bash
+
+if [ -z "$SCRIPTS_ROOT" ]
+then
+    echo "Variable SCRIPTS_ROOT must be defined" && exit 1
+fi
+
+source "$SCRIPTS_ROOT"/functions.sh || exit 1
+
+if [ -z "$STREAMS_ROOT" ]
+then
+    echo "Variable STREAMS_ROOT must be defined" && exit 1
+fi
+
+check_commands "ostree"
+
+exec 2>&1
+
+# checkout <ref> <commit> <store_dir> - hardlink checkout of the commit into the shared checkout store
+# remove <store_dir> <commit> - remove the commit checkout from the store
+operation=$1
+
+case "$operation" in
+checkout)
+    ref=$2
+    commit_id=$3
+    store_dir=$4
+
+    ref_repo_dir=$(ref_repo_dir "$ref")
+    repo_bare_path="$STREAMS_ROOT/$ref_repo_dir/bare/repo"
+
+    [ -d "$store_dir/$commit_id" ] && exit 0
+    mkdir -m 0775 -p "$store_dir" || exit 1
+
+    tmp_dir="$store_dir/.$commit_id.$$"
+    sudo ostree checkout --repo "$repo_bare_path" "$commit_id" "$tmp_dir" || exit 1
+    sudo mv "$tmp_dir" "$store_dir/$commit_id"
+    ;;
+remove)
+    store_dir=$2
+    commit_id=$3
+
+    sudo rm -rf "${store_dir:?}/${commit_id:?}"
+    ;;
+*)
+    echo "Unknown operation $operation" && exit 1
+    ;;
+esac
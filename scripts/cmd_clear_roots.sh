@@ -19,7 +19,10 @@ ref_dir=$(ref_to_dir $ref)
 branch_path="$STREAMS_ROOT/$ref_dir"
 roots_dir="$branch_path/roots"
 
-cd $roots_dir
+cd $roots_dir || exit 0
+
+# The overlay may still be mounted after an update that produced no commit
+while sudo umount ./merged 2>/dev/null; do :; done
 
 mask="????????????????????????????????????????????????????????????????"
 
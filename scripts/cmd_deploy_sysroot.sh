@@ -0,0 +1,139 @@
+#!/usr/bin/env bash
+
+
+if [ -z "$SCRIPTS_ROOT" ]
+then
+    echo "Variable SCRIPTS_ROOT must be defined" && exit 1
+fi
+
+source "$SCRIPTS_ROOT"/functions.sh || exit 1
+
+if [ -z "$STREAMS_ROOT" ]
+then
+    echo "Variable STREAMS_ROOT must be defined" && exit 1
+fi
+
+check_commands "ostree" "grub-install" "parted" "losetup"
+
+# Size of the target disk; computed by acoslib from the commit content, 20GiB by default
+root_size=${ROOT_SIZE:-20GiB}
+
+exec 2>&1
+
+if [ $# -lt 3 ] || [ $# -gt 5 ]
+then
+	echo "Help: $0 <branch> <commitid> <raw_file> [<vardir>] [<directory of main ostree repository>]"
+	echo "Deploy the commit into a bootable sysroot on the raw disk image <raw_file>"
+	echo "For example: $0 altcos/x86_64/sisyphus ac24e /tmp/disk.raw"
+	echo "If <raw_file> ends with .qcow2 the sysroot is written straight into a qcow2 image through qemu-nbd"
+	exit 1
+fi
+
+if [ "$UID" != 0 ]
+then
+    echo "ERROR: $0 needs to be run as root (uid=0) only" && exit 1
+fi
+
+branch=$1
+branch_repo_dir=$(ref_repo_dir $branch)
+branch_repo=$STREAMS_ROOT/$branch_repo_dir
+main_repo=${5:-$branch_repo/bare/repo}
+if [ ! -d $main_repo ]
+then
+	echo "ERROR: ostree repository must exist"
+	exit 1
+fi
+ref_dir=$(ref_to_dir $branch)
+branch_dir=$STREAMS_ROOT/$ref_dir
+
+commit_id=$(full_commit_id $ref_dir $2)
+if [ -z "$commit_id" ]
+then
+  echo "ERROR: Commit $2 must exist"
+  exit 1
+fi
+var_dir=${4:-$branch_dir/vars/$commit_id/var}
+
+raw_file=$3
+
+os_name=alt-containeros
+NBD_LOCK=/run/acoslib-nbd.lock
+
+mount_dir=$(mktemp --tmpdir -d altcos_deploy_sysroot-XXXXXX)
+repo_local=$mount_dir/ostree/repo
+
+# Unmount the sysroot and detach the nbd/loop device on any exit; a failed deployment leaves no disk behind
+detach=
+function cleanup() {
+    local status=$?
+    mountpoint -q $mount_dir && umount $mount_dir
+    [ -n "$detach" ] && $detach
+    rmdir $mount_dir
+    [ $status != 0 ] && rm -f $raw_file
+    return $status
+}
+trap cleanup EXIT
+
+if [[ "$raw_file" == *.qcow2 ]]
+then
+    check_commands "qemu-img" "qemu-nbd"
+    modprobe nbd max_part=8
+    trace_phase deploy.disk qemu-img create -f qcow2 $raw_file $root_size || exit 1
+    # Parallel deployments pick a free device and connect it under one lock,
+    # otherwise two of them may see the same nbd as free and attach to it
+    exec 8>$NBD_LOCK
+    flock 8
+    loop_dev=
+    for dev in /sys/block/nbd*
+    do
+        if [ "$(cat $dev/size)" = 0 ]
+        then
+            loop_dev=/dev/$(basename $dev)
+            break
+        fi
+    done
+    if [ -z "$loop_dev" ]
+    then
+        echo "ERROR: no free nbd device" && exit 1
+    fi
+    # The qemu-nbd daemon must not inherit the lock descriptor
+    qemu-nbd --connect=$loop_dev $raw_file 8>&- || exit 1
+    detach="qemu-nbd --disconnect $loop_dev"
+    exec 8>&-
+else
+    # Sparse file: only the blocks written by the deployment take disk space
+    trace_phase deploy.disk truncate -s $root_size $raw_file
+    loop_dev=$(losetup --show -f $raw_file)
+    detach="losetup --detach $loop_dev"
+fi
+loop_part="$loop_dev"p1
+
+dd if=/dev/zero of=$loop_dev bs=1M count=3
+parted $loop_dev mktable msdos
+parted -a optimal $loop_dev mkpart primary ext4 2MIB 100%
+parted $loop_dev set 1 boot on
+trace_phase deploy.mkfs mkfs.ext4 -L boot $loop_part
+
+mount $loop_part $mount_dir
+ostree admin init-fs --modern $mount_dir
+trace_phase deploy.pull ostree pull-local --repo $repo_local $main_repo $commit_id
+trace_phase deploy.grub grub-install --target=i386-pc --root-directory=$mount_dir $loop_dev
+ln -s ../loader/grub.cfg $mount_dir/boot/grub/grub.cfg
+ostree config --repo $repo_local set sysroot.bootloader grub2
+ostree config --repo $repo_local set sysroot.readonly true
+ostree refs --repo $repo_local --create altcos:$branch $commit_id
+ostree admin os-init $os_name --sysroot $mount_dir
+
+OSTREE_BOOT_PARTITION="/boot" trace_phase deploy.deploy ostree admin deploy altcos:$branch --sysroot $mount_dir --os $os_name \
+	--karg-append=ignition.platform.id=qemu --karg-append=\$ignition_firstboot \
+	--karg-append=net.ifnames=0 --karg-append=biosdevname=0 \
+	--karg-append=rw \
+	--karg-append=quiet --karg-append=root=UUID=$(blkid --match-tag UUID -o value $loop_part)
+
+rm -rf $mount_dir/ostree/deploy/$os_name/var
+trace_phase deploy.var rsync -a $var_dir $mount_dir/ostree/deploy/$os_name/
+touch $mount_dir/ostree/deploy/$os_name/var/.ostree-selabeled
+
+touch $mount_dir/boot/ignition.firstboot
+
+echo $raw_file
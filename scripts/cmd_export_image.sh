@@ -0,0 +1,40 @@
+#!/usr/bin/env bash
+
+
+if [ -z "$SCRIPTS_ROOT" ]
+then
+    echo "Variable SCRIPTS_ROOT must be defined" && exit 1
+fi
+
+source "$SCRIPTS_ROOT"/functions.sh || exit 1
+
+exec 2>&1
+
+if [ $# -ne 3 ]
+then
+	echo "Help: $0 <format> <raw_file> <out_file>"
+	echo "Export the deployed raw disk image (see cmd_deploy_sysroot.sh) to the given format"
+	echo "For example: $0 qcow2 /tmp/disk.raw out/1.qcow2"
+	exit 1
+fi
+
+format=$1
+raw_file=$2
+out_file=$3
+tmp_file="$out_file.$$"
+
+case "$format" in
+qcow2)
+    check_commands "qemu-img"
+    qemu-img convert -O qcow2 "$raw_file" "$tmp_file" || exit 1
+    ;;
+raw)
+    cp --sparse=always "$raw_file" "$tmp_file" || exit 1
+    ;;
+*)
+    echo "ERROR: unsupported image format $format" && exit 1
+    ;;
+esac
+
+mv "$tmp_file" "$out_file"
+echo "$out_file"
@@ -0,0 +1,65 @@
+#!/usr/bin/env bash
+
+if [ -z "$SCRIPTS_ROOT" ]
+then
+    echo "Variable SCRIPTS_ROOT must be defined" && exit 1
+fi
+
+source "$SCRIPTS_ROOT"/functions.sh || exit 1
+
+if [ -z "$STREAMS_ROOT" ]
+then
+    echo "Variable STREAMS_ROOT must be defined" && exit 1
+fi
+
+exec 2>&1
+
+# save <ref> <archive> [<base_snapshot>] - save the changes of the overlay upper layer of the ref since
+#   <base_snapshot> (all of it without one) into the incremental archive; the snapshot of the saved state is
+#   written next to the archive (<archive> with .snar suffix) and serves as the base of the next layer
+# restore <ref> <archive>... - replace the overlay upper layer of the ref with the archives applied in order
+operation=$1
+ref=$2
+shift 2
+
+ref_dir=$(ref_to_dir "$ref")
+roots_path="$STREAMS_ROOT/$ref_dir/roots"
+
+cd "$roots_path" || exit 1
+
+case "$operation" in
+save)
+    archive=$1
+    base_snapshot=$2
+    snapshot="${archive%.tar}.snar"
+
+    if [ -n "$base_snapshot" ]
+    then
+        sudo cp "$base_snapshot" "$snapshot.$$" || exit 1
+    else
+        sudo rm -f "$snapshot.$$"
+    fi
+
+    sudo tar --xattrs --acls --listed-incremental="$snapshot.$$" -cpf "$archive.$$" -C upper . || exit 1
+    sudo mv "$snapshot.$$" "$snapshot"
+    sudo mv "$archive.$$" "$archive"
+    ;;
+restore)
+    lower_dir=$(readlink root)
+
+    while sudo umount ./merged; do :; done
+
+    sudo rm -rf upper work
+    sudo mkdir upper work
+    # Extraction with --listed-incremental also removes files deleted by the layer
+    for archive in "$@"
+    do
+        sudo tar --xattrs --acls --listed-incremental=/dev/null -xpf "$archive" -C upper || exit 1
+    done
+
+    sudo mount -t overlay overlay -o lowerdir="$lower_dir",upperdir=./upper,workdir=./work ./merged
+    ;;
+*)
+    echo "Unknown operation $operation" && exit 1
+    ;;
+esac
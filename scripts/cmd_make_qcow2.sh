@@ -15,8 +15,6 @@ fi
 
 check_commands "qemu-img" "ostree"
 
-root_size=20GiB
-
 exec 2>&1
 
 if [ $# -gt 4 ]
@@ -54,7 +52,7 @@ fi
 short_commit_id=$2
 if [ -z $short_commit_id ]
 then
-  commit_id=$(last_commit_id $ref_dir)
+  commit_id=$(last_commit_id $ref_dir $branch $main_repo)
   var_dir=$branch_repo/vars/$commit_id/var
 else
   if [[ "$short_commit_id" == */* ]] # It's var_dir
@@ -90,49 +88,10 @@ then
   out_file="$out_dir/$out_filename.qcow2"
 fi
 
-os_name=alt-containeros
-
-mount_dir=$(mktemp --tmpdir -d altcos_make_qcow2-XXXXXX)
-repo_local=$mount_dir/ostree/repo
 raw_file=$(mktemp --tmpdir altcos_make_qcow2-XXXXXX.raw)
 
-fallocate -l $root_size $raw_file
-
-loop_dev=$(losetup --show -f $raw_file)
-loop_part="$loop_dev"p1
-
-dd if=/dev/zero of=$loop_dev bs=1M count=3
-parted $loop_dev mktable msdos
-parted -a optimal $loop_dev mkpart primary ext4 2MIB 100%
-parted $loop_dev set 1 boot on
-mkfs.ext4 -L boot $loop_part
-
-mount $loop_part $mount_dir
-ostree admin init-fs --modern $mount_dir
-ostree pull-local --repo $repo_local $main_repo $commit_id
-grub-install --target=i386-pc --root-directory=$mount_dir $loop_dev
-ln -s ../loader/grub.cfg $mount_dir/boot/grub/grub.cfg
-ostree config --repo $repo_local set sysroot.bootloader grub2
-ostree config --repo $repo_local set sysroot.readonly true
-ostree refs --repo $repo_local --create altcos:$branch $commit_id
-ostree admin os-init $os_name --sysroot $mount_dir
-
-OSTREE_BOOT_PARTITION="/boot" ostree admin deploy altcos:$branch --sysroot $mount_dir --os $os_name \
-	--karg-append=ignition.platform.id=qemu --karg-append=\$ignition_firstboot \
-	--karg-append=net.ifnames=0 --karg-append=biosdevname=0 \
-	--karg-append=rw \
-	--karg-append=quiet --karg-append=root=UUID=$(blkid --match-tag UUID -o value $loop_part)
-
-rm -rf $mount_dir/ostree/deploy/$os_name/var
-rsync -av $var_dir $mount_dir/ostree/deploy/$os_name/
-touch $mount_dir/ostree/deploy/$os_name/var/.ostree-selabeled
-
-touch $mount_dir/boot/ignition.firstboot
-
-umount $mount_dir
-rm -rf $mount_dir
-losetup --detach "$loop_dev"
-qemu-img convert -O qcow2 $raw_file $out_file
+trace_phase make_qcow2.deploy "$SCRIPTS_ROOT"/cmd_deploy_sysroot.sh $branch $commit_id $raw_file $var_dir $main_repo || exit 1
+trace_phase make_qcow2.export "$SCRIPTS_ROOT"/cmd_export_image.sh qcow2 $raw_file $out_file || exit 1
 rm $raw_file
 
 echo $out_file
@@ -52,7 +52,12 @@ fi
 sudo mkdir -p "$roots_path" || exit 1
 cd "$roots_path" || exit 1
 
-if [ ! -d "$last_commit_id" ]
+# CHECKOUT_STORE: the commit is already checked out into the shared store (cmd_checkout_store.sh)
+if [ -n "$CHECKOUT_STORE" ]
+then
+    sudo rm -rf "$last_commit_id"
+    sudo ln -sfn "$CHECKOUT_STORE/$last_commit_id" "$last_commit_id"
+elif [ ! -d "$last_commit_id" ]
 then
     sudo ostree checkout --repo "$repo_bare_path" "$last_commit_id"
 fi
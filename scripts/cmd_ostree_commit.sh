@@ -26,31 +26,52 @@ version=$(ref_version "$ref" "$commit_id")
 next_version=$3
 next_version_var_subdir=$(version_var_subdir "$next_version")
 
+fingerprint=$4
+
+# COMMIT_TREE=upper: commit only roots/upper on top of $commit_id (see acoslib/ostreecommit.py)
+tree=${COMMIT_TREE:-root}
+
 repo_bare_path="$STREAMS_ROOT/$ref_repo_dir/bare/repo"
 ref_dir="$STREAMS_ROOT/$ref_dir"
 roots_path="$ref_dir/roots"
 vars_path="$ref_dir/vars"
 
-add_metadata=
+add_metadata=()
 if ! is_base_ref "$ref"
 then
     altcos_file="$ref_dir/altconf.yml"
 
-    add_metadata=" --add-metadata-string=parent_commit_id=$commit_id"
-    add_metadata="$add_metadata --add-metadata-string=parent_version=$version"
+    add_metadata+=("--add-metadata-string=parent_commit_id=$commit_id")
+    add_metadata+=("--add-metadata-string=parent_version=$version")
     altcos_file_mt=$(date -r "$altcos_file" +%s 2>/dev/null)
-    add_metadata="$add_metadata --add-metadata-string=altcos_file_mt=$altcos_file_mt"
+    add_metadata+=("--add-metadata-string=altcos_file_mt=$altcos_file_mt")
+fi
+
+if [ -n "$fingerprint" ]
+then
+    add_metadata+=("--add-metadata-string=altcos_fingerprint=$fingerprint")
 fi
 
 cd "$roots_path" || exit 1
-new_commit_id=$(sudo ostree commit \
-            --repo="$repo_bare_path" \
-            --tree=dir="$commit_id" \
-            -b "$ref" \
-            --no-bindings \
-            --mode-ro-executables \
-            "$add_metadata" \
-            --add-metadata-string=version="$next_version") || exit 1
+if [ "$tree" = upper ]
+then
+    new_commit_id=$(sudo env PYTHONPATH="$ACOSLIB_ROOT" "${PYTHON:-python3}" -m acoslib.ostreecommit \
+                --repo="$repo_bare_path" \
+                --branch="$ref" \
+                --parent="$commit_id" \
+                --tree=upper \
+                "${add_metadata[@]}" \
+                --add-metadata-string=version="$next_version") || exit 1
+else
+    new_commit_id=$(sudo ostree commit \
+                --repo="$repo_bare_path" \
+                --tree=dir="$commit_id" \
+                -b "$ref" \
+                --no-bindings \
+                --mode-ro-executables \
+                "${add_metadata[@]}" \
+                --add-metadata-string=version="$next_version") || exit 1
+fi
 
 sudo ostree summary --repo="$repo_bare_path" --update
 
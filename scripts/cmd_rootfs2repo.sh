@@ -41,8 +41,12 @@ then
 	exit 1
 fi
 
+# VERSION_MAJOR is allocated by acoslib from the ref's version registry
 data_dir=$out_dir/$version_date
-if [[ -d "$data_dir" && -n "$(ls -1 "$data_dir" 2>/dev/null)" ]]
+if [ -n "$VERSION_MAJOR" ]
+then
+  major=$VERSION_MAJOR
+elif [[ -d "$data_dir" && -n "$(ls -1 "$data_dir" 2>/dev/null)" ]]
 then
   let major=$(ls -1 "$data_dir" 2>/dev/null | sort -n | tail -1)+1
 else
@@ -20,21 +20,55 @@ then
     sudo mkdir -p "$docker_images_dir"
 fi
 
+# Image sources: docker://<registry>/<name>:<tag> or oci:<layout dir>:<name>:<tag> (local OCI layout);
+# plain <name>:<tag> means docker://
+#
+# IMAGE_CACHE: content-addressed cache shared by all subrefs
+#   blobs/                      - OCI blobs, every layer is fetched once
+#   archives/<digest>-<name>.xz - ready docker-archive of the image, memoized by its manifest digest
 tmpfile="/tmp/skopeo.$$"
 for image
 do
-    archive_file=$(echo $image | tr '/' '_' | tr ':' '_')
+    case "$image" in
+    docker://*) src=$image; tag=${image#docker://} ;;
+    oci:*) src=$image; tag=${image#oci:}; tag=${tag#*:} ;;
+    *) src=docker://$image; tag=$image ;;
+    esac
+
+    archive_file=$(echo $tag | tr '/' '_' | tr ':' '_')
     archive_file=$docker_images_dir/$archive_file
     sudo rm -rf "$archive_file"
 
     xzfile="$archive_file.xz"
-    if [ ! -f "$xzfile" ]
+    if [ -n "$IMAGE_CACHE" ]
+    then
+        digest=$(sudo skopeo inspect --format '{{.Digest}}' "$src") || exit 1
+        digest=${digest#sha256:}
+        cached="$IMAGE_CACHE/archives/$digest-$(basename "$archive_file").xz"
+
+        if [ ! -f "$cached" ]
+        then
+            mkdir -m 0775 -p "$IMAGE_CACHE/blobs" "$IMAGE_CACHE/archives"
+            layout="$IMAGE_CACHE/.oci-$digest.$$"
+            tmp_archive="$IMAGE_CACHE/archives/.$digest.$$"
+
+            sudo skopeo copy --dest-shared-blob-dir "$IMAGE_CACHE/blobs" "$src" "oci:$layout:image" || exit 1
+            sudo skopeo copy --src-shared-blob-dir "$IMAGE_CACHE/blobs" --additional-tag="$tag" \
+                "oci:$layout:image" "docker-archive:$tmp_archive" || exit 1
+            sudo rm -rf "$layout"
+
+            sudo xz -9 -T0 "$tmp_archive" || exit 1
+            sudo mv "$tmp_archive.xz" "$cached"
+        fi
+
+        sudo cp "$cached" "$xzfile" || exit 1
+    elif [ ! -f "$xzfile" ]
     then
         >$tmpfile
         until grep manifest $tmpfile
         do
             sudo rm -f "$archive_file"
-            sudo skopeo copy --additional-tag=$image docker://$image docker-archive:$archive_file  2>&1 | tee $tmpfile
+            sudo skopeo copy --additional-tag=$tag $src docker-archive:$archive_file  2>&1 | tee $tmpfile
         done
         sudo xz -9 "$archive_file"
     fi
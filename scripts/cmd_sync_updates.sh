@@ -17,6 +17,8 @@ ref=$1
 ref_dir=$(ref_to_dir "$ref")
 commit_id=$2
 version=$3
+# upper: leave changes (whiteouts included) in roots/upper for an incremental commit
+tree=${4:-root}
 
 version_var_subdir=$(version_var_subdir $version)
 branch_path="$STREAMS_ROOT/$ref_dir"
@@ -25,9 +27,19 @@ commit_path="$roots_path/root"
 var_dir="$branch_path/vars/$version_var_subdir"
 
 cd "$roots_path" || exit 1
+
+if [ "$tree" != upper ] && [ -L "$commit_id" ]
+then
+    # The checkout is shared through the checkout store: copy changes into a private hardlinked copy
+    store_path=$(readlink -f "$commit_id")
+    sudo rm -f "$commit_id"
+    sudo cp -al "$store_path" "$commit_id" || exit 1
+fi
+
 sudo du -s upper
 sudo du -s root
-sudo rm -f ./upper/etc ./root/etc
+sudo rm -f ./upper/etc
+[ "$tree" = upper ] || sudo rm -f ./root/etc
 
 sudo mkdir --mode=0775 -p "$var_dir"
 cd upper || exit 1
@@ -40,6 +52,14 @@ sudo rsync -avd lib/rpm usr/share
 sudo rm -rf ./var ./run
 sudo mkdir ./var
 
+if [ "$tree" = upper ]
+then
+    cd ..
+    sudo du -s upper
+    sudo umount merged
+    exit 0
+fi
+
 delete=$(sudo find . -type c)
 sudo rm -rf "$delete"
 
@@ -17,11 +17,19 @@ exec 2>&1
 ref=$1
 ref_dir=$(ref_to_dir $ref)
 
-# rpm_list_file=$2
+rpm_list_file=$2
 roots_path="$STREAMS_ROOT/$ref_dir/roots";
 merged_dir=$roots_path/merged
+check_apt_dirs $merged_dir
+mount_pkg_sources $merged_dir
 sudo chroot $merged_dir rm -rf /var/lib/rpm
 sudo chroot $merged_dir ln -sf /lib/rpm/ /var/lib/
-sudo chroot $merged_dir apt-get install -y update-kernel
-sudo chroot $merged_dir update-kernel -y
-sudo chroot $merged_dir apt-get remove -y update-kernel
+with_pkg_cache sudo chroot $merged_dir apt-get install -y update-kernel
+with_pkg_cache sudo chroot $merged_dir update-kernel -y
+with_pkg_cache sudo chroot $merged_dir apt-get remove -y update-kernel
+
+# Package set after the kernel update (acoslib compares its digest with the head commit)
+if [ -n "$rpm_list_file" ]
+then
+    sudo chroot $merged_dir rpm -qa --dbpath=/lib/rpm > $rpm_list_file
+fi
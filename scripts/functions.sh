@@ -90,6 +90,20 @@ function version_var_subdir() {
     echo "$date/$major/$minor"
 }
 
+# Query the commit index (commits.db) maintained by acoslib.
+# Prints nothing when the index or sqlite3 is unavailable.
+function commit_index_query() {
+    ref_dir=$1
+    query=$2
+
+    index_file=$STREAMS_ROOT/$ref_dir/commits.db
+
+    if [ -f "$index_file" ] && command -v sqlite3 &> /dev/null
+    then
+        sqlite3 -readonly "$index_file" "$query" 2>/dev/null
+    fi
+}
+
 function full_commit_id() {
     if [ -z "$STREAMS_ROOT" ]
     then
@@ -98,13 +112,20 @@ function full_commit_id() {
 
     (
     ref_dir=$1
-    short_commit_id=$2
+    short_commit_id=$(echo "$2" | tr -cd '[:xdigit:]' | tr '[:upper:]' '[:lower:]')
+
+    ids=$(commit_index_query "$ref_dir" \
+        "SELECT sha256 FROM commits WHERE sha256 >= '$short_commit_id' AND sha256 < '$short_commit_id~' LIMIT 2")
 
-    var_dir=$STREAMS_ROOT/$ref_dir/vars
-    cd "$var_dir" || exit 1
+    if [ -z "$ids" ]
+    then
+        var_dir=$STREAMS_ROOT/$ref_dir/vars
+        cd "$var_dir" || exit 1
+
+        ids=$(ls -1dr "$short_commit_id"* 2>/dev/null)
+    fi
 
-    ids=$(ls -1dr "$short_commit_id"*)
-    set -- "$ids"
+    set -- $ids
 
     if [ $# = 0 ]
     then
@@ -122,6 +143,11 @@ function full_commit_id() {
     )
 }
 
+# last_commit_id <ref_dir> [<ref>] [<repo>]
+# The index may lag behind commits made outside acoslib, so its head is checked against the ostree ref.
+# <ref> is the branch name as is (altcos/x86_64/Sisyphus/apache): ref_dir is lowercased and does not name
+# the branch, so without <ref> only the index is consulted.
+# ostree dates have one-second resolution; commits of the same second are ordered by their version.
 function last_commit_id() {
     (
     ref_dir=$1
@@ -131,10 +157,36 @@ function last_commit_id() {
         echo "Variable STREAMS_ROOT must be defined" || exit 1
     fi
 
-    cd "$STREAMS_ROOT/$ref_dir/vars" && exit 1
+    ref=$2
+    repo=${3:-$STREAMS_ROOT/$(ref_repo_dir "$ref_dir")/bare/repo}
+
+    head=""
+    if [ -n "$ref" ] && command -v ostree &> /dev/null
+    then
+        head=$(ostree rev-parse --repo="$repo" "$ref" 2>/dev/null)
+    fi
+
+    commit_id=$(commit_index_query "$ref_dir" \
+        "SELECT commits.sha256 FROM commits LEFT JOIN versions ON versions.sha256 = commits.sha256
+         ORDER BY commits.date DESC, versions.date DESC, versions.major DESC, versions.minor DESC LIMIT 1")
+    if [ -n "$head" ]
+    then
+        if [ -n "$commit_id" ] && [ "$commit_id" != "$head" ]
+        then
+            echo "Commit index of $ref_dir is stale ($commit_id), using ostree head $head" >&2
+        fi
+        echo "$head" && return
+    fi
+
+    if [ -n "$commit_id" ]
+    then
+        echo "$commit_id" && return
+    fi
+
+    cd "$STREAMS_ROOT/$ref_dir/vars" || exit 1
 
     mask="????????????????????????????????????????????????????????????????"
-    commit_id=$(ls -1tdr "$mask" | tail -1) && echo "$commit_id"
+    commit_id=$(ls -1tdr $mask | tail -1) && echo "$commit_id"
     )
 }
 
@@ -155,10 +207,16 @@ function ref_version() {
 
     (
     ref=$1
-    commit_id=$2
-    ref_repo_dir=$(ref_repo_dir "$ref")
-    repo_bare_path="$STREAMS_ROOT/$ref_repo_dir/bare/repo"
-    ret=$(ostree --repo="$repo_bare_path" show "$commit_id" --print-metadata-key=version | tr -d "'")
+    commit_id=$(echo "$2" | tr -cd '[:xdigit:]' | tr '[:upper:]' '[:lower:]')
+    ref_dir=$(ref_to_dir "$ref")
+
+    ret=$(commit_index_query "$ref_dir" "SELECT version FROM versions WHERE sha256 = '$commit_id'")
+    if [ -z "$ret" ]
+    then
+        ref_repo_dir=$(ref_repo_dir "$ref")
+        repo_bare_path="$STREAMS_ROOT/$ref_repo_dir/bare/repo"
+        ret=$(ostree --repo="$repo_bare_path" show "$commit_id" --print-metadata-key=version | tr -d "'")
+    fi
     echo "$ret"
     )
 }
@@ -184,6 +242,79 @@ function check_apt_dirs() {
     sudo chown root:rpm "$root_dir"/var/cache/apt/
 }
 
+# Shared package cache and local mirror for apt inside a ref chroot.
+# PKG_CACHE_DIR - directory bind-mounted over var/cache/apt/archives of the chroot
+# PKG_MIRROR_DIR - local apt repository bind-mounted (read-only) at /run/acoslib-mirror of the chroot;
+#   apt sources of the chroot are shadowed by a tmpfs listing only the mirror, so the image keeps its own sources
+# The cache is locked shared for the lifetime of the calling script (acoslib evicts it under an exclusive lock),
+# mounts are removed on exit.
+PKG_MIRROR_MOUNT=/run/acoslib-mirror
+
+function mount_pkg_sources() {
+    root_dir=$1
+    pkg_mounts=()
+
+    if [ -n "$PKG_CACHE_DIR" ]
+    then
+        mkdir -p "$PKG_CACHE_DIR/partial" || exit 1
+        exec 9>"$PKG_CACHE_DIR/.lock"
+        flock -s 9
+
+        sudo mount --bind "$PKG_CACHE_DIR" "$root_dir/var/cache/apt/archives" || exit 1
+        pkg_mounts+=("$root_dir/var/cache/apt/archives")
+    fi
+
+    if [ -n "$PKG_MIRROR_DIR" ]
+    then
+        sudo mkdir -p "$root_dir$PKG_MIRROR_MOUNT"
+        sudo mount --bind -o ro "$PKG_MIRROR_DIR" "$root_dir$PKG_MIRROR_MOUNT" || exit 1
+        pkg_mounts+=("$root_dir$PKG_MIRROR_MOUNT")
+
+        sources_dir="$root_dir/usr/etc/apt/sources.list.d"
+        sudo mount -t tmpfs -o mode=0755 acoslib-sources "$sources_dir" || exit 1
+        pkg_mounts+=("$sources_dir")
+        pkg_mirror_sources | sudo tee "$sources_dir/alt.list" > /dev/null
+    fi
+
+    trap umount_pkg_sources EXIT
+}
+
+# Run an apt transaction that uses the shared cache.
+# apt locks archives/lock for the whole transaction and fails instead of waiting when another chroot holds it,
+# so transactions take turns on .apt.lock; apt-get update and the rest of the scripts run concurrently.
+function with_pkg_cache() {
+    if [ -n "$PKG_CACHE_DIR" ]
+    then
+        flock "$PKG_CACHE_DIR/.apt.lock" "$@"
+    else
+        "$@"
+    fi
+}
+
+function umount_pkg_sources() {
+    for mount_point in "${pkg_mounts[@]}"
+    do
+        sudo umount "$mount_point"
+    done
+    pkg_mounts=()
+}
+
+# Print apt sources for the local mirror.
+# A mirror with generated indexes (<arch>/base) is used as is,
+# a plain directory of packages (<arch>/RPMS.classic) is read through rpm-dir.
+function pkg_mirror_sources() {
+    for arch in x86_64 noarch
+    do
+        if [ -d "$PKG_MIRROR_DIR/$arch/base" ]
+        then
+            echo "rpm file:$PKG_MIRROR_MOUNT $arch classic"
+        elif [ -d "$PKG_MIRROR_DIR/$arch" ]
+        then
+            echo "rpm-dir file:$PKG_MIRROR_MOUNT $arch classic"
+        fi
+    done
+}
+
 function check_commands() {
     for arg in "${@}"
     do
@@ -194,3 +325,22 @@ function check_commands() {
         fi
     done
 }
+
+# Run a command as a named build phase.
+# With ACOSLIB_TRACE_FILE set (acoslib.tracing) the phase timing is appended there as a JSON line.
+function trace_phase() {
+    local name=$1 start end rc
+    shift
+
+    start=$(date +%s.%N)
+    "$@"
+    rc=$?
+    end=$(date +%s.%N)
+
+    if [ -n "$ACOSLIB_TRACE_FILE" ]
+    then
+        printf '{"name": "%s", "start": %s, "end": %s, "returncode": %d}\n' \
+            "$name" "$start" "$end" "$rc" >> "$ACOSLIB_TRACE_FILE"
+    fi
+    return $rc
+}
@@ -0,0 +1,50 @@
+"""
+Время запуска: импорт acoslib и запросы CLI, не трогающие репозиторий, не загружают libostree (gi)
+и укладываются в STARTUP_BUDGET (cron и сценарии вызывают CLI сотни раз в день).
+"""
+from __future__ import annotations
+
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+import pytest
+
+from benchmarks.bench_startup import STARTUP_BUDGET
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+# Лучший из нескольких запусков меньше зависит от фоновой нагрузки
+RUNS = 3
+
+
+def _best_time(*args: str) -> tuple[float, subprocess.CompletedProcess]:
+    env = {**os.environ, "PYTHONPATH": str(ROOT)}
+
+    best, proc = None, None
+    for _ in range(RUNS):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, proc
+
+
+@pytest.mark.parametrize("module", ["acoslib", "acoslib.models", "acoslib.cli"])
+def test_import_does_not_load_gi(module: str) -> None:
+    _, proc = _best_time("-c", f"import sys, {module}; print('gi' in sys.modules)")
+    assert proc.stdout.strip() == "False"
+
+
+def test_import_within_budget() -> None:
+    elapsed, _ = _best_time("-c", "import acoslib.models")
+    assert elapsed < STARTUP_BUDGET, f"import acoslib.models took {elapsed:.3f}s > {STARTUP_BUDGET}s"
+
+
+def test_cli_help_within_budget() -> None:
+    elapsed, proc = _best_time("-m", "acoslib", "--help")
+    assert "usage" in proc.stdout
+    assert elapsed < STARTUP_BUDGET, f"python -m acoslib --help took {elapsed:.3f}s > {STARTUP_BUDGET}s"